@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+#
+# ################
+# abstrys.__main__
+# ################
+#
+# A single entry point for the command-line tools, run as::
+#
+#  python -m abstrys db <rst2db arguments>
+#  python -m abstrys md <rst2md arguments>
+#  python -m abstrys all <arguments>
+#  python -m abstrys serve <server arguments>
+#  python -m abstrys client <client arguments>
+#
+# Only the tool that's asked for is imported, and the tools themselves only
+# load docutils and the writers once there's something to convert, so that
+# commands like ``python -m abstrys db -h`` start quickly.
+#
+# by Eron Hennessey
+#
+
+import sys
+
+from abstrys.common import printerr
+
+# the subcommands, and the modules that run them.
+COMMANDS = {'db': 'abstrys.cmd_rst2db',
+            'md': 'abstrys.cmd_rst2md',
+            'all': 'abstrys.cmd_rst2all',
+            'serve': 'abstrys.server',
+            'client': 'abstrys.client'}
+
+USAGE = """
+abstrys - convert reStructuredText to DocBook or Markdown
+
+**Usage:**
+
+:
+python -m abstrys db <rst2db arguments>
+
+python -m abstrys md <rst2md arguments>
+
+python -m abstrys all <arguments>   (DocBook and Markdown at once)
+
+python -m abstrys serve <server arguments>
+
+python -m abstrys client <client arguments>
+
+Use -h after any of the commands (for example, ``python -m abstrys db -h``)
+to see its arguments.
+        """
+
+
+def print_usage_and_exit(return_code=0):
+    print(USAGE)
+    sys.exit(return_code)
+
+
+def main():
+    if len(sys.argv) < 2:
+        print_usage_and_exit(1)
+    if sys.argv[1] in ('-h', '-?'):
+        print_usage_and_exit()
+    if sys.argv[1] not in COMMANDS:
+        printerr("Unknown command: %s" % sys.argv[1])
+        print_usage_and_exit(1)
+    module_name = COMMANDS[sys.argv[1]]
+    # the tools read their arguments from sys.argv, as if they'd been run on
+    # their own.
+    sys.argv = [module_name] + sys.argv[2:]
+    __import__(module_name)
+    sys.modules[module_name].run()
+
+
+if __name__ == "__main__":
+    main()
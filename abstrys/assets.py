@@ -0,0 +1,298 @@
+# -*- coding: utf-8 -*-
+#
+# ##############
+# abstrys.assets
+# ##############
+#
+# Copies the images referenced by converted documents into the output tree.
+# Each image is stored once, in a single directory, named by a hash of its
+# contents: an image referenced from many documents, or saved under many
+# names, is only copied once, and an image whose copy is already there isn't
+# copied again.
+#
+# Images are hashed as the documents are translated, since the name of each
+# copy is written into the output. The copying is done by a pool of threads
+# while translation goes on. When documents are translated by worker
+# processes, the workers only hash the images; the copies they need, and the
+# hashes, are handed back to the main process's copier, so that an image used
+# by several workers is copied once, and the hashes are saved.
+#
+# by Eron Hennessey
+#
+
+# json, shutil, threading and the thread pool are imported by the functions
+# that use them, so that loading this module doesn't slow down the
+# command-line tools when images aren't being copied.
+import os
+import re
+
+from abstrys.cache import file_digest
+
+
+# The directory that images are copied to, beneath the output directory, if
+# no other is given.
+DEFAULT_IMAGE_DIR = '_images'
+
+# The number of threads copying images.
+DEFAULT_THREADS = 4
+
+# The number of characters of each image's hash used to name its copy.
+HASH_LENGTH = 20
+
+# URIs that start with a scheme (such as http: or data:) or a host.
+_EXTERNAL_URI = re.compile(r'^([a-zA-Z][a-zA-Z0-9+.-]*:|//)')
+
+
+def parse_copy_images_option(arg, params):
+    """Handles the --copy-images[=image_dir] command-line option, setting the
+    matching params. Returns False if arg isn't that option."""
+    (name, sep, value) = arg[2:].partition('=')
+    if name != 'copy-images':
+        return False
+    params['copy_images'] = True
+    if value:
+        params['image_dir'] = value
+    return True
+
+
+def get_image_dir(params):
+    """Returns the directory that images are copied to, or None if they
+    aren't: the directory given with --copy-images, or DEFAULT_IMAGE_DIR in
+    the output directory (or beside the output file)."""
+    if not params.get('copy_images'):
+        return None
+    if params.get('image_dir') != None:
+        return params['image_dir']
+    if params.get('output_dir') != None:
+        return os.path.join(params['output_dir'], DEFAULT_IMAGE_DIR)
+    output_filename = params.get('output_filename')
+    return os.path.join(os.path.dirname(output_filename or ''),
+                        DEFAULT_IMAGE_DIR)
+
+
+def is_external_uri(uri):
+    """Returns True if uri refers to something other than a local file."""
+    return _EXTERNAL_URI.match(uri) is not None
+
+
+def get_relative_uri(path, start):
+    """Returns the URI of the file at path relative to the directory start
+    ('' for the current directory)."""
+    return os.path.relpath(path, start or os.curdir).replace(os.sep, '/')
+
+
+def _copy_file(source, target):
+    """Copies source to target by way of a temporary file beside it, so that
+    a copy that's cut short (or that's being made by another process) is
+    never taken for a complete one."""
+    import shutil
+    import threading
+    temp = '%s.%d-%d.tmp' % (target, os.getpid(),
+                             threading.current_thread().ident)
+    shutil.copyfile(source, temp)
+    try:
+        os.rename(temp, target)
+    except OSError:
+        # on Windows, the target can't be replaced; it's already there.
+        os.remove(temp)
+        if not os.path.exists(target):
+            raise
+
+
+class AssetCopier(object):
+    """Copies images into output_dir, naming each copy by a hash of its
+    contents.
+
+    If digest_cache_filename is given, the hash of each image is kept in it,
+    with the image's size and modification time, so that unchanged images
+    aren't read again by the next run."""
+
+    def __init__(self, output_dir, digest_cache_filename=None,
+                 threads=DEFAULT_THREADS):
+        self.output_dir = output_dir
+        self.digest_cache_filename = digest_cache_filename
+        self.threads = threads
+        # the [mtime, size, digest] of each image, by absolute path.
+        self.digests = self._read_digests()
+        self.digests_changed = False
+        # the entries added to the digests since take_deferred() was last
+        # called, and the (path, name) of each copy needed, when the copies
+        # are deferred.
+        self.new_digests = {}
+        self.deferred = None
+        # the name of the copy of each image, by absolute path, and the
+        # names of the copies made (or found to be there already).
+        self.copies = {}
+        self.copy_names = set()
+        # the number of images copied.
+        self.copy_count = 0
+        # the thread pool, made when the first copy is needed, and the
+        # (source, target, result) of each copy that hasn't been waited for.
+        self.pool = None
+        self.pending = []
+
+    def __getstate__(self):
+        # converters (and their copiers) are sent to worker processes, which
+        # make their own thread pools.
+        state = self.__dict__.copy()
+        state['pool'] = None
+        state['pending'] = []
+        state['new_digests'] = {}
+        return state
+
+    def _read_digests(self):
+        if self.digest_cache_filename is None:
+            return {}
+        import json
+        try:
+            with open(self.digest_cache_filename) as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def save_digests(self):
+        """Writes the hashes of the images to the digest cache, if there is
+        one and they've changed."""
+        if self.digest_cache_filename is None or not self.digests_changed:
+            return
+        import json
+        dirname = os.path.dirname(self.digest_cache_filename)
+        if dirname and not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        with open(self.digest_cache_filename, 'w') as f:
+            json.dump(self.digests, f)
+        self.digests_changed = False
+
+    def get_digest(self, path):
+        """Returns the hash of the contents of the file at path (an absolute
+        path), or None if it can't be read. It's only read if its size or
+        modification time have changed since it was last hashed."""
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        entry = self.digests.get(path)
+        if (entry is not None and entry[0] == st.st_mtime and
+                entry[1] == st.st_size):
+            return entry[2]
+        digest = file_digest(path)
+        if digest is not None:
+            self.digests[path] = [st.st_mtime, st.st_size, digest]
+            self.new_digests[path] = self.digests[path]
+            self.digests_changed = True
+        return digest
+
+    def add(self, filename):
+        """Queues an image to be copied, unless a copy of its contents has
+        already been made. Returns the path of the copy, or None if the image
+        can't be read."""
+        path = os.path.abspath(filename)
+        name = self.copies.get(path)
+        if name is None:
+            digest = self.get_digest(path)
+            if digest is None:
+                return None
+            name = digest[:HASH_LENGTH] + os.path.splitext(path)[1].lower()
+            self.copies[path] = name
+            if name not in self.copy_names:
+                self.copy_names.add(name)
+                if self.deferred is not None:
+                    self.deferred.append((path, name))
+                else:
+                    self._queue_copy_of(path, name)
+        return os.path.join(self.output_dir, name)
+
+    def _queue_copy_of(self, path, name):
+        target = os.path.join(self.output_dir, name)
+        if not os.path.exists(target):
+            self._queue_copy(path, target)
+
+    def defer_copies(self):
+        """Makes add() record the copies it needs rather than making them, for
+        a worker process whose copies are made by another copier."""
+        self.deferred = []
+
+    def take_deferred(self):
+        """Returns the (digests, copies) recorded since this was last called:
+        the new entries for the digest cache, and the (path, name) of each
+        copy needed. Pass them to merge() on the copier that makes the
+        copies."""
+        results = (self.new_digests, self.deferred or [])
+        self.new_digests = {}
+        if self.deferred is not None:
+            self.deferred = []
+        return results
+
+    def merge(self, digests, copies):
+        """Adds the digests and queues the copies taken from another copier
+        with take_deferred(). Copies that have already been made (or queued)
+        are skipped."""
+        if digests:
+            self.digests.update(digests)
+            self.digests_changed = True
+        for (path, name) in copies:
+            self.copies[path] = name
+            if name not in self.copy_names:
+                self.copy_names.add(name)
+                self._queue_copy_of(path, name)
+
+    def _queue_copy(self, source, target):
+        if self.pool is None:
+            from multiprocessing.pool import ThreadPool
+            try:
+                os.makedirs(self.output_dir)
+            except OSError:
+                # another process may have just made it.
+                if not os.path.isdir(self.output_dir):
+                    raise
+            self.pool = ThreadPool(self.threads)
+        self.pending.append((source, target,
+                             self.pool.apply_async(_copy_file,
+                                                   (source, target))))
+        self.copy_count += 1
+
+    def wait(self):
+        """Waits for the images queued so far to be copied. Returns a message
+        for each one that couldn't be."""
+        errors = []
+        for (source, target, result) in self.pending:
+            try:
+                result.get()
+            except (IOError, OSError) as e:
+                errors.append("Couldn't copy %s to %s: %s" %
+                              (source, target, e))
+        self.pending = []
+        return errors
+
+    def finish(self):
+        """Waits for every copy, stops the threads and saves the digest
+        cache. Returns the messages for the copies that failed, as wait()
+        does. The copier can still be used afterwards."""
+        errors = self.wait()
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+        self.save_digests()
+        return errors
+
+
+def add_doctree_images(doctree, assets, source_dir, image_paths):
+    """Queues the images in a doctree to be copied by assets, taking their
+    URIs to be relative to source_dir. The path of each copy is added to
+    image_paths, by the image's URI."""
+    from docutils import nodes
+    from abstrys.docutils_ext.traversal import iter_tree
+    for node in iter_tree(doctree, nodes.image):
+        uri = node['uri']
+        if uri in image_paths or is_external_uri(uri):
+            continue
+        # Sphinx lists the files matching a URI such as 'picture.*' as its
+        # candidates.
+        filename = uri
+        candidates = node.get('candidates') or {}
+        if candidates and uri not in candidates.values():
+            filename = sorted(candidates.values())[0]
+        path = assets.add(os.path.join(source_dir, filename))
+        if path is not None:
+            image_paths[uri] = path
@@ -0,0 +1,742 @@
+# -*- coding: utf-8 -*-
+#
+# #############
+# abstrys.batch
+# #############
+#
+# Batch conversion support for the command-line tools. Lets rst2db and rst2md
+# convert many files (or whole directory trees) in a single process, reusing
+# the same docutils writer and settings for every document.
+#
+# by Eron Hennessey
+#
+
+import fnmatch
+import os
+import sys
+from collections import deque
+
+from abstrys.assets import (AssetCopier, get_image_dir, get_relative_uri,
+        is_external_uri)
+from abstrys.cache import ConversionCache, file_digest, make_key
+from abstrys.common import printerr, printwarn
+
+
+# The pattern used to pick up files when a directory is given and no include
+# patterns were specified.
+DEFAULT_INCLUDES = ['*.rst']
+
+
+def read_manifest(manifest_filename):
+    """Reads a list of input files from a manifest file.
+
+    The manifest lists one path per line. Blank lines and lines starting with
+    '#' are ignored. Relative paths are taken to be relative to the directory
+    that contains the manifest."""
+    base_dir = os.path.dirname(manifest_filename)
+    paths = []
+    with open(manifest_filename, 'r') as manifest_file:
+        for line in manifest_file:
+            line = line.strip()
+            if line == '' or line.startswith('#'):
+                continue
+            paths.append(os.path.join(base_dir, line))
+    return paths
+
+
+def _matches_any(name, patterns):
+    for pattern in patterns:
+        if fnmatch.fnmatch(name, pattern):
+            return True
+    return False
+
+
+def _walk(path, excludes):
+    """Walks the directory tree at path, as os.walk() does, yielding
+    (dirpath, reldir, filenames) for each directory. Excluded directories
+    aren't walked into at all, and the results are sorted so that they're
+    always in the same order."""
+    for (dirpath, dirnames, filenames) in os.walk(path):
+        reldir = os.path.relpath(dirpath, path)
+        dirnames[:] = sorted(
+                d for d in dirnames if not _matches_any(
+                    os.path.normpath(os.path.join(reldir, d)), excludes))
+        yield (dirpath, reldir, sorted(filenames))
+
+
+def find_input_files(paths, includes=None, excludes=None):
+    """Expands a list of files and directories into the files to convert.
+
+    Directories are searched recursively; files within them are kept if their
+    path (relative to the directory) matches one of the *includes* patterns
+    and none of the *excludes* patterns. Files named explicitly are always
+    kept unless they match an exclude pattern.
+
+    Returns a list of (input_filename, relative_name) tuples, where
+    relative_name is used to mirror the input tree in the output directory."""
+    if not includes:
+        includes = DEFAULT_INCLUDES
+    excludes = excludes or []
+    found = []
+    for path in paths:
+        if os.path.isdir(path):
+            for (dirpath, reldir, filenames) in _walk(path, excludes):
+                for filename in filenames:
+                    relname = os.path.normpath(os.path.join(reldir, filename))
+                    if (_matches_any(relname, includes) and
+                            not _matches_any(relname, excludes)):
+                        found.append((os.path.join(dirpath, filename),
+                                      relname))
+        else:
+            relname = os.path.basename(path)
+            if not _matches_any(relname, excludes):
+                found.append((path, relname))
+    return found
+
+
+def get_output_filename(relative_name, output_dir, extension):
+    """Returns the output filename for an input file, mirroring its location
+    in the input tree beneath output_dir."""
+    (base, ext) = os.path.splitext(relative_name)
+    return os.path.join(output_dir, base + extension)
+
+
+def write_output_file(output_filename, write):
+    """Calls write with a file opened for writing bytes, and makes what it
+    writes the contents of output_filename. It's written to a temporary file
+    in the same directory first, and only put in place once write returns,
+    so a conversion that fails part of the way through doesn't leave a
+    partial output file behind."""
+    import tempfile
+    (output_dir, name) = os.path.split(output_filename)
+    (fd, temp_filename) = tempfile.mkstemp(dir=output_dir or os.curdir,
+                                           prefix='.%s.' % name,
+                                           suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as output_file:
+            write(output_file)
+        # the temporary file is only readable by its owner; give the output
+        # the permissions a new file would have.
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(temp_filename, 0o666 & ~umask)
+        # os.replace() is only in Python 3; on Python 2, os.rename() replaces
+        # the file on everything but Windows.
+        getattr(os, 'replace', os.rename)(temp_filename, output_filename)
+    except BaseException:
+        # this includes the SystemExit docutils raises for a serious error.
+        os.remove(temp_filename)
+        raise
+
+
+def get_docutils_settings(writer, settings_overrides):
+    """Processes the docutils settings for a writer once, so that they can be
+    shared by every document converted in the same process."""
+    from docutils import io
+    from docutils.core import Publisher
+    publisher = Publisher(writer=writer, source_class=io.StringInput,
+                          destination_class=io.StringOutput)
+    publisher.set_components('standalone', 'restructuredtext', None)
+    publisher.process_programmatic_settings(None, settings_overrides, None)
+    return publisher.settings
+
+
+class Converter(object):
+    """Converts reST files one at a time with a single, reusable writer.
+
+    Subclasses provide create_writer(), and can override prepare_document()
+    and process_output() to customize the output of each document."""
+
+    # the extension given to output files when converting a directory tree.
+    output_extension = None
+
+    settings_overrides = {'input_encoding': 'utf-8',
+                          'output_encoding': 'utf-8'}
+
+    def __init__(self, params):
+        self.params = params
+        self.writer = None
+        self.settings = None
+        self.cache = None
+        self.profiler = None
+        # the files (such as included files) that the last document converted
+        # depended on.
+        self.dependencies = []
+        # the images that the last document converted referenced, and the
+        # copier that copies them into the output tree, if they're copied.
+        self.images = []
+        self.assets = None
+        image_dir = get_image_dir(params)
+        if image_dir != None:
+            digest_cache_filename = None
+            if params.get('cache_dir') != None:
+                digest_cache_filename = os.path.join(params['cache_dir'],
+                                                     'image_digests.json')
+            self.assets = AssetCopier(image_dir, digest_cache_filename)
+        if params.get('profile'):
+            from abstrys.profiling import NodeProfiler
+            self.profiler = NodeProfiler(params.get('cprofile', False))
+        elif params.get('cache_dir') != None:
+            # the cache isn't used when profiling, since it would skip the
+            # work being measured.
+            self.cache = ConversionCache(params['cache_dir'],
+                                         params['cache_limit'])
+
+    def __getstate__(self):
+        # converters are sent to worker processes before they're prepared;
+        # each worker creates its own writer and settings.
+        state = self.__dict__.copy()
+        state['writer'] = None
+        state['settings'] = None
+        return state
+
+    def create_writer(self):
+        """Returns the docutils writer used for every document."""
+        raise NotImplementedError
+
+    def prepare(self):
+        """Creates the writer and processes the docutils settings. This only
+        does any work the first time it's called."""
+        if self.writer is None:
+            self.writer = self.create_writer()
+            self.writer.profiler = self.profiler
+            self.settings = get_docutils_settings(self.writer,
+                                                  self.settings_overrides)
+
+    def start_profiling(self):
+        """Starts cProfile, if it's being used."""
+        if self.profiler is not None:
+            self.profiler.start()
+
+    def finish_profiling(self):
+        """Writes the profiling report, if profiling is turned on."""
+        if self.profiler is not None:
+            self.profiler.stop()
+            self.profiler.write_report(self.params.get('profile_filename'))
+
+    def prepare_document(self, input_filename, output_filename):
+        """Called before each document is converted."""
+        pass
+
+    def process_output(self, contents):
+        """Called with the writer's output for each document. Returns the
+        contents to write."""
+        return contents
+
+    def get_cached_extras(self):
+        """Returns a dict of anything other than the output of the document
+        just translated that should be kept in the cache with it."""
+        return {}
+
+    def use_cached_extras(self, extras):
+        """Called with the extras kept with a document's cached output when
+        it's used."""
+        pass
+
+    def get_image_uri_function(self, input_filename, output_filename):
+        """Returns the function the writer calls with the URI of each image,
+        or None if images aren't being copied. It queues the image to be
+        copied, and returns the URI of the copy, relative to the output
+        file."""
+        if self.assets is None:
+            return None
+        source_dir = os.path.dirname(input_filename or '')
+        output_dir = os.path.dirname(output_filename or '')
+
+        def get_image_uri(uri):
+            if is_external_uri(uri):
+                return uri
+            filename = os.path.join(source_dir, uri)
+            path = self.assets.add(filename)
+            if path is None:
+                printwarn("%s: can't read image: %s" % (input_filename, uri))
+                return uri
+            if filename not in self.images:
+                self.images.append(filename)
+            return get_relative_uri(path, output_dir)
+        return get_image_uri
+
+    def prepare_images(self, input_filename, output_filename):
+        """Called before each document is translated, to set up the copying
+        of its images."""
+        self.images = []
+        self.writer.get_image_uri = self.get_image_uri_function(
+                input_filename, output_filename)
+
+    def wait_for_images(self):
+        """Waits for the images queued so far to be copied. Returns a message
+        for each one that couldn't be."""
+        if self.assets is None:
+            return []
+        return self.assets.wait()
+
+    def finish_images(self):
+        """Waits for every image to be copied, and saves their hashes for
+        the next run. Returns a message for each one that couldn't be
+        copied."""
+        if self.assets is None:
+            return []
+        return self.assets.finish()
+
+    def defer_images(self):
+        """Makes the converter hash its images but leave the copying to
+        another converter, which is given the results of
+        take_image_results(). Used in worker processes."""
+        if self.assets is not None:
+            self.assets.defer_copies()
+
+    def take_image_results(self):
+        """Returns the image hashes and copies recorded since this was last
+        called, or None if images aren't being copied."""
+        if self.assets is None:
+            return None
+        return self.assets.take_deferred()
+
+    def merge_image_results(self, results):
+        """Saves the hashes and makes the copies returned by another
+        converter's take_image_results()."""
+        if results is not None:
+            self.assets.merge(*results)
+
+    def get_cache_key_parts(self, input_filename, output_filename):
+        """Returns everything other than the input file's contents that
+        affects the output of a document."""
+        import docutils
+        from abstrys import __version__
+        parts = [self.__class__.__name__, __version__, docutils.__version__,
+                 sorted(self.settings_overrides.items()), input_filename]
+        template_filename = self.params.get('template_filename')
+        if template_filename != None:
+            parts.extend([template_filename, file_digest(template_filename)])
+        if self.assets is not None:
+            # the output holds the URIs of the copies of its images.
+            parts.extend([os.path.abspath(self.assets.output_dir),
+                          os.path.abspath(os.path.dirname(output_filename or
+                                                          ''))])
+        return parts
+
+    def _get_cached_entry(self, key):
+        """Returns the cache entry for key, as long as none of the files the
+        document depended on (such as included files) have changed."""
+        entry = self.cache.get(key)
+        if entry is None:
+            return None
+        for (filename, digest) in entry['dependencies']:
+            if file_digest(filename) != digest:
+                return None
+        return entry
+
+    def convert(self, input_filename, output_filename=None):
+        """Converts a single file, returning the output as encoded bytes."""
+        with open(input_filename, 'rb') as input_file:
+            input_file_contents = input_file.read()
+        return self.convert_contents(input_file_contents, input_filename,
+                                     output_filename)
+
+    def get_cached_output(self, input_file_contents, input_filename=None,
+                          output_filename=None):
+        """Returns the cached output for a document, or None if it isn't in
+        the cache (or there is no cache)."""
+        if self.cache is None:
+            return None
+        key = make_key(input_file_contents,
+                *self.get_cache_key_parts(input_filename, output_filename))
+        entry = self._get_cached_entry(key)
+        if entry is None:
+            return None
+        self.dependencies = [filename for (filename, digest)
+                             in entry['dependencies']]
+        self.images = entry.get('images', [])
+        if self.assets is not None:
+            # the copies may have been removed since the output was cached.
+            for filename in self.images:
+                self.assets.add(filename)
+        self.use_cached_extras(entry.get('extras', {}))
+        return entry['output']
+
+    def cache_output(self, input_file_contents, input_filename,
+                     output_filename, contents):
+        """Adds the output for a document, and the files it depended on, to
+        the cache (if there is one)."""
+        if self.cache is None:
+            return
+        key = make_key(input_file_contents,
+                *self.get_cache_key_parts(input_filename, output_filename))
+        dependencies = [(filename, file_digest(filename))
+                        for filename in self.dependencies]
+        self.cache.put(key, {'output': contents,
+                             'dependencies': dependencies,
+                             'images': self.images,
+                             'extras': self.get_cached_extras()})
+
+    def get_doctree_key_parts(self, input_filename):
+        """Returns everything other than the input file's contents that
+        affects the doctree. The writer, template and output filename don't,
+        so a cached doctree can be used whenever only they have changed."""
+        import docutils
+        from abstrys import __version__
+        return ['doctree', __version__, docutils.__version__,
+                sys.version_info[:2], sorted(self.settings_overrides.items()),
+                input_filename]
+
+    def _get_cached_doctree(self, key, input_filename):
+        """Returns the doctree cached for key, ready to be translated, or
+        None if there isn't one."""
+        from docutils.utils import DependencyList, new_reporter
+        entry = self._get_cached_entry(key)
+        if entry is None:
+            return None
+        doctree = entry['doctree']
+        doctree.settings = self.settings.copy()
+        doctree.settings.record_dependencies = DependencyList()
+        doctree.reporter = new_reporter(input_filename or '<string>',
+                                        doctree.settings)
+        self.dependencies = [filename for (filename, digest)
+                             in entry['dependencies']]
+        return doctree
+
+    def _cache_doctree(self, key, doctree):
+        # the settings, reporter and transformer hold streams and other
+        # things that can't be pickled, and aren't needed to translate the
+        # doctree; they're put back once it's been stored.
+        saved = (doctree.settings, doctree.reporter, doctree.transformer)
+        doctree.settings = doctree.reporter = doctree.transformer = None
+        try:
+            dependencies = [(filename, file_digest(filename))
+                            for filename in self.dependencies]
+            self.cache.put(key, {'doctree': doctree,
+                                 'dependencies': dependencies})
+        finally:
+            (doctree.settings, doctree.reporter, doctree.transformer) = saved
+
+    def parse(self, input_file_contents, input_filename=None):
+        """Parses reST source (as encoded bytes), returning the doctree. The
+        writers don't change the doctree, so it can be translated any number
+        of times, by any converter that shares these settings.
+
+        If there's a cache, parsed doctrees are kept in it too, so that the
+        document doesn't need to be parsed again when only the writer's
+        settings, the template or the output format have changed."""
+        from docutils.core import publish_doctree
+        from docutils.utils import DependencyList
+        self.prepare()
+        key = None
+        if self.cache is not None:
+            key = make_key(input_file_contents,
+                           *self.get_doctree_key_parts(input_filename))
+            doctree = self._get_cached_doctree(key, input_filename)
+            if doctree is not None:
+                return doctree
+        settings = self.settings.copy()
+        settings.record_dependencies = DependencyList()
+        doctree = publish_doctree(input_file_contents,
+                                  source_path=input_filename,
+                                  settings=settings)
+        self.dependencies = list(settings.record_dependencies.list)
+        if key is not None:
+            self._cache_doctree(key, doctree)
+        return doctree
+
+    def translate(self, doctree, input_filename=None, output_filename=None):
+        """Translates a doctree, returning the output as encoded bytes."""
+        from docutils.io import StringOutput
+        self.prepare()
+        self.prepare_document(input_filename, output_filename)
+        self.prepare_images(input_filename, output_filename)
+        contents = self.writer.write(doctree, StringOutput(
+                encoding=self.settings.output_encoding))
+        # a changed image is copied under a new name, so the output has to be
+        # made again.
+        self.dependencies = self.dependencies + self.images
+        return self.process_output(contents)
+
+    def convert_contents(self, input_file_contents, input_filename=None,
+                         output_filename=None):
+        """Converts reST source (as encoded bytes), returning the output as
+        encoded bytes. input_filename is used to find included files and in
+        error messages."""
+        self.prepare()
+        contents = self.get_cached_output(input_file_contents, input_filename,
+                                          output_filename)
+        if contents is not None:
+            return contents
+        doctree = self.parse(input_file_contents, input_filename)
+        contents = self.translate(doctree, input_filename, output_filename)
+        self.cache_output(input_file_contents, input_filename,
+                          output_filename, contents)
+        return contents
+
+    def convert_to_file(self, input_filename, output_file,
+                        output_filename=None):
+        """Converts a single file, with the writer streaming its output to
+        output_file (opened for writing bytes) as it goes, rather than holding
+        all of it in memory. Templates and the cache aren't used."""
+        from docutils.core import publish_string
+        from docutils.utils import DependencyList
+        self.prepare()
+        with open(input_filename, 'rb') as input_file:
+            input_file_contents = input_file.read()
+        self.prepare_document(input_filename, output_filename)
+        self.prepare_images(input_filename, output_filename)
+        settings = self.settings.copy()
+        settings.record_dependencies = DependencyList()
+        self.writer.output_file = output_file
+        try:
+            publish_string(input_file_contents,
+                           source_path=input_filename,
+                           writer=self.writer,
+                           settings=settings)
+        finally:
+            self.writer.output_file = None
+        self.dependencies = (list(settings.record_dependencies.list) +
+                             self.images)
+
+    def convert_file(self, input_filename, output_filename):
+        """Converts a single file and writes the result to output_filename,
+        creating its directory if needed."""
+        output_dir = os.path.dirname(output_filename)
+        if output_dir and not os.path.isdir(output_dir):
+            os.makedirs(output_dir)
+        if self.params.get('stream_output'):
+            write_output_file(output_filename,
+                    lambda output_file: self.convert_to_file(
+                            input_filename, output_file, output_filename))
+            return
+        contents = self.convert(input_filename, output_filename)
+        write_output_file(output_filename,
+                          lambda output_file: output_file.write(contents))
+
+
+class MultiConverter(object):
+    """Converts reST files into several formats at once, parsing each file
+    only once and handing the same doctree to every converter's writer.
+
+    Each job's output filename is a base name, to which each converter adds
+    its own output_extension. The converters all parse with the same
+    settings: the document title is promoted, as rst2md does, and field
+    lists are left as they are, as rst2db expects."""
+
+    settings_overrides = {'input_encoding': 'utf-8',
+                          'output_encoding': 'utf-8',
+                          'docinfo_xform': False}
+
+    def __init__(self, params, converters):
+        self.params = params
+        self.converters = converters
+        for converter in converters:
+            # this also keeps their cache entries apart from those made by
+            # the converters on their own.
+            converter.settings_overrides = self.settings_overrides
+            # the images referenced by both outputs are only copied once.
+            converter.assets = converters[0].assets
+        self.dependencies = []
+
+    def prepare(self):
+        for converter in self.converters:
+            converter.prepare()
+
+    def start_profiling(self):
+        for converter in self.converters:
+            converter.start_profiling()
+
+    def finish_profiling(self):
+        for converter in self.converters:
+            converter.finish_profiling()
+
+    def wait_for_images(self):
+        return self.converters[0].wait_for_images()
+
+    def finish_images(self):
+        return self.converters[0].finish_images()
+
+    def defer_images(self):
+        self.converters[0].defer_images()
+
+    def take_image_results(self):
+        return self.converters[0].take_image_results()
+
+    def merge_image_results(self, results):
+        self.converters[0].merge_image_results(results)
+
+    def get_output_filenames(self, output_base):
+        return [output_base + converter.output_extension
+                for converter in self.converters]
+
+    def convert_contents(self, input_file_contents, input_filename=None,
+                         output_base=None):
+        """Converts reST source (as encoded bytes), returning a list with the
+        output of each converter."""
+        self.prepare()
+        output_filenames = [None] * len(self.converters)
+        if output_base != None:
+            output_filenames = self.get_output_filenames(output_base)
+        outputs = [converter.get_cached_output(input_file_contents,
+                                               input_filename, output_filename)
+                   for (converter, output_filename)
+                   in zip(self.converters, output_filenames)]
+        doctree = None
+        for (i, converter) in enumerate(self.converters):
+            if outputs[i] is not None:
+                continue
+            if doctree is None:
+                doctree = self.converters[0].parse(input_file_contents,
+                                                   input_filename)
+                dependencies = self.converters[0].dependencies
+            converter.dependencies = dependencies
+            outputs[i] = converter.translate(doctree, input_filename,
+                                             output_filenames[i])
+            converter.cache_output(input_file_contents, input_filename,
+                                   output_filenames[i], outputs[i])
+        self.dependencies = sorted(set(
+                filename for converter in self.converters
+                for filename in converter.dependencies))
+        return outputs
+
+    def convert_file(self, input_filename, output_base):
+        """Converts a single file, writing each converter's output to
+        output_base plus its extension."""
+        output_dir = os.path.dirname(output_base)
+        if output_dir and not os.path.isdir(output_dir):
+            os.makedirs(output_dir)
+        with open(input_filename, 'rb') as input_file:
+            input_file_contents = input_file.read()
+        outputs = self.convert_contents(input_file_contents, input_filename,
+                                        output_base)
+        for (output_filename, contents) in zip(
+                self.get_output_filenames(output_base), outputs):
+            write_output_file(output_filename,
+                              lambda output_file: output_file.write(contents))
+
+
+def get_batch_jobs(params, extension):
+    """Returns the list of (input_filename, output_filename) pairs to convert
+    for a batch run, based on the command-line params."""
+    paths = list(params['input_filenames'])
+    if params['manifest_filename'] != None:
+        paths.extend(read_manifest(params['manifest_filename']))
+    inputs = find_input_files(paths, params['includes'], params['excludes'])
+    return [(input_filename,
+             get_output_filename(relname, params['output_dir'], extension))
+            for (input_filename, relname) in inputs]
+
+
+def get_search_paths(params):
+    """Returns the paths that get_batch_jobs() looks in for input files: the
+    directories searched, with all of their subdirectories that aren't
+    excluded, and the manifest file. The jobs can change when any of them
+    does."""
+    paths = []
+    for path in params['input_filenames']:
+        if os.path.isdir(path):
+            paths.extend(dirpath for (dirpath, reldir, filenames)
+                         in _walk(path, params['excludes'] or []))
+    if params['manifest_filename'] != None:
+        paths.append(params['manifest_filename'])
+    return paths
+
+
+def order_by_size(jobs):
+    """Sorts jobs so that the largest input files come first. Ties are broken
+    by filename so that the order is always the same."""
+    def size_key(job):
+        try:
+            size = os.path.getsize(job[0])
+        except OSError:
+            size = 0
+        return (-size, job[0])
+    return sorted(jobs, key=size_key)
+
+
+def get_process_count(value):
+    """Converts the value of the -j switch to a number of processes. 'auto'
+    uses one process per CPU."""
+    if value == 'auto':
+        import multiprocessing
+        return multiprocessing.cpu_count()
+    return max(1, int(value))
+
+
+# The converter used by a worker process. Set by _init_worker().
+_worker_converter = None
+
+
+def _init_worker(converter):
+    """Prepares a worker process: importing docutils and lxml and setting up
+    the writer happens once here, rather than once per document. The images
+    are copied by the main process."""
+    global _worker_converter
+    converter.prepare()
+    converter.defer_images()
+    _worker_converter = converter
+
+
+def _convert_in_worker(job):
+    """Converts a single job in a worker process. Returns (error, images):
+    error is None on success, or an error message, and images are the image
+    hashes and copies for the main process (see take_image_results())."""
+    (input_filename, output_filename) = job
+    error = None
+    try:
+        _worker_converter.convert_file(input_filename, output_filename)
+    except Exception as e:
+        error = str(e)
+    return (error, _worker_converter.take_image_results())
+
+
+def run_batch(converter, jobs, processes=1):
+    """Converts each (input_filename, output_filename) pair in jobs with the
+    given converter. Errors are reported and the remaining files are still
+    converted. Returns the number of files that failed, counting the images
+    that couldn't be copied.
+
+    If processes is greater than one, the jobs are shared among a pool of
+    worker processes."""
+    if processes > 1 and len(jobs) > 1:
+        failures = _run_parallel(converter, jobs, processes)
+    else:
+        failures = 0
+        for (input_filename, output_filename) in jobs:
+            try:
+                converter.convert_file(input_filename, output_filename)
+            except Exception as e:
+                printerr("%s: %s" % (input_filename, e))
+                failures += 1
+    for error in converter.finish_images():
+        printerr(error)
+        failures += 1
+    return failures
+
+
+def _run_parallel(converter, jobs, processes):
+    """Converts the jobs on a pool of worker processes.
+
+    The largest files are scheduled first so that no worker is left with a
+    big file at the end of the run. Results are collected in scheduling order,
+    so errors are always reported in the same order, and only a couple of
+    jobs per worker are allowed to be in flight at once."""
+    import multiprocessing
+    max_pending = processes * 2
+    failures = 0
+    pending = deque()
+
+    def collect(job, result):
+        (error, images) = result.get()
+        converter.merge_image_results(images)
+        if error != None:
+            printerr("%s: %s" % (job[0], error))
+            return 1
+        return 0
+
+    pool = multiprocessing.Pool(processes, _init_worker, (converter,))
+    try:
+        for job in order_by_size(jobs):
+            if len(pending) >= max_pending:
+                failures += collect(*pending.popleft())
+            pending.append((job, pool.apply_async(_convert_in_worker,
+                                                  (job,))))
+        while pending:
+            failures += collect(*pending.popleft())
+    finally:
+        pool.close()
+        pool.join()
+    return failures
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+#
+# #############
+# abstrys.cache
+# #############
+#
+# An on-disk cache for conversion results, keyed by a hash of everything that
+# affects the output and limited in size by evicting the least recently used
+# entries.
+#
+# by Eron Hennessey
+#
+
+# hashlib, pickle and tempfile are imported by the functions that use them,
+# so that loading this module doesn't slow down the command-line tools when
+# the cache isn't being used.
+import os
+
+
+# The default limit on the total size of a cache directory (512 MB).
+DEFAULT_MAX_SIZE = 512 * 1024 * 1024
+
+_SIZE_UNITS = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+
+
+def parse_size(value):
+    """Converts a size such as '200M', '2G' or '1048576' to a number of
+    bytes."""
+    value = value.strip().upper()
+    if value.endswith('B'):
+        value = value[:-1]
+    if value and value[-1] in _SIZE_UNITS:
+        return int(float(value[:-1]) * _SIZE_UNITS[value[-1]])
+    return int(value)
+
+
+def _to_bytes(part):
+    if isinstance(part, bytes):
+        return part
+    if not isinstance(part, type(u'')):
+        part = repr(part)
+    return part.encode('utf-8')
+
+
+def make_key(*parts):
+    """Returns a cache key for the given parts, which can be bytes, text or
+    anything with a stable repr()."""
+    import hashlib
+    digest = hashlib.sha256()
+    for part in parts:
+        part = _to_bytes(part)
+        # length-prefix each part so that ('ab', 'c') and ('a', 'bc') differ.
+        digest.update(_to_bytes('%d:' % len(part)))
+        digest.update(part)
+    return digest.hexdigest()
+
+
+def file_digest(filename):
+    """Returns a hash of the file's contents, or None if it can't be read."""
+    import hashlib
+    try:
+        with open(filename, 'rb') as f:
+            return hashlib.sha256(f.read()).hexdigest()
+    except (IOError, OSError):
+        return None
+
+
+class ConversionCache(object):
+    """A directory of pickled values with a limit on its total size.
+
+    Reading an entry marks it as recently used; when storing an entry takes
+    the cache over its size limit, the least recently used entries are
+    removed."""
+
+    def __init__(self, cache_dir, max_size=DEFAULT_MAX_SIZE):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        # the total size of the cache, read from disk on the first write.
+        self._total_size = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_total_size'] = None
+        return state
+
+    def _get_entry_path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + '.pickle')
+
+    def get(self, key):
+        """Returns the value stored for key, or None if there isn't one."""
+        import pickle
+        path = self._get_entry_path(key)
+        try:
+            with open(path, 'rb') as entry_file:
+                value = pickle.load(entry_file)
+        except (IOError, OSError, EOFError, pickle.UnpicklingError):
+            return None
+        try:
+            # the modification time records when the entry was last used.
+            os.utime(path, None)
+        except OSError:
+            pass
+        return value
+
+    def put(self, key, value):
+        """Stores value for key, evicting old entries if necessary."""
+        import pickle
+        import tempfile
+        path = self._get_entry_path(key)
+        entry_dir = os.path.dirname(path)
+        if not os.path.isdir(entry_dir):
+            try:
+                os.makedirs(entry_dir)
+            except OSError:
+                # another process may have just created it.
+                if not os.path.isdir(entry_dir):
+                    raise
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        if self._total_size is None:
+            self._total_size = sum(size for (mtime, size, p) in self._scan())
+        # write to a temporary file first, so that other processes never see
+        # a partial entry.
+        (fd, temp_path) = tempfile.mkstemp(dir=entry_dir)
+        with os.fdopen(fd, 'wb') as entry_file:
+            entry_file.write(data)
+        try:
+            self._total_size -= os.stat(path).st_size
+        except OSError:
+            pass
+        # replacing the entry in one step means that another process putting
+        # the same key at the same time can't make this fail.
+        getattr(os, 'replace', os.rename)(temp_path, path)
+        self._total_size += len(data)
+        if self._total_size > self.max_size:
+            self.evict()
+
+    def _scan(self):
+        """Returns a list of (mtime, size, path) for every entry."""
+        entries = []
+        for (dirpath, dirnames, filenames) in os.walk(self.cache_dir):
+            for filename in filenames:
+                if not filename.endswith('.pickle'):
+                    continue
+                path = os.path.join(dirpath, filename)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+        return entries
+
+    def evict(self):
+        """Removes the least recently used entries until the cache is within
+        its size limit."""
+        entries = self._scan()
+        entries.sort()
+        total = sum(size for (mtime, size, path) in entries)
+        for (mtime, size, path) in entries:
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+        self._total_size = total
@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+#
+# ##############
+# abstrys.client
+# ##############
+#
+# A thin client for the conversion server (see abstrys.server), and the
+# message framing used by both.
+#
+# Each message is a JSON object, encoded as UTF-8 and preceded by its length
+# as a four-byte, big-endian unsigned integer. The client sends a request and
+# the server answers it with a response; any number of requests can be sent
+# over the same connection.
+#
+# This module only imports what it needs to talk to the server, so that it
+# starts quickly.
+#
+# by Eron Hennessey
+#
+
+import json
+import os
+import struct
+import sys
+
+from abstrys.common import printerr
+
+
+USAGE = """
+client - convert reStructuredText using a running conversion server
+
+**Usage:**
+
+:
+python -m abstrys client db <filename> [-o output_file] [-e root_element]
+                            [-t template_file] [-S socket_path]
+
+python -m abstrys client md <filename> [-o output_file] [-t template_file]
+                            [-S socket_path]
+
+python -m abstrys client ping [-S socket_path]
+
+python -m abstrys client stop [-S socket_path]
+
+Start the server with ``python -m abstrys serve``. Use '-' as the filename to
+read the reST source from stdin.
+
+**Settings:**
+
+-o *output_file*    have the server write the output to this file. If this
+                  is not specified, then output will be sent to ``stdout``.
+
+-e *root_element*   the root element of the DocBook output (default:
+                  'section').
+
+-t *template_file*  dress the output with this Jinja2 template.
+
+-S *socket_path*    the server's socket (default: %s).
+        """
+
+# the format of the length that comes before each message.
+_LENGTH = struct.Struct('>I')
+
+
+def get_default_socket_path():
+    """Returns the socket used when no other path has been given: one per
+    user, in their runtime directory if there is one."""
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+    if runtime_dir:
+        return os.path.join(runtime_dir, 'abstrys.sock')
+    uid = getattr(os, 'getuid', lambda: 0)()
+    return '/tmp/abstrys-%d.sock' % uid
+
+
+def _read_exactly(stream, length):
+    data = b''
+    while len(data) < length:
+        chunk = stream.read(length - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return data
+
+
+def receive_message(stream):
+    """Reads a message from a file-like stream. Returns None if the stream
+    was closed before a whole message arrived."""
+    header = _read_exactly(stream, _LENGTH.size)
+    if header is None:
+        return None
+    (length,) = _LENGTH.unpack(header)
+    data = _read_exactly(stream, length)
+    if data is None:
+        return None
+    return json.loads(data.decode('utf-8'))
+
+
+def send_message(stream, message):
+    """Writes a message to a file-like stream."""
+    data = json.dumps(message).encode('utf-8')
+    stream.write(_LENGTH.pack(len(data)) + data)
+    stream.flush()
+
+
+class ConversionClient(object):
+    """A connection to a conversion server."""
+
+    def __init__(self, socket_path=None):
+        import socket
+        if socket_path is None:
+            socket_path = get_default_socket_path()
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.socket.connect(socket_path)
+        self.stream = self.socket.makefile('rwb')
+
+    def request(self, message):
+        """Sends a request and returns the server's response."""
+        send_message(self.stream, message)
+        response = receive_message(self.stream)
+        if response is None:
+            raise IOError("The server closed the connection.")
+        return response
+
+    def close(self):
+        self.stream.close()
+        self.socket.close()
+
+
+def print_usage_and_exit(return_code=0):
+    print(USAGE % get_default_socket_path())
+    sys.exit(return_code)
+
+
+def process_cmd_args(args):
+    params = {'command': None,
+              'input_filename': None,
+              'output_filename': None,
+              'root_element': None,
+              'template_filename': None,
+              'socket_path': None}
+    last_switch = None
+    for arg in args:
+        if arg[0] == '-' and arg != '-':
+            if arg[1] == 'h' or arg[1] == '?':
+                print_usage_and_exit()
+            last_switch = arg[1]
+        else:
+            if last_switch == 'o':  # the output filename
+                params['output_filename'] = os.path.abspath(arg)
+            elif last_switch == 'e':  # the root element
+                params['root_element'] = arg
+            elif last_switch == 't':  # the template filename
+                params['template_filename'] = os.path.abspath(arg)
+            elif last_switch == 'S':  # the server's socket
+                params['socket_path'] = arg
+            elif params['command'] is None:
+                params['command'] = arg
+            else:  # the filename to process
+                params['input_filename'] = arg
+            last_switch = None
+    return params
+
+
+def get_request(params):
+    """Returns the request to send for the command-line params."""
+    if params['command'] == 'ping':
+        return {'command': 'ping'}
+    if params['command'] == 'stop':
+        return {'command': 'shutdown'}
+    request = {'command': 'convert', 'format': params['command']}
+    if params['input_filename'] == '-':
+        stdin = getattr(sys.stdin, 'buffer', sys.stdin)
+        request['input'] = stdin.read().decode('utf-8')
+    else:
+        # the server reads the file itself, so that included files are
+        # found relative to it.
+        request['input_filename'] = os.path.abspath(params['input_filename'])
+    for name in ('output_filename', 'root_element', 'template_filename'):
+        if params[name] != None:
+            request[name] = params[name]
+    return request
+
+
+def run(args=None):
+    """The main procedure."""
+    if args is None:
+        args = sys.argv[1:]
+    params = process_cmd_args(args)
+
+    if params['command'] not in ('db', 'md', 'ping', 'stop'):
+        print_usage_and_exit(1)
+    if params['command'] in ('db', 'md') and params['input_filename'] == None:
+        printerr("Wait, I need at *least* a filename to process!")
+        print_usage_and_exit(1)
+
+    try:
+        client = ConversionClient(params['socket_path'])
+    except (IOError, OSError) as e:
+        printerr("Can't connect to the server: %s" % e)
+        sys.exit(1)
+    try:
+        response = client.request(get_request(params))
+    finally:
+        client.close()
+
+    if not response['ok']:
+        printerr(response['error'])
+        sys.exit(1)
+    if response.get('output') != None:
+        stdout = getattr(sys.stdout, 'buffer', sys.stdout)
+        stdout.write(response['output'].encode('utf-8'))
+        stdout.flush()
+    sys.exit(0)
+
+
+if __name__ == "__main__":
+    run()
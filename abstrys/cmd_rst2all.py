@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# rst2all.py
+# ==========
+#
+# Converts reStructuredText to both DocBook and Markdown in one run. Each
+# file is parsed once, and the same doctree is given to both writers, which
+# takes about half the time of running rst2db and rst2md one after the other.
+#
+# by Eron Hennessey
+#
+
+import os
+import sys
+
+from abstrys.assets import parse_copy_images_option
+from abstrys.batch import (MultiConverter, get_batch_jobs, get_process_count,
+        run_batch)
+from abstrys.cache import DEFAULT_MAX_SIZE, parse_size
+from abstrys.common import printerr
+
+
+USAGE = """
+rst2all - convert reStructuredText to DocBook and Markdown at once
+
+**Usage:**
+
+:
+python -m abstrys all <filename> -o output_base [-e root_element]
+                      [-c cache_dir] [-l cache_limit] [--link-index]
+                      [--copy-images[=image_dir]]
+
+python -m abstrys all <filename_or_dir> [...] -d output_dir
+                      [-m manifest_file] [-i include_glob] [-x exclude_glob]
+                      [-j processes] [-e root_element] [-c cache_dir]
+                      [-l cache_limit] [--link-index]
+                      [--copy-images[=image_dir]]
+
+Each file is parsed once, and written as both DocBook (.xml) and Markdown
+(.md). The settings are the same as for rst2db and rst2md; templates aren't
+supported.
+
+**Settings:**
+
+-o *output_base*    write the output to output_base.xml and output_base.md.
+
+-e *root_element*   set the root element of the DocBook output. If this is not
+                  specified, then 'section' will be used by default.
+
+--width=*n*       wrap the Markdown output's paragraphs to n characters
+                  (default: 78).
+
+--no-wrap         write each paragraph of the Markdown output on a single
+                  line.
+
+--max-col-width=*n*
+                  don't pad the Markdown output's table columns out wider
+                  than n characters.
+
+--link-index      warn about links in the DocBook output to IDs that aren't
+                  in the document, and write its IDs and links to
+                  output_base.ids.json.
+
+--copy-images[=*image_dir*]
+                  copy the images the documents reference into image_dir
+                  (default: _images, in the output directory or beside the
+                  output files), and point both outputs at the copies. Each
+                  image is stored once, named by a hash of its contents.
+
+--watch           keep running after converting, and convert the documents
+                  again whenever they or any file they include changes. With
+                  -d, documents added to the input directories are converted
+                  too.
+
+-c *cache_dir*      keep converted documents in cache_dir.
+
+-l *cache_limit*    the maximum size of the cache directory (default: 512M).
+
+**Batch settings:**
+
+-d *output_dir*     convert all of the input files, writing the results to
+                  output_dir, mirroring the layout of the input tree.
+
+-m *manifest_file*  also convert the files listed in manifest_file.
+
+-i *include_glob*   when searching directories, only convert files matching
+                  this pattern (default: '*.rst').
+
+-x *exclude_glob*   skip files and directories matching this pattern.
+
+-j *processes*      convert files in parallel, using this many worker
+                  processes. Use 'auto' for one process per CPU.
+        """
+
+
+def print_usage_and_exit(return_code=0):
+    print(USAGE)
+    sys.exit(return_code)
+
+
+def process_cmd_args():
+    # get the command args
+    params = {'input_filenames': [],
+              'output_filename': None,
+              'output_dir': None,
+              'manifest_filename': None,
+              'includes': [],
+              'excludes': [],
+              'processes': 1,
+              'cache_dir': None,
+              'cache_limit': DEFAULT_MAX_SIZE,
+              'template_filename': None,
+              'root_element': 'section',
+              'table_max_col_width': None,
+              'line_width': None,
+              'link_index': False,
+              'copy_images': False,
+              'image_dir': None,
+              'watch': False}
+    last_switch = None
+    for arg in sys.argv[1:]:
+        if arg.startswith('--'):
+            if arg == '--watch':
+                params['watch'] = True
+            elif arg.startswith('--max-col-width='):
+                params['table_max_col_width'] = int(arg.split('=', 1)[1])
+            elif arg.startswith('--width='):
+                params['line_width'] = int(arg.split('=', 1)[1])
+            elif arg == '--no-wrap':
+                params['line_width'] = 0
+            elif arg == '--link-index':
+                params['link_index'] = True
+            elif parse_copy_images_option(arg, params):
+                pass
+            else:
+                printerr("Unknown option: %s" % arg)
+                print_usage_and_exit(1)
+        elif arg[0] == '-':
+            if arg[1] == 'h' or arg[1] == '?':
+                print_usage_and_exit()
+            last_switch = arg[1]
+        else:
+            if last_switch == 'o':  # the output base name
+                params['output_filename'] = arg
+            elif last_switch == 'e':  # the root element
+                params['root_element'] = arg
+            elif last_switch == 'd':  # the output directory
+                params['output_dir'] = arg
+            elif last_switch == 'm':  # the manifest filename
+                params['manifest_filename'] = arg
+            elif last_switch == 'i':  # an include pattern
+                params['includes'].append(arg)
+            elif last_switch == 'x':  # an exclude pattern
+                params['excludes'].append(arg)
+            elif last_switch == 'j':  # the number of worker processes
+                params['processes'] = get_process_count(arg)
+            elif last_switch == 'c':  # the cache directory
+                params['cache_dir'] = arg
+            elif last_switch == 'l':  # the cache size limit
+                params['cache_limit'] = parse_size(arg)
+            else:  # a filename to process
+                params['input_filenames'].append(arg)
+            last_switch = None
+    return params
+
+
+def create_converter(params):
+    """Returns a converter for DocBook and Markdown."""
+    from abstrys.cmd_rst2db import DocBookConverter
+    from abstrys.cmd_rst2md import MarkdownConverter
+    return MultiConverter(params, [DocBookConverter(params),
+                                   MarkdownConverter(params)])
+
+
+def run():
+    """The main procedure."""
+    params = process_cmd_args()
+
+    if (len(params['input_filenames']) == 0 and
+            params['manifest_filename'] == None):
+        printerr("Wait, I need at *least* a filename to process!")
+        print_usage_and_exit(1)
+
+    for input_filename in params['input_filenames']:
+        if not os.path.exists(input_filename):
+            printerr("File doesn't exist: %s" % input_filename)
+            sys.exit(1)
+
+    converter = create_converter(params)
+
+    # batch mode: each job's output filename is the base name for both
+    # outputs.
+    if params['output_dir'] != None:
+        jobs = get_batch_jobs(params, '')
+    elif (len(params['input_filenames']) != 1 or
+            os.path.isdir(params['input_filenames'][0])):
+        printerr("Use -d to set an output directory when converting more "
+                 "than one file.")
+        print_usage_and_exit(1)
+    elif params['output_filename'] == None:
+        printerr("Use -o to set the base name of the output files.")
+        print_usage_and_exit(1)
+    else:
+        jobs = [(params['input_filenames'][0], params['output_filename'])]
+
+    if params['watch']:
+        from abstrys.watch import watch
+        if params['output_dir'] != None:
+            watch(converter, jobs, params, '')
+        else:
+            watch(converter, jobs)
+
+    failures = run_batch(converter, jobs, params['processes'])
+    sys.exit(1 if failures else 0)
+
+if __name__ == "__main__":
+    run()
@@ -13,9 +13,13 @@
 import os
 import sys
 
-from abstrys.docutils_ext.markdown_writer import MarkdownWriter
+from abstrys.assets import parse_copy_images_option
+from abstrys.batch import (Converter, get_batch_jobs, get_process_count,
+        run_batch, write_output_file)
+from abstrys.cache import DEFAULT_MAX_SIZE, parse_size
 from abstrys.common import printerr
-from docutils.core import publish_string
+from abstrys.profiling import parse_profile_option
+from abstrys.templates import render_template
 
 
 USAGE = """
@@ -24,6 +28,13 @@ rst2md - convert reStructuredText to Markdown
 **Usage**::
 
  rst2md <filename> [-o output_file] [-t template_file]
+        [-c cache_dir] [-l cache_limit] [-s] [--width=n] [--no-wrap]
+        [--max-col-width=n] [--copy-images[=image_dir]]
+
+ rst2md <filename_or_dir> [...] -d output_dir [-m manifest_file]
+        [-i include_glob] [-x exclude_glob] [-j processes]
+        [-t template_file] [-c cache_dir] [-l cache_limit] [-s]
+        [--copy-images[=image_dir]]
 
 Only the filename to process is required. All other settings are optional.
 
@@ -37,6 +48,79 @@ Only the filename to process is required. All other settings are optional.
 
                     Use {{data.contents}} to represent the output of this script
                     in your template.
+
+-s                  stream the output as each part of the document is
+                    converted, rather than collecting all of it in memory
+                    first. Can't be used with -t, and the cache isn't used.
+
+--watch             keep running after converting, and convert the documents
+                    again whenever they, the template or any file they include
+                    changes. Needs -o or -d. With -d, documents added to the
+                    input directories are converted too. Uses inotify on Linux
+                    if the inotify_simple package is installed.
+
+--width=*n*         wrap paragraphs to n characters (default: 78).
+
+--no-wrap           write each paragraph on a single line.
+
+--max-col-width=*n*
+                    don't pad table columns out wider than n characters.
+                    Columns are as wide as their widest cell by default;
+                    longer cells are still written in full.
+
+--copy-images[=*image_dir*]
+                    copy the images the documents reference into image_dir
+                    (default: _images, in the output directory or beside
+                    the output file), and point the output at the copies.
+                    Each image is stored once, named by a hash of its
+                    contents, and isn't copied again if its copy is already
+                    there. With -c, the hashes are kept in the cache, so
+                    unchanged images aren't read again.
+
+**Cache settings**:
+
+-c *cache_dir*      keep converted documents in cache_dir. A document is only
+                    converted again if its contents, the settings, the
+                    template or any file it includes have changed. Parsed
+                    documents are kept too, so changing only the template
+                    skips parsing.
+
+-l *cache_limit*    the maximum size of the cache directory, such as 500M or
+                    2G (default: 512M). The least recently used entries are
+                    removed first.
+
+**Batch settings**:
+
+Any number of files and directories can be given when an output directory is
+set with -d. They are all converted in a single process.
+
+-d *output_dir*     convert all of the input files, writing the results to
+                    output_dir. Directories are searched recursively, and the
+                    layout of the input tree is mirrored in output_dir.
+
+-m *manifest_file*  also convert the files listed in manifest_file, one path
+                    per line. Relative paths are relative to the manifest.
+
+-i *include_glob*   when searching directories, only convert files matching
+                    this pattern (default: '*.rst'). Can be given more than
+                    once.
+
+-x *exclude_glob*   skip files and directories matching this pattern. Can be
+                    given more than once.
+
+-j *processes*      convert files in parallel, using this many worker
+                    processes. Use 'auto' for one process per CPU.
+
+**Profiling**:
+
+--profile[=*report_file*]
+                    time each of the translator's handlers, for each kind of
+                    document node, and write a report (to report_file, or to
+                    stderr) with the slowest first. The cache isn't used, and
+                    files are converted in a single process.
+
+--cprofile          also run Python's cProfile, and add its results to the
+                    report.
         """
 
 
@@ -46,13 +130,42 @@ def print_usage_and_exit(return_code=0):
 
 def process_cmd_args():
     # get the command args
-    params = {'input_filename': None,
+    params = {'input_filenames': [],
               'output_filename': None,
+              'output_dir': None,
+              'manifest_filename': None,
+              'includes': [],
+              'excludes': [],
+              'processes': 1,
+              'cache_dir': None,
+              'cache_limit': DEFAULT_MAX_SIZE,
               'template_filename': None,
+              'stream_output': False,
+              'profile': False,
+              'profile_filename': None,
+              'cprofile': False,
+              'watch': False,
+              'copy_images': False,
+              'image_dir': None,
+              'table_max_col_width': None,
+              'line_width': None,
               'switches': []}
     last_switch = None
     for arg in sys.argv[1:]:
-        if arg[0] == '-':
+        if arg.startswith('--'):
+            if arg == '--watch':
+                params['watch'] = True
+            elif arg.startswith('--max-col-width='):
+                params['table_max_col_width'] = int(arg.split('=', 1)[1])
+            elif arg.startswith('--width='):
+                params['line_width'] = int(arg.split('=', 1)[1])
+            elif arg == '--no-wrap':
+                params['line_width'] = 0
+            elif not (parse_copy_images_option(arg, params) or
+                      parse_profile_option(arg, params)):
+                printerr("Unknown option: %s" % arg)
+                print_usage_and_exit(1)
+        elif arg[0] == '-':
             if arg[1] == 'h' or arg[1] == '?':
                 print_usage_and_exit()
             params['switches'].append(arg[1])
@@ -64,8 +177,30 @@ def process_cmd_args():
             elif last_switch == 't':  # the template filename
                 params['template_filename'] = arg
                 last_switch = None
-            else:  # the filename to process
-                params['input_filename'] = arg
+            elif last_switch == 'd':  # the output directory
+                params['output_dir'] = arg
+                last_switch = None
+            elif last_switch == 'm':  # the manifest filename
+                params['manifest_filename'] = arg
+                last_switch = None
+            elif last_switch == 'i':  # an include pattern
+                params['includes'].append(arg)
+                last_switch = None
+            elif last_switch == 'x':  # an exclude pattern
+                params['excludes'].append(arg)
+                last_switch = None
+            elif last_switch == 'j':  # the number of worker processes
+                params['processes'] = get_process_count(arg)
+                last_switch = None
+            elif last_switch == 'c':  # the cache directory
+                params['cache_dir'] = arg
+                last_switch = None
+            elif last_switch == 'l':  # the cache size limit
+                params['cache_limit'] = parse_size(arg)
+                last_switch = None
+            else:  # a filename to process
+                params['input_filenames'].append(arg)
+    params['stream_output'] = ('s' in params['switches'])
     return params
 
 
@@ -81,10 +216,45 @@ def process_with_template(contents, params, fields):
         printerr("""Jinja2 is not installed: can't use template!""")
         sys.exit(1)
     fields['contents'] = contents
-    jinja2env = jinja2.Environment(loader=jinja2.FileSystemLoader('/'),
-            trim_blocks=True)
-    t = jinja2env.get_template(params['template_filename'])
-    return t.render(data=fields)
+    # compiled templates are kept with the rest of the cache, if there is one.
+    bytecode_cache_dir = None
+    if params['cache_dir'] != None:
+        bytecode_cache_dir = os.path.join(params['cache_dir'], 'templates')
+    return render_template(params['template_filename'], fields,
+                           bytecode_cache_dir=bytecode_cache_dir)
+
+
+class MarkdownConverter(Converter):
+    """Converts reST files to Markdown."""
+
+    output_extension = '.md'
+
+    def create_writer(self):
+        # imported here, so that the writer (and docutils and lxml) are only
+        # loaded when there's something to convert.
+        from abstrys.docutils_ext.markdown_writer import (LINE_WIDTH,
+                MarkdownWriter)
+        line_width = self.params.get('line_width')
+        if line_width == None:
+            line_width = LINE_WIDTH
+        return MarkdownWriter(
+                table_max_col_width=self.params.get('table_max_col_width'),
+                line_width=line_width)
+
+    def get_cache_key_parts(self, input_filename, output_filename):
+        parts = Converter.get_cache_key_parts(self, input_filename,
+                                              output_filename)
+        parts.extend([self.params.get('table_max_col_width'),
+                      self.params.get('line_width')])
+        return parts
+
+    def process_output(self, contents):
+        # process the output with a template if a template name was supplied.
+        if self.params['template_filename'] != None:
+            contents = process_with_template(contents.decode('utf-8'),
+                                             self.params,
+                                             self.writer.fields).encode('utf-8')
+        return contents
 
 
 def run():
@@ -92,42 +262,76 @@ def run():
     params = process_cmd_args()
 
     # check for the basics. Without these, we're lost...
-    if params['input_filename'] == None:
+    if (len(params['input_filenames']) == 0 and
+            params['manifest_filename'] == None):
         printerr("Wait, I need at *least* a filename to process!")
         print_usage_and_exit(1)
 
-    if not os.path.exists(params['input_filename']):
-        printerr("File doesn't exist: %s" % params['input_filename'])
+    for input_filename in params['input_filenames']:
+        if not os.path.exists(input_filename):
+            printerr("File doesn't exist: %s" % input_filename)
+            sys.exit(1)
+
+    if params['stream_output'] and params['template_filename'] != None:
+        printerr("A template can't be used when streaming the output.")
         sys.exit(1)
 
-    # get the file contents first
-    input_file_contents = open(params['input_filename'], 'rb').read()
-
-    docutils_writer = None
-    # set up the writer
-    docutils_writer = MarkdownWriter()
-
-    # get the markdown output.
-    overrides = {'input_encoding': 'utf-8',
-                 'output_encoding': 'utf-8'}
-    markdown_contents = publish_string(input_file_contents,
-                                      writer=docutils_writer,
-                                      settings_overrides=overrides)
-
-    # process the output with a template if a template name was supplied.
-    if params['template_filename'] != None:
-        markdown_contents = process_with_template(markdown_contents.decode('utf-8'),
-                                                 params,
-                                                 docutils_writer.fields).encode('utf-8')
-    # if there's an output file, write to that. Otherwise, write to stdout.
+    converter = MarkdownConverter(params)
+
+    # batch mode: convert everything into the output directory.
+    if params['output_dir'] != None:
+        jobs = get_batch_jobs(params, converter.output_extension)
+        if params['watch']:
+            from abstrys.watch import watch
+            watch(converter, jobs, params, converter.output_extension)
+        processes = params['processes']
+        if params['profile'] and processes != 1:
+            printerr("Profiling: converting in a single process.")
+            processes = 1
+        converter.start_profiling()
+        failures = run_batch(converter, jobs, processes)
+        converter.finish_profiling()
+        sys.exit(1 if failures else 0)
+
+    if (len(params['input_filenames']) != 1 or
+            os.path.isdir(params['input_filenames'][0])):
+        printerr("Use -d to set an output directory when converting more "
+                 "than one file.")
+        print_usage_and_exit(1)
+
+    if params['watch']:
+        if params['output_filename'] == None:
+            printerr("Use -o to set an output file when watching for "
+                     "changes.")
+            sys.exit(1)
+        from abstrys.watch import watch
+        watch(converter, [(params['input_filenames'][0],
+                           params['output_filename'])])
+
+    def write(output_file):
+        if params['stream_output']:
+            converter.convert_to_file(params['input_filenames'][0],
+                                      output_file, params['output_filename'])
+        else:
+            # get the markdown output.
+            markdown_contents = converter.convert(
+                    params['input_filenames'][0], params['output_filename'])
+            output_file.write(markdown_contents)
+        output_file.flush()
+
+    # if there's an output file, write to that (once the conversion has
+    # worked). Otherwise, write to stdout.
+    converter.start_profiling()
     if params['output_filename'] == None:
-        output_file = sys.stdout
+        write(getattr(sys.stdout, 'buffer', sys.stdout))
     else:
-        output_file = open(params['output_filename'], 'w+')
-
-    output_file.write(markdown_contents)
+        write_output_file(params['output_filename'], write)
+    converter.finish_profiling()
+    errors = converter.finish_images()
+    for error in errors:
+        printerr(error)
     # that's it, we're done here!
-    sys.exit(0)
+    sys.exit(1 if errors else 0)
 
 if __name__ == "__main__":
     run()
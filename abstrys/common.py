@@ -9,9 +9,14 @@
 #
 # by Eron Hennessey
 #
+import sys
+
 
 def printerr(error_text):
     """Prints an error message to stderr"""
     sys.stderr.write("ERROR -- %s\n" % error_text)
 
 
+def printwarn(warning_text):
+    """Prints a warning message to stderr"""
+    sys.stderr.write("WARNING -- %s\n" % warning_text)
@@ -13,12 +13,41 @@
 # * http://docutils.sourceforge.net/docs/ref/doctree.html
 #
 import os
+import posixpath
+import re
 import sys
 
 from docutils import nodes, writers
+from abstrys.docutils_ext.traversal import iter_tree, walkabout
 
 import lxml.etree as etree
 
+# the text type, which is str on Python 3.
+try:
+    unicode
+except NameError:
+    unicode = str
+
+
+XML_NS = 'http://www.w3.org/XML/1998/namespace'
+XML_ID = '{%s}id' % XML_NS
+
+# the characters that can't be used in an xml:id.
+_NON_ID_CHARACTERS = re.compile(r'[^\w.-]', re.UNICODE)
+
+# Elements that only ever contain other elements. When streaming, these are
+# written to the output as they're opened and closed; everything else is
+# collected into a small tree and written out as soon as it's closed.
+STREAMED_ELEMENTS = set([
+    'abstract', 'appendix', 'article', 'blockquote', 'book', 'caution',
+    'chapter', 'important', 'info', 'itemizedlist', 'listitem',
+    'mediaobject', 'note', 'orderedlist', 'part', 'preface', 'row',
+    'section', 'table', 'tbody', 'tgroup', 'thead', 'tip', 'variablelist',
+    'varlistentry', 'warning'])
+
+# The indentation used for each level of pretty-printed output.
+INDENT = '  '
+
 
 def _print_error(text, node = None):
     """Prints an error string and optionally, the node being worked on."""
@@ -27,22 +56,246 @@ def _print_error(text, node = None):
         sys.stderr.write(u"  %s\n" % unicode(node))
 
 
+def get_root_node(document):
+    """Returns the node that DocBookTranslator makes the root element of the
+    output: the document itself, if docutils has promoted its title, or else
+    its first section (or topic)."""
+    if len(document) > 0 and isinstance(document[0], nodes.title):
+        return document
+    # findall() replaced traverse() in docutils 0.18.
+    findall = getattr(document, 'findall', document.traverse)
+    for node in findall(lambda n: isinstance(n, (nodes.section,
+                                                 nodes.topic))):
+        return node
+    return None
+
+
+class _StreamedElement(object):
+    """Stands in for an element that has already been written out."""
+
+    def __init__(self, tag):
+        self.tag = tag
+        # pretty-printing is turned off for an element once it contains text,
+        # as it is with lxml's pretty_print.
+        self.format = True
+        self.has_children = False
+
+
+def _escape_text(text):
+    """Escapes text as lxml does when it serializes it."""
+    return (text.replace('&', '&amp;').replace('<', '&lt;')
+            .replace('>', '&gt;').replace('\r', '&#13;'))
+
+
+def _escape_attribute(value):
+    """Escapes an attribute value as lxml does when it serializes it."""
+    return (_escape_text(value).replace('"', '&quot;')
+            .replace('\n', '&#10;').replace('\t', '&#9;'))
+
+
+class StreamingTreeBuilder(object):
+    """Takes the place of lxml's TreeBuilder, but writes the document to a
+    file as it's built.
+
+    Only the elements that are currently open are kept in memory, along with
+    the block (paragraph, title, and so on) being built, so the memory used
+    doesn't grow with the size of the document. The output is the same as
+    etree.tostring(..., pretty_print=True) gives: the root element's start
+    tag is serialized by lxml itself, and the rest is written the way lxml
+    writes it. (lxml's own incremental writer can't be used, since it sorts
+    the namespace declarations, and declares the xml prefix.)"""
+
+    def __init__(self, output_file, output_xml_header=True):
+        self.output_file = output_file
+        if output_xml_header:
+            self._write("<?xml version='1.0' encoding='utf-8' "
+                        "standalone='yes'?>\n")
+        # the prefix of each namespace declared by the root element.
+        self.prefixes = {XML_NS: 'xml'}
+        # the stack of elements that have been started in the output.
+        self.stack = []
+        # the builder (and nesting depth) of the block currently being
+        # collected, if any.
+        self.block_tb = None
+        self.block_depth = 0
+        self.closed = False
+
+    def _write(self, text):
+        self.output_file.write(text.encode('utf-8'))
+
+    def _get_name(self, tag):
+        """Returns the name written for a tag or attribute name, with the
+        prefix of its namespace."""
+        if tag[0] != '{':
+            return tag
+        (namespace, name) = tag[1:].split('}', 1)
+        prefix = self.prefixes.get(namespace)
+        if prefix is None:
+            return name
+        return '%s:%s' % (prefix, name)
+
+    def _get_start_tag(self, tag, attribs, empty=False):
+        parts = ['<', self._get_name(tag)]
+        for (key, value) in attribs.items():
+            parts.append(' %s="%s"' % (self._get_name(key),
+                                       _escape_attribute(value)))
+        parts.append('/>' if empty else '>')
+        return ''.join(parts)
+
+    def _get_root_start_tag(self, tag, attribs, nsmap):
+        """Returns the root element's start tag, with its namespace
+        declarations, as lxml writes it."""
+        tag_text = etree.tostring(etree.Element(tag, attribs, nsmap=nsmap),
+                                  encoding='unicode')
+        for (prefix, namespace) in (nsmap or {}).items():
+            if prefix is not None:
+                self.prefixes[namespace] = prefix
+        # the element is empty, so it's written as <tag .../>.
+        return tag_text[:-2] + '>'
+
+    def _start_child(self):
+        """Indents the output for a new child of the current element."""
+        if self.stack:
+            parent = self.stack[-1]
+            parent.has_children = True
+            if parent.format:
+                self._write('\n' + INDENT * len(self.stack))
+
+    def start(self, tag, attribs, nsmap=None):
+        if self.block_tb is not None:
+            self.block_depth += 1
+            return self.block_tb.start(tag, attribs)
+        if self.stack and tag not in STREAMED_ELEMENTS:
+            self.block_tb = etree.TreeBuilder()
+            self.block_depth = 1
+            return self.block_tb.start(tag, attribs)
+        self._start_child()
+        # only the root element declares the namespaces.
+        if self.stack:
+            self._write(self._get_start_tag(tag, attribs))
+        else:
+            self._write(self._get_root_start_tag(tag, attribs, nsmap))
+        e = _StreamedElement(tag)
+        self.stack.append(e)
+        return e
+
+    def data(self, text):
+        if self.block_tb is not None:
+            self.block_tb.data(text)
+        elif self.stack:
+            self.stack[-1].format = False
+            self._write(_escape_text(text))
+
+    def end(self, tag):
+        if self.block_tb is not None:
+            self.block_depth -= 1
+            e = self.block_tb.end(tag)
+            if self.block_depth == 0:
+                self.block_tb = None
+                self._start_child()
+                self._write_block(e, len(self.stack), True)
+            return e
+        e = self.stack.pop()
+        if e.has_children and e.format:
+            self._write('\n' + INDENT * len(self.stack))
+        self._write('</%s>' % self._get_name(e.tag))
+        return e
+
+    def _write_block(self, e, level, format):
+        """Writes a finished block to the output."""
+        if e.text is None and len(e) == 0:
+            # an empty element is written as <tag/>, as lxml writes it.
+            self._write(self._get_start_tag(e.tag, e.attrib, True))
+            return
+        # as with lxml's pretty-printing, only elements with no text directly
+        # inside them get indented.
+        format = format and not e.text and not [c for c in e if c.tail]
+        self._write(self._get_start_tag(e.tag, e.attrib))
+        if e.text:
+            self._write(_escape_text(e.text))
+        for child in e:
+            if format:
+                self._write('\n' + INDENT * (level + 1))
+            self._write_block(child, level + 1, format)
+            if child.tail:
+                self._write(_escape_text(child.tail))
+        if format and len(e):
+            self._write('\n' + INDENT * level)
+        self._write('</%s>' % self._get_name(e.tag))
+
+    def close(self):
+        """Finishes the output. Returns None, since the document has already
+        been written."""
+        if not self.closed:
+            self.closed = True
+            self._write('\n')
+        return None
+
+
+def get_document_xml_id(docname):
+    """Returns the xml:id given to the root element of a document, made from
+    its name: characters that can't be used in an ID, such as the slashes of
+    a document in a subdirectory, become hyphens."""
+    xml_id = _NON_ID_CHARACTERS.sub('-', docname)
+    if not xml_id or not (xml_id[0].isalpha() or xml_id[0] == '_'):
+        xml_id = '_' + xml_id
+    return xml_id
+
+
+def get_id_aliases(document):
+    """Returns the ID written for each of a document's node IDs that isn't
+    written itself, by that ID. An element can only have one ID, but a node
+    can have several: a section has its own, and one for each label (target)
+    before it. The last of the labels is written, or the node's first ID if
+    it has none."""
+    target_ids = set(node['refid'] for node in iter_tree(document,
+                                                          nodes.target)
+                     if node.get('refid') not in (None, 'index-0'))
+    aliases = {}
+    for node in iter_tree(document, nodes.Element):
+        ids = node['ids']
+        if len(ids) < 2:
+            continue
+        written_id = ids[0]
+        for node_id in ids:
+            if node_id in target_ids:
+                written_id = node_id
+        for node_id in ids:
+            if node_id != written_id:
+                aliases[node_id] = written_id
+    return aliases
+
+
 class DocBookWriter(writers.Writer):
     """A docutils writer for DocBook."""
 
-    def __init__(self, root_element, document_id = None, output_xml_header=True):
+    def __init__(self, root_element, document_id = None, output_xml_header=True,
+                 output_file=None):
         """Initialize the writer. Takes the root element of the resulting
-        DocBook output as its sole argument."""
+        DocBook output as its sole argument.
+
+        If output_file (a file opened for writing bytes) is given, the output
+        is streamed to it as the document is translated, and the writer's
+        output will be empty."""
         writers.Writer.__init__(self)
         self.document_type = root_element
         self.document_id = document_id
         self.output_xml_header = output_xml_header
+        self.output_file = output_file
+        # set to a function that returns the fileref to write for each
+        # image's URI.
+        self.get_image_uri = None
+        # set to an abstrys.profiling.NodeProfiler to time the translator.
+        self.profiler = None
 
     def translate(self):
         """Call the translator to translate the document"""
         self.visitor = DocBookTranslator(self.document, self.document_type,
-                self.document_id, self.output_xml_header)
-        self.document.walkabout(self.visitor)
+                self.document_id, self.output_xml_header, self.output_file,
+                get_image_uri=self.get_image_uri)
+        if self.profiler is not None:
+            self.profiler.instrument(self.visitor)
+        walkabout(self.document, self.visitor)
         self.output = self.visitor.astext()
         self.fields = self.visitor.fields
 
@@ -50,27 +303,66 @@ class DocBookWriter(writers.Writer):
 class DocBookTranslator(nodes.NodeVisitor):
     """A docutils translator for DocBook."""
 
+    # the helper methods that are timed when profiling.
+    profiled_helpers = ('_push_element', '_pop_element')
+
     def __init__(self, document, document_type, document_id = None,
-                 output_xml_header=True):
+                 output_xml_header=True, output_file=None, root_aliases=None,
+                 get_image_uri=None, id_aliases=None):
         """Initialize the translator. Takes the root element of the resulting
-        DocBook output as its sole argument."""
+        DocBook output as its sole argument. If output_file is given, the
+        output is streamed to it instead of being returned by astext().
+
+        root_aliases gives, by document name, the IDs of the node that became
+        the root element of each of the other documents (see get_root_node());
+        links to them are made to the root element's ID instead. Similarly,
+        id_aliases gives the get_id_aliases() of each of the other
+        documents, and links to their nodes are made to the ID written.
+
+        If get_image_uri is given, it's called with each image's URI, and
+        returns the fileref to write (such as the URI of a copy of the
+        image)."""
         nodes.NodeVisitor.__init__(self, document)
         self.settings = document.settings
         self.content = []
         self.document_type = document_type
         self.document_id = document_id
+        # the root element's ID, made from the document's name.
+        self.root_id = None
+        if document_id != None:
+            self.root_id = get_document_xml_id(document_id)
         self.in_first_section = False
         self.output_xml_header = output_xml_header
 
         self.in_pre_block = False
         self.in_figure = False
         self.next_element_id = None
+        # the IDs given to elements that differ from their nodes' IDs, by
+        # id(node).
+        self.node_ids = {}
+        self.root_aliases = root_aliases or {}
+        self.id_aliases = id_aliases or {}
+        self.get_image_uri = get_image_uri
+        # the IDs of this document's root node, which all become its ID, and
+        # the ID written for each of the other IDs of its nodes.
+        self.own_root_aliases = set()
+        self.own_id_aliases = get_id_aliases(document)
+        # the (id, element) of each element given an ID, the title of each
+        # of them that has one, and the linkend of each link, for
+        # get_link_data().
+        self.link_targets = []
+        self.link_titles = {}
+        self.linkends = []
 
         # self.estack is a stack of etree nodes. The bottom of the stack should
         # always be the base element (the document). The top of the stack is
         # the element currently being processed.
         self.estack = []
-        self.tb = etree.TreeBuilder()
+        self.output_file = output_file
+        if output_file is not None:
+            self.tb = StreamingTreeBuilder(output_file, output_xml_header)
+        else:
+            self.tb = etree.TreeBuilder()
         self.fields = {}
         self.current_field_name = None
         self.nsmap = {'xml': 'http://www.w3.org/XML/1998/namespace',
@@ -86,8 +378,18 @@ class DocBookTranslator(nodes.NodeVisitor):
     # functions used by the translator.
     #
 
+    def astree(self):
+        """Returns the root element of the translated document. If the output
+        is being streamed, this finishes writing it and returns None."""
+        return self.tb.close()
+
+
     def astext(self):
-        doc = self.tb.close()
+        if self.output_file is not None:
+            # the output has already been written.
+            self.tb.close()
+            return b''
+        doc = self.astree()
         et = etree.ElementTree(doc)
         if self.output_xml_header:
             rep = etree.tostring(et, encoding="utf-8", standalone=True,
@@ -97,14 +399,32 @@ class DocBookTranslator(nodes.NodeVisitor):
         return rep
 
 
-    def _add_element_title(self, title_name, title_attribs = {}):
+    def get_link_data(self):
+        """Returns the IDs given to elements in the output, as [id, element,
+        title] lists, the linkends of its links, and the ID written for each
+        of the node IDs that weren't, in a dict with 'targets', 'links' and
+        'aliases' (see abstrys.link_index)."""
+        aliases = dict(self.own_id_aliases)
+        if self.root_id != None:
+            for node_id in self.own_root_aliases:
+                aliases[node_id] = self.root_id
+        return {'targets': [[target_id, element,
+                             self.link_titles.get(target_id)]
+                            for (target_id, element) in self.link_targets],
+                'links': self.linkends,
+                'aliases': aliases}
+
+
+    def _add_element_title(self, title_name, title_attribs=None):
         """Add a title to the current element."""
         self._push_element('title', title_attribs)
         self.tb.data(title_name)
-        return self.tb_end('title')
+        return self._pop_element()
 
 
-    def _push_element(self, name, attribs = {}):
+    def _push_element(self, name, attribs=None):
+        if attribs is None:
+            attribs = {}
         if self.next_element_id:
             attribs['{http://www.w3.org/XML/1998/namespace}id'] = self.next_element_id
             self.next_element_id = None
@@ -112,6 +432,8 @@ class DocBookTranslator(nodes.NodeVisitor):
             del attribs['{http://www.w3.org/XML/1998/namespace}id']
         e = self.tb.start(name, attribs, self.nsmap)
         self.estack.append(e)
+        if XML_ID in attribs:
+            self.link_targets.append((attribs[XML_ID], name))
         return e
 
 
@@ -124,13 +446,48 @@ class DocBookTranslator(nodes.NodeVisitor):
     # The document itself
     #
 
+    def _push_root_element(self, node):
+        """Start the root element, for the node (the document, or its first
+        section) that holds the document's title."""
+        self.node_ids[id(node)] = self.root_id
+        if self.root_id != None:
+            # the root element always gets the document's ID, so that links
+            # to the document find it, even if a target comes before it.
+            self.next_element_id = None
+            self.own_root_aliases = set(node['ids'])
+        self._push_element(self.document_type,
+                           {'{http://www.w3.org/XML/1998/namespace}id': self.root_id,
+                            'version': '5.0'})
+        self.in_first_section = True
+
+
+    def _get_node_id(self, node):
+        """Returns the ID given to the element made for a node, which may not
+        be the one in the doctree. The doctree itself is never changed, so
+        that it can be translated again (by another writer, for instance)."""
+        if id(node) in self.node_ids:
+            return self.node_ids[id(node)]
+        if len(node['ids']) > 0:
+            return self._get_written_id(node['ids'][0])
+        return None
+
+
+    def _get_written_id(self, node_id):
+        """Returns the ID written for one of the IDs of a node."""
+        return unicode(self.own_id_aliases.get(node_id, node_id))
+
+
     def visit_document(self, node):
-        """Create the document itself."""
-        pass
+        """Create the document itself. If docutils has promoted the title of
+        the first section to be the document's title, the document becomes
+        the root element."""
+        if len(node) > 0 and isinstance(node[0], nodes.title):
+            self._push_root_element(node)
 
 
     def depart_document(self, node):
-        pass
+        if id(node) in self.node_ids:
+            self._pop_element()
 
     #
     # document parts
@@ -152,12 +509,8 @@ class DocBookTranslator(nodes.NodeVisitor):
         if self.current_field_name is None:
             self._pop_element()
 
-    def visit_compact_paragraph(self, node):
-        self.visit_paragraph(node)
-
-
-    def depart_compact_paragraph(self, node):
-        self.depart_paragraph(node)
+    visit_compact_paragraph = visit_paragraph
+    depart_compact_paragraph = depart_paragraph
 
 
     def visit_section(self, node):
@@ -165,20 +518,16 @@ class DocBookTranslator(nodes.NodeVisitor):
         # Do something special if this is the very first section in the
         # document.
         if self.in_first_section == False:
-            node['ids'][0] = self.document_id
-            self._push_element(self.document_type,
-                               {'{http://www.w3.org/XML/1998/namespace}id': self.document_id,
-                                'version': '5.0'})
-            self.in_first_section = True
+            self._push_root_element(node)
             return
 
         if self.next_element_id:
-            node['ids'][0] = self.next_element_id
+            self.node_ids[id(node)] = self.next_element_id
             attribs['{http://www.w3.org/XML/1998/namespace}id'] = self.next_element_id
             self.next_element_id = None
         else:
             if len(node['ids']) > 0:
-                attribs['{http://www.w3.org/XML/1998/namespace}id'] = unicode(node['ids'][0])
+                attribs['{http://www.w3.org/XML/1998/namespace}id'] = self._get_written_id(node['ids'][0])
 
         self._push_element('section', attribs)
         # TODO - Collect other attributes.
@@ -205,14 +554,6 @@ class DocBookTranslator(nodes.NodeVisitor):
         self._pop_element()
 
 
-    def visit_address(self, node):
-        self.visit_literal_block(node)
-
-
-    def depart_address(self, node):
-        self.depart_literal_block(node)
-
-
     def visit_comment(self, node):
         # ignore comments in the output.
         _print_error("ignoring comment:", node)
@@ -291,13 +632,16 @@ class DocBookTranslator(nodes.NodeVisitor):
 
     def visit_title(self, node):
         attribs = {}
+        parent_id = self._get_node_id(node.parent)
         # first check to see if an {http://www.w3.org/XML/1998/namespace}id was supplied.
         if len(node['ids']) > 0:
-            attribs['{http://www.w3.org/XML/1998/namespace}id'] = unicode(node['ids'][0])
-        elif len(node.parent['ids']) > 0:
+            attribs['{http://www.w3.org/XML/1998/namespace}id'] = self._get_written_id(node['ids'][0])
+        elif parent_id != None:
             # If the parent node has an ID, we can use that and add '.title' at
             # the end to make a deterministic title ID.
-            attribs['{http://www.w3.org/XML/1998/namespace}id'] = '%s.title' % unicode(node.parent['ids'][0])
+            attribs['{http://www.w3.org/XML/1998/namespace}id'] = '%s.title' % parent_id
+        if parent_id != None:
+            self.link_titles[parent_id] = node.astext()
         self._push_element('title', attribs)
 
 
@@ -321,18 +665,45 @@ class DocBookTranslator(nodes.NodeVisitor):
         self._pop_element()
 
 
-    def visit_topic(self, node):
-        self.visit_section(node)
-
-
-    def depart_topic(self, node):
-        self.depart_section(node)
+    visit_topic = visit_section
+    depart_topic = depart_section
 
 
     #
     # link parts
     #
 
+    def _get_linkend(self, refuri):
+        """Returns the linkend for an internal reference: the ID in the URI's
+        fragment or, if it has none, the ID of the document it names, which
+        is made from the document's name. Links to the IDs of a document's
+        root node are made to the document's ID."""
+        (path, sep, fragment) = refuri.partition('#')
+        if path:
+            # the path is relative to this document.
+            docname = posixpath.normpath(posixpath.join(
+                    posixpath.dirname(self.document_id or ''),
+                    os.path.splitext(path)[0]))
+        else:
+            docname = self.document_id
+        if docname == self.document_id:
+            aliases = self.own_root_aliases
+            id_aliases = self.own_id_aliases
+        else:
+            aliases = self.root_aliases.get(docname, ())
+            id_aliases = self.id_aliases.get(docname, {})
+        if not fragment or fragment in aliases:
+            if docname is None:
+                return None
+            return get_document_xml_id(docname)
+        return id_aliases.get(fragment, fragment)
+
+
+    def _push_link(self, linkend):
+        self.linkends.append(linkend)
+        self._push_element('link', {'linkend': linkend})
+
+
     def visit_reference(self, node):
         internal_ref = False
 
@@ -342,19 +713,19 @@ class DocBookTranslator(nodes.NodeVisitor):
 
         # internal ref style #2: it hides as an external ref, with strange
         # qualities.
+        refuri = node.get('refuri')
         if (node.hasattr('anonymous') and (node['anonymous'] == 1) and
-                node.hasattr('refuri') and (node['refuri'][0] == '_')):
+                refuri and (refuri[0] == '_')):
             internal_ref = True
-            node['refuri'] = node['refuri'][1:]
+            refuri = refuri[1:]
 
         if node.hasattr('refid'):
-            self._push_element('link', {'linkend': node['refid']})
-        elif node.hasattr('refuri'):
+            self._push_link(self._get_linkend('#' + node['refid']))
+        elif refuri != None:
             if internal_ref:
-                ref_name = os.path.splitext(node['refuri'])[0]
-                self._push_element('link', {'linkend': ref_name})
+                self._push_link(self._get_linkend(refuri))
             else:
-                self._push_element('link', {'{http://www.w3.org/1999/xlink}href': node['refuri']})
+                self._push_element('link', {'{http://www.w3.org/1999/xlink}href': refuri})
         else:
             _print_error('unknown reference', node)
 
@@ -369,7 +740,7 @@ class DocBookTranslator(nodes.NodeVisitor):
             if node['refid'] == 'index-0':
                 return
             else:
-                self.next_element_id = node['refid']
+                self.next_element_id = self._get_written_id(node['refid'])
 
 
     def depart_target(self, node):
@@ -429,12 +800,8 @@ class DocBookTranslator(nodes.NodeVisitor):
         self._pop_element()
 
 
-    def visit_definition(self, node):
-        self.visit_list_item(node)
-
-
-    def depart_definition(self, node):
-        self.depart_list_item(node)
+    visit_definition = visit_list_item
+    depart_definition = depart_list_item
 
 
     def visit_field_list(self, node):
@@ -461,7 +828,7 @@ class DocBookTranslator(nodes.NodeVisitor):
         elif name == 'date':
             self._push_element('pubdate')
         self.current_field_name = name
-        raise self.SkipNode
+        raise nodes.SkipNode
 
     def depart_field_name(self, node):
         pass
@@ -471,7 +838,7 @@ class DocBookTranslator(nodes.NodeVisitor):
             value = node.astext()
             self.fields[self.current_field_name] = value
         else:
-            node.clear()
+            raise nodes.SkipNode
 
     def depart_field_body(self, node):
         if self.current_field_name:
@@ -498,7 +865,10 @@ class DocBookTranslator(nodes.NodeVisitor):
         imagedata_attribs = {}
 
         if node.hasattr('uri'):
-            imagedata_attribs['fileref'] = node['uri']
+            if self.get_image_uri is not None:
+                imagedata_attribs['fileref'] = self.get_image_uri(node['uri'])
+            else:
+                imagedata_attribs['fileref'] = node['uri']
         else:
             # unknown attribute
             imagedata_attribs['eek'] = unicode(node)
@@ -693,6 +1063,10 @@ class DocBookTranslator(nodes.NodeVisitor):
         self._pop_element()
         self.in_pre_block = False
 
+    # addresses are written as literal blocks, keeping their line breaks.
+    visit_address = visit_literal_block
+    depart_address = depart_literal_block
+
 
     def visit_literal(self, node):
         self._push_element('code')
@@ -719,19 +1093,11 @@ class DocBookTranslator(nodes.NodeVisitor):
         self.visit_note(node)
 
 
-    def depart_admonition(self, node):
-        self.depart_note(node)
-
-
     def visit_attention(self, node):
         self.visit_important(node)
         self._add_element_title('Attention')
 
 
-    def depart_attention(self, node):
-        self.depart_important(node)
-
-
     def visit_caution(self, node):
         self._push_element('caution')
 
@@ -745,28 +1111,16 @@ class DocBookTranslator(nodes.NodeVisitor):
         self._add_element_title('Danger')
 
 
-    def depart_danger(self, node):
-        self.depart_warning(node)
-
-
     def visit_error(self, node):
         self.visit_important(node)
         self._add_element_title('Error')
 
 
-    def depart_error(self, node):
-        self.depart_important(node)
-
-
     def visit_hint(self, node):
         self.visit_tip(node)
         self._add_element_title('Hint')
 
 
-    def depart_hint(self, node):
-        self.depart_tip(node)
-
-
     def visit_important(self, node):
         self._push_element('important')
 
@@ -798,6 +1152,14 @@ class DocBookTranslator(nodes.NodeVisitor):
     def depart_warning(self, node):
         self._pop_element()
 
+    # the other admonitions are closed in the same way as the ones they're
+    # written as.
+    depart_admonition = depart_note
+    depart_attention = depart_important
+    depart_danger = depart_warning
+    depart_error = depart_important
+    depart_hint = depart_tip
+
     #
     # Error encountered...
     #
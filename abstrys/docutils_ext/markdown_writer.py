@@ -13,13 +13,124 @@
 # * http://docutils.sourceforge.net/docs/ref/doctree.html
 #
 import os
+import posixpath
+import re
 import sys
+import unicodedata
 
 from docutils import nodes, writers
-from textwrap import TextWrapper
+from abstrys.docutils_ext.traversal import iter_tree, walkabout
+
+# the text type, which is str on Python 3.
+try:
+    unicode
+except NameError:
+    unicode = str
 
 LINE_WIDTH = 78
 
+# the characters that separate words when wrapping (other than spaces), as
+# for textwrap.
+_WHITESPACE = dict((ord(c), u' ') for c in u'\t\n\x0b\x0c\r')
+
+# the narrowest a table column can be: the header bar needs at least three
+# dashes.
+MIN_COL_WIDTH = 3
+
+# the characters that GitHub leaves out of the anchors made for headings.
+_SLUG_PUNCTUATION = re.compile(r'[^\w\- ]', re.UNICODE)
+
+# URIs that start with a scheme (such as http: or mailto:) or a host.
+_EXTERNAL_URI = re.compile(r'^([a-zA-Z][a-zA-Z0-9+.-]*:|//)')
+
+def wrap_text(text, width, initial_indent='', subsequent_indent=''):
+    """Wraps text into lines no longer than width (counting the indents),
+    and returns them as a list. If width is None, the text is put on a
+    single line.
+
+    This gives the same results as textwrap.TextWrapper (with
+    break_long_words=False) in a single pass over the words, except that
+    lines are never broken after a hyphen, since Markdown would show the
+    line break as a space. Words longer than a line get a line to
+    themselves, and the spacing between words on a line is kept."""
+    # each run of n spaces between two words gives n - 1 empty strings.
+    words = text.expandtabs().translate(_WHITESPACE).split(' ')
+    lines = []
+    line = [initial_indent]
+    line_len = len(initial_indent)
+    line_has_words = False
+    spaces = 0
+    for word in words:
+        if not word:
+            spaces += 1
+            continue
+        if line_has_words:
+            spaces += 1
+            if width is not None and line_len + spaces + len(word) > width:
+                lines.append(''.join(line))
+                line = [subsequent_indent]
+                line_len = len(subsequent_indent)
+                spaces = 0
+        elif width is not None and line_len + spaces + len(word) > width:
+            # leading spaces that leave no room for the first word are
+            # dropped.
+            spaces = 0
+        if spaces:
+            line.append(' ' * spaces)
+            line_len += spaces
+            spaces = 0
+        line.append(word)
+        line_len += len(word)
+        line_has_words = True
+    if line_has_words:
+        lines.append(''.join(line))
+    return lines
+
+
+def get_slug(text):
+    """Returns the anchor that GitHub makes for a heading: its text in lower
+    case, without punctuation, and with hyphens for spaces."""
+    return _SLUG_PUNCTUATION.sub('', text.strip().lower()).replace(' ', '-')
+
+
+def get_anchors(document):
+    """Returns the anchors of the headings in a document's Markdown output,
+    by the IDs of the nodes they're written for: every title (along with the
+    section, topic or table it belongs to) and definition list term. As
+    GitHub does, repeated anchors have -1, -2 and so on added to them."""
+    anchors = {}
+    counts = {}
+    for node in iter_tree(document, (nodes.title, nodes.term)):
+        slug = get_slug(node.astext())
+        if slug in counts:
+            counts[slug] += 1
+            slug = '%s-%d' % (slug, counts[slug])
+        else:
+            counts[slug] = 0
+        ids = node['ids']
+        if isinstance(node, nodes.title):
+            ids = ids + node.parent['ids']
+        for node_id in ids:
+            anchors.setdefault(node_id, slug)
+    return anchors
+
+
+def _text_width(text):
+    """Returns the number of columns text takes up, counting wide (East
+    Asian) characters as two."""
+    try:
+        text.encode('ascii')
+        return len(text)
+    except UnicodeError:
+        pass
+    width = 0
+    for c in text:
+        if unicodedata.combining(c):
+            continue
+        width += 2 if unicodedata.east_asian_width(c) in ('W', 'F') else 1
+    return width
+
+
 def _print_error(text, node = None):
     """Prints an error string and optionally, the node being worked on."""
     sys.stderr.write('\n%s: %s\n' % (__name__, text))
@@ -27,6 +138,17 @@ def _print_error(text, node = None):
         sys.stderr.write(u"  %s\n" % unicode(node))
 
 
+class StreamingBody(object):
+    """Stands in for the translator's list of output strings, writing each
+    one to a file (encoded as UTF-8) as soon as it's added."""
+
+    def __init__(self, output_file):
+        self.output_file = output_file
+
+    def append(self, text):
+        self.output_file.write(text.encode('utf-8'))
+
+
 class MarkdownWriter(writers.Writer):
     """A docutils writer for Markdown."""
 
@@ -34,23 +156,59 @@ class MarkdownWriter(writers.Writer):
     supported = ('markdown',)
     output = None
 
-    def __init__(self):
-        """Initialize the writer. Takes the root element of the resulting
-        Markdown output as its sole argument."""
+    def __init__(self, output_file=None, table_max_col_width=None,
+                 line_width=LINE_WIDTH, anchor_index=None):
+        """Initialize the writer.
+
+        If output_file (a file opened for writing bytes) is given, the output
+        is written to it as each block of the document is finished, and the
+        writer's output will be empty.
+
+        If table_max_col_width is given, table columns aren't padded out any
+        wider than that, though longer cells are still written in full.
+
+        Paragraphs are wrapped to line_width characters. If it's None (or
+        0), each paragraph is written on a single line.
+
+        anchor_index gives the anchors (see get_anchors()) of each of a set
+        of documents, by name, for resolving links between them. Set docname
+        to the name of each document before writing it.
+
+        Set get_image_uri to a function to have it called with each image's
+        URI, returning the URI to write (such as that of a copy of the
+        image)."""
         writers.Writer.__init__(self)
         self.translator_class = MarkdownTranslator
+        self.output_file = output_file
+        self.table_max_col_width = table_max_col_width
+        self.line_width = line_width
+        self.anchor_index = anchor_index
+        self.docname = None
+        self.get_image_uri = None
+        # the (node, uri) of each reference in the last document written
+        # that couldn't be resolved.
+        self.unresolved_refs = []
+        # set to an abstrys.profiling.NodeProfiler to time the translator.
+        self.profiler = None
 
     def translate(self):
-        visitor = self.translator_class(self.document)
-        self.document.walkabout(visitor)
+        visitor = self.translator_class(self.document,
+                output_file=self.output_file,
+                table_max_col_width=self.table_max_col_width,
+                line_width=self.line_width, docname=self.docname,
+                anchor_index=self.anchor_index,
+                get_image_uri=self.get_image_uri)
+        if self.profiler is not None:
+            self.profiler.instrument(visitor)
+        walkabout(self.document, visitor)
         self.output = visitor.astext()
+        self.unresolved_refs = visitor.unresolved_refs
+        self.fields = {}
 
 
 class MarkdownTranslator(nodes.NodeVisitor):
     """A docutils translator for Markdown."""
 
-    body_content = ""
-    cur_para = ""
     section_level = 1
     indent = ""
     extra_indent = ""
@@ -59,25 +217,60 @@ class MarkdownTranslator(nodes.NodeVisitor):
     enumerated_list = False
     deindent_first = False
 
-    def __init__(self, document):
-        """Initialize the translator."""
+    # the helper methods that are timed when profiling.
+    profiled_helpers = ('_wrap_lines_indented', '_print_lines_indented',
+                        '_print_table')
+
+    def __init__(self, document, output_file=None, table_max_col_width=None,
+                 line_width=LINE_WIDTH, docname=None, anchor_index=None,
+                 get_image_uri=None):
+        """Initialize the translator. If output_file is given, the output is
+        streamed to it instead of being returned by astext(). If
+        get_image_uri is given, it returns the URI to write for each image's
+        URI."""
         nodes.NodeVisitor.__init__(self, document)
-        self.wrapper = TextWrapper(width=LINE_WIDTH, break_long_words=False)
+        self.table_max_col_width = table_max_col_width
+        self.line_width = line_width or None
+        # the anchors of this document's headings and of those of the other
+        # documents, for resolving links, and the references that couldn't
+        # be resolved.
+        self.docname = docname
+        self.anchors = get_anchors(document)
+        self.anchor_index = anchor_index or {}
+        self.unresolved_refs = []
+        self.get_image_uri = get_image_uri
+        # the line prefixes, by indent and quote level.
+        self.line_prefixes = {}
+        # the output and the text of the current paragraph are both collected
+        # as lists of strings, and only joined once they're complete.
+        self.output_file = output_file
+        if output_file is not None:
+            self.body = StreamingBody(output_file)
+        else:
+            self.body = []
+        self.cur_para = []
 
     def astext(self):
-        return self.body_content
+        if self.output_file is not None:
+            # the output has already been written.
+            return ''
+        return ''.join(self.body)
 
     #
     # some useful functions for formatting things.
     #
 
     def _get_line_prefix(self):
-        return self.indent + ('> ' * self.quote_level)
+        key = (self.indent, self.quote_level)
+        prefix = self.line_prefixes.get(key)
+        if prefix is None:
+            prefix = self.indent + ('> ' * self.quote_level)
+            self.line_prefixes[key] = prefix
+        return prefix
 
     def _print_line_indented(self, text=""):
         """Prints a single line, indented (and possibly quoted)."""
-        line = (self._get_line_prefix() + text.rstrip() + '\n')
-        self.body_content += line
+        self.body.append(self._get_line_prefix() + text.rstrip() + '\n')
 
     def _print_lines_indented(self, text):
         """Prints a group of lines, indented (and possibly quoted)."""
@@ -85,7 +278,7 @@ class MarkdownTranslator(nodes.NodeVisitor):
         lines = text.splitlines()
         for line in lines:
             if self.deindent_first:
-                self.body_content += line
+                self.body.append(line)
                 self.deindent_first = False
             else:
                 self._print_line_indented(line)
@@ -93,13 +286,12 @@ class MarkdownTranslator(nodes.NodeVisitor):
     def _wrap_lines_indented(self, text):
         """Wraps a group of lines, indented (and possibly quoted)."""
         line_prefix = self._get_line_prefix()
-        self.wrapper.initial_indent = line_prefix
-        self.wrapper.subsequent_indent = line_prefix + self.extra_indent
-        wrapped_text = self.wrapper.fill(self.cur_para)
+        wrapped_text = '\n'.join(wrap_text(text, self.line_width, line_prefix,
+                                           line_prefix + self.extra_indent))
         if self.deindent_first:
             wrapped_text = wrapped_text[len(line_prefix):]
             self.deindent_first = False
-        self.body_content += wrapped_text.rstrip() + '\n'
+        self.body.append(wrapped_text.rstrip() + '\n')
 
     def _start_admonition(self, node, title):
         self.quote_level += 1
@@ -125,7 +317,7 @@ class MarkdownTranslator(nodes.NodeVisitor):
     #
 
     def visit_Text(self, node):
-        self.cur_para += node.astext()
+        self.cur_para.append(node.astext())
 
     def depart_Text(self, node):
         pass
@@ -135,13 +327,14 @@ class MarkdownTranslator(nodes.NodeVisitor):
         pass
 
     def depart_paragraph(self, node):
+        para_text = ''.join(self.cur_para)
         if self.in_literal:
-            self._print_lines_indented(self.cur_para)
+            self._print_lines_indented(para_text)
         else:
-            self._wrap_lines_indented(self.cur_para)
+            self._wrap_lines_indented(para_text)
         self._print_line_indented()
         # clear the collected para content.
-        self.cur_para = ""
+        self.cur_para = []
 
     def visit_section(self, node):
         self.section_level += 1
@@ -177,9 +370,9 @@ class MarkdownTranslator(nodes.NodeVisitor):
 
     def visit_list_item(self, node):
         if self.enumerated_list:
-            self.body_content += (self._get_line_prefix() + "1. ")
+            self.body.append(self._get_line_prefix() + "1. ")
         else:
-            self.body_content += (self._get_line_prefix() + "* ")
+            self.body.append(self._get_line_prefix() + "* ")
         self.indent += "    "
         self.deindent_first = True
 
@@ -202,17 +395,8 @@ class MarkdownTranslator(nodes.NodeVisitor):
     def depart_definition_list_item(self, node):
         self.section_level -= 1
 
-    def visit_term(self, node):
-        self.visit_title(node)
-
-    def depart_term(self, node):
-        self.depart_title(node)
-
-    def visit_definition(self, node):
-        self.visit_block_quote(node)
-
-    def depart_definition(self, node):
-        self.depart_block_quote(node)
+    visit_definition = visit_block_quote
+    depart_definition = depart_block_quote
 
 
     # description
@@ -225,17 +409,17 @@ class MarkdownTranslator(nodes.NodeVisitor):
 
     # emphasis
     def visit_emphasis(self, node):
-        self.cur_para += "*"
+        self.cur_para.append("*")
 
     def depart_emphasis(self, node):
-        self.cur_para += "*"
+        self.cur_para.append("*")
 
     # strong
     def visit_strong(self, node):
-        self.cur_para += "**"
+        self.cur_para.append("**")
 
     def depart_strong(self, node):
-        self.cur_para += "**"
+        self.cur_para.append("**")
 
 
     # field
@@ -289,6 +473,8 @@ class MarkdownTranslator(nodes.NodeVisitor):
             alt_text = node['alt']
         if 'uri' in node:
             uri = node['uri']
+            if self.get_image_uri is not None:
+                uri = self.get_image_uri(uri)
         return (uri, alt_text)
 
     def visit_image(self, node):
@@ -349,21 +535,18 @@ class MarkdownTranslator(nodes.NodeVisitor):
 
     # literal inlines
     def visit_literal(self, node):
-        self.cur_para += "`%s`" % node.astext()
+        self.cur_para.append("`%s`" % node.astext())
         raise nodes.SkipNode
 
     def depart_literal(self, node):
         pass
 
-    def visit_inline(self, node):
-        self.visit_literal(node)
-
-    def depart_inline(self, node):
-        self.depart_literal(node)
+    visit_inline = visit_literal
+    depart_inline = depart_literal
 
     def visit_literal_strong(self, node):
         # not a normal reST element; this is added by Sphinx.
-        self.cur_para += "**`%s`**" % node.astext()
+        self.cur_para.append("**`%s`**" % node.astext())
         raise nodes.SkipNode
 
     def depart_literal_strong(self, node):
@@ -428,24 +611,46 @@ class MarkdownTranslator(nodes.NodeVisitor):
     # links and references
     #
 
+    def _get_link_uri(self, node, uri):
+        """Returns the URI for a link. Other documents are given the .md
+        extension, and IDs are replaced by the anchors of the headings they
+        belong to. If the document (when there's an anchor index) or the ID
+        can't be found, the reference is added to unresolved_refs."""
+        if _EXTERNAL_URI.match(uri):
+            return uri
+        (path, sep, fragment) = uri.partition('#')
+        if path:
+            if path.endswith('.md'):
+                path = path[:-3]
+            # the path is relative to this document.
+            docname = posixpath.normpath(posixpath.join(
+                    posixpath.dirname(self.docname or ''), path))
+            anchors = self.anchor_index.get(docname)
+            if anchors is None and self.anchor_index:
+                self.unresolved_refs.append((node, uri))
+            path += '.md'
+        else:
+            anchors = self.anchors
+        if fragment and anchors is not None:
+            if fragment in anchors:
+                fragment = anchors[fragment]
+            else:
+                self.unresolved_refs.append((node, uri))
+        if fragment:
+            return '%s#%s' % (path, fragment)
+        return path
+
     def visit_reference(self, node):
         text = ""
         if 'refuri' in node:
-            uri = node['refuri']
-            print("visit_reference")
-            print("---------------")
-            print(node.parent)
-            print("\n")
-            print(node)
-            print("\n")
-            if not uri.startswith('http'):
-                uri = uri + '.md'
-            text = ("[%s](%s)" % (node.astext(), uri))
+            text = ("[%s](%s)" % (node.astext(),
+                                  self._get_link_uri(node, node['refuri'])))
         elif 'refid' in node:
-            text = ("[%s](#%s)" % (node.astext(), node['refid']))
+            text = ("[%s](%s)" % (node.astext(),
+                    self._get_link_uri(node, '#' + node['refid'])))
         else:
             text = node.astext()
-        self.cur_para += text
+        self.cur_para.append(text)
         raise nodes.SkipNode
 
     def depart_reference(self, node):
@@ -453,62 +658,126 @@ class MarkdownTranslator(nodes.NodeVisitor):
 
 
     # table
+    #
+    # Tables are written as pipe tables, laid out when the tgroup is reached,
+    # in two passes over the rows: the first writes each cell only to measure
+    # it, and the second writes each row again and prints it, padded to the
+    # widest cell in each column. Only one row is held at a time, so very
+    # long tables don't use much memory, and they're streamed with -s.
     def visit_table(self, node):
         pass
 
     def depart_table(self, node):
         self._print_line_indented()
 
-    def visit_tgroup(self, node):
-        self.table_cols = int(node['cols'])
-        self.table_col_widths = []
-
-    def depart_tgroup(self, node):
-        self.table_cols = 0
-
-    def visit_colspec(self, node):
-        self.table_col_widths.append(int(node['colwidth']))
-
-    def depart_colspec(self, node):
-        pass
-
-    def visit_tbody(self, node):
-        pass
-
-    def depart_tbody(self, node):
-        pass
-
-    def visit_thead(self, node):
-        pass
-
-    def depart_thead(self, node):
-        header_bar = self._get_line_prefix() + '| '
-        for w in self.table_col_widths:
-            header_bar += (('-' * w) + ' | ')
-        header_bar = header_bar[:-1] + '\n'
-        self.body_content += header_bar
-
-    def visit_entry(self, node):
-        pass
-
-    def depart_entry(self, node):
-        pass
+    def _get_cell_text(self, entry):
+        """Returns the Markdown for a table entry on a single line, with any
+        pipes escaped. The entry's contents are written by the translator
+        itself, unwrapped and unindented, so that emphasis, literals and
+        links are kept."""
+        saved = (self.body, self.cur_para, self.indent, self.extra_indent,
+                 self.quote_level, self.line_width, self.deindent_first)
+        self.body = []
+        self.cur_para = []
+        self.indent = self.extra_indent = ''
+        self.quote_level = 0
+        self.line_width = None
+        self.deindent_first = False
+        try:
+            for child in entry.children:
+                walkabout(child, self)
+            text = ''.join(self.body) + ''.join(self.cur_para)
+        finally:
+            (self.body, self.cur_para, self.indent, self.extra_indent,
+             self.quote_level, self.line_width, self.deindent_first) = saved
+        lines = [line.strip() for line in text.splitlines()]
+        return ' '.join(line for line in lines if line).replace('|', '\\|')
+
+    def _get_row_cells(self, row, spans):
+        """Returns the text of each column in a row. Cells that span more
+        than one column or row are followed by empty cells in the columns
+        and rows they cover; spans holds the number of rows still covered in
+        each column."""
+        cells = []
+        entries = iter(row.children)
+        while len(cells) < len(spans):
+            col = len(cells)
+            if spans[col] > 0:
+                spans[col] -= 1
+                cells.append('')
+                continue
+            entry = next(entries, None)
+            if entry is None:
+                cells.append('')
+                continue
+            cells.append(self._get_cell_text(entry))
+            spans[col] = entry.get('morerows', 0)
+            for i in range(entry.get('morecols', 0)):
+                if len(cells) < len(spans):
+                    spans[len(cells)] = entry.get('morerows', 0)
+                    cells.append('')
+        return cells
+
+    def _print_table_row(self, cells, widths):
+        row_text = [self._get_line_prefix(), '|']
+        for (text, width) in zip(cells, widths):
+            row_text.append(' ')
+            row_text.append(text)
+            row_text.append(' ' * (max(width - _text_width(text), 0) + 1))
+            row_text.append('|')
+        row_text.append('\n')
+        self.body.append(''.join(row_text))
+
+    def _iter_table_rows(self, tgroup, cols):
+        """Yields (is_header, cells) for each row of a table, with the text
+        of each of its columns."""
+        spans = [0] * cols
+        for part in tgroup.children:
+            if isinstance(part, nodes.thead):
+                is_header = True
+            elif isinstance(part, nodes.tbody):
+                is_header = False
+            else:
+                # colspecs: the widths in the source don't matter here.
+                continue
+            for row in part.children:
+                yield (is_header, self._get_row_cells(row, spans))
+
+    def _print_table_bar(self, header_rows, cols, widths):
+        """Writes the bar beneath a table's header. Markdown tables must
+        have a header, so a table without one is given an empty one."""
+        if header_rows == 0:
+            self._print_table_row([''] * cols, widths)
+        self._print_table_row(['-' * w for w in widths], widths)
+
+    def _print_table(self, tgroup, cols, widths):
+        """Writes a table's rows, one at a time."""
+        header_rows = 0
+        printed_bar = False
+        for (is_header, cells) in self._iter_table_rows(tgroup, cols):
+            if is_header:
+                header_rows += 1
+            elif not printed_bar:
+                self._print_table_bar(header_rows, cols, widths)
+                printed_bar = True
+            self._print_table_row(cells, widths)
+        if not printed_bar:
+            self._print_table_bar(header_rows, cols, widths)
 
-    def visit_row(self, node):
-        row_text = self._get_line_prefix() + '| '
-        cur_entry = 0
-        for entry in node.children:
-            # remove any newlines in the entry's text.
-            entry_text = ' '.join(entry.astext().splitlines())
-            row_text += entry_text.ljust(self.table_col_widths[cur_entry]) + ' | '
-            cur_entry += 1
-        row_text = row_text[:-1] + '\n'
-        self.body_content += row_text
+    def visit_tgroup(self, node):
+        cols = int(node['cols'])
+        widths = [MIN_COL_WIDTH] * cols
+        max_width = self.table_max_col_width
+        for (is_header, cells) in self._iter_table_rows(node, cols):
+            for (i, text) in enumerate(cells):
+                width = _text_width(text)
+                if max_width != None:
+                    width = min(width, max_width)
+                if width > widths[i]:
+                    widths[i] = width
+        self._print_table(node, cols, widths)
         raise nodes.SkipNode
 
-    def depart_row(self, node):
-        pass
-
 
     # target
     def visit_target(self, node):
@@ -520,12 +789,16 @@ class MarkdownTranslator(nodes.NodeVisitor):
 
     # title
     def visit_title(self, node):
-        self.body_content += "\n%s %s\n\n" % (("#" * self.section_level), node.astext())
+        self.body.append("\n%s %s\n\n" % (("#" * self.section_level), node.astext()))
         raise nodes.SkipNode
 
     def depart_title(self, node):
         pass
 
+    # definition list terms are written as headings.
+    visit_term = visit_title
+    depart_term = depart_title
+
     def visit_substitution_definition(self, node):
         # ignore these...
         raise nodes.SkipNode
@@ -558,11 +831,8 @@ class MarkdownTranslator(nodes.NodeVisitor):
     def depart_compound(self, node):
         pass
 
-    def visit_compact_paragraph(self, node):
-        self.visit_paragraph(node)
-
-    def depart_compact_paragraph(self, node):
-        self.depart_paragraph(node)
+    visit_compact_paragraph = visit_paragraph
+    depart_compact_paragraph = depart_paragraph
 
     # title_reference
     def visit_title_reference(self, node):
@@ -573,7 +843,7 @@ class MarkdownTranslator(nodes.NodeVisitor):
 
 
     def visit_problematic(self, node):
-        print("found problematic node!")
+        _print_error('problematic node', node)
 
     def depart_problematic(self, node):
         pass
@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+#
+# ##############################
+# abstrys.docutils_ext.traversal
+# ##############################
+#
+# Doctree traversal for the translators.
+#
+# docutils' NodeVisitor.dispatch_visit() and dispatch_departure() build a
+# method name and look it up for every node entered and left. Instead, each
+# translator class gets a dispatch table the first time it's used, mapping
+# each node class to its visit and depart handlers, and walkabout() calls
+# the handlers straight from the table.
+#
+# by Eron Hennessey
+#
+
+from docutils import nodes
+
+
+class DispatchTable(object):
+    """The visit and depart handlers of a translator class, by node class.
+
+    The handlers for docutils' own node classes are looked up when the table
+    is made; those for any other node classes (such as Sphinx's) are looked
+    up the first time one is seen. Node classes without a handler use the
+    translator's unknown_visit() and unknown_departure()."""
+
+    def __init__(self, translator_class):
+        self.translator_class = translator_class
+        self.handlers = {}
+        for name in nodes.node_class_names:
+            self.get(getattr(nodes, name))
+
+    def get(self, node_class):
+        """Returns the (visit, depart) functions for a node class. They're
+        called with the translator and the node."""
+        handlers = self.handlers.get(node_class)
+        if handlers is None:
+            name = node_class.__name__
+            translator_class = self.translator_class
+            handlers = (
+                    getattr(translator_class, 'visit_' + name,
+                            translator_class.unknown_visit),
+                    getattr(translator_class, 'depart_' + name,
+                            translator_class.unknown_departure))
+            # in Python 2, these are unbound methods, which won't accept a
+            # subclass of the translator; use the functions beneath them.
+            handlers = tuple(getattr(f, '__func__', f) for f in handlers)
+            self.handlers[node_class] = handlers
+        return handlers
+
+
+def get_dispatch_table(translator_class):
+    """Returns the dispatch table for a translator class, making it the
+    first time it's asked for."""
+    # each subclass gets a table of its own, rather than its parent's.
+    table = translator_class.__dict__.get('_dispatch_table')
+    if table is None:
+        table = DispatchTable(translator_class)
+        translator_class._dispatch_table = table
+    return table
+
+
+def _call_dispatch_visit(visitor, node):
+    return visitor.dispatch_visit(node)
+
+
+def _call_dispatch_departure(visitor, node):
+    return visitor.dispatch_departure(node)
+
+
+def _get_handler_lookup(visitor):
+    """Returns a function that gives the (visit, depart) handlers for a node
+    class. If the visitor's own dispatch methods have been replaced on the
+    instance (as abstrys.profiling does), they're always used instead of the
+    dispatch table."""
+    if ('dispatch_visit' in visitor.__dict__ or
+            'dispatch_departure' in visitor.__dict__):
+        handlers = (_call_dispatch_visit, _call_dispatch_departure)
+        return lambda node_class: handlers
+    return get_dispatch_table(visitor.__class__).get
+
+
+# marks a traversal that's been stopped, once the StopTraversal exception has
+# been handled.
+_STOPPED = object()
+
+
+def _walkabout(node, visitor, get_handlers):
+    # Rather than recursing once per level of the tree, which fails on deeply
+    # nested documents, the nodes whose children are being walked are kept
+    # on a stack, as (node, depart, call_depart, siblings), where siblings
+    # iterates over the rest of the node's siblings; children iterates over
+    # the rest of the children of the node on top of the stack.
+    #
+    # Each TreePruningException is handled where Node.walkabout() would
+    # handle it, including those raised by depart handlers, which it passes
+    # on to the walk of the parent node. pending is the exception that the
+    # node on top of the stack has to handle, or _STOPPED.
+    handlers = {}
+    get_known_handlers = handlers.get
+    stack = []
+    push = stack.append
+    pop = stack.pop
+    children = None
+    while True:
+        node_class = node.__class__
+        node_handlers = get_known_handlers(node_class)
+        if node_handlers is None:
+            node_handlers = handlers[node_class] = get_handlers(node_class)
+        (visit, depart) = node_handlers
+        call_depart = True
+        pending = None
+        try:
+            visit(visitor, node)
+        except nodes.SkipNode:
+            call_depart = False
+            node_children = None
+        except nodes.SkipDeparture:
+            call_depart = False
+            node_children = node.children
+        except nodes.SkipChildren:
+            node_children = None
+        except nodes.StopTraversal:
+            node_children = None
+            pending = _STOPPED
+        except nodes.SkipSiblings as e:
+            call_depart = False
+            node_children = None
+            pending = e
+        else:
+            node_children = node.children
+        if node_children:
+            push((node, depart, call_depart, children))
+            children = iter(node_children[:])
+            node = next(children)
+            continue
+        if call_depart:
+            try:
+                depart(visitor, node)
+            except nodes.TreePruningException as e:
+                pending = e
+
+        # the node is done; move on to its next sibling, finishing each node
+        # on the stack that has no more children to walk.
+        while stack:
+            if pending is None:
+                node = next(children, None)
+                if node is not None:
+                    break
+            elif pending is _STOPPED:
+                pass
+            elif isinstance(pending, nodes.StopTraversal):
+                pending = _STOPPED
+            elif isinstance(pending, (nodes.SkipSiblings,
+                                      nodes.SkipChildren)):
+                pending = None
+            else:
+                # not handled by this node's walk; it isn't departed.
+                children = pop()[3]
+                continue
+            (parent, depart, call_depart, children) = pop()
+            if call_depart:
+                try:
+                    depart(visitor, parent)
+                except nodes.TreePruningException as e:
+                    pending = e
+        else:
+            if pending is None:
+                return False
+            elif pending is _STOPPED:
+                return True
+            raise pending
+
+
+def iter_tree(node, node_class=None):
+    """Yields node and every node beneath it, in document order, as
+    node.findall() does, but without recursing, so that deeply nested
+    documents can be searched. If node_class is given, only the nodes that
+    are instances of it are yielded."""
+    stack = [node]
+    pop = stack.pop
+    extend = stack.extend
+    while stack:
+        node = pop()
+        if node_class is None or isinstance(node, node_class):
+            yield node
+        children = node.children
+        if children:
+            extend(reversed(children))
+
+
+def walkabout(node, visitor):
+    """Walks the tree beneath node with visitor, as node.walkabout(visitor)
+    does, calling each node's handlers through the dispatch table. Returns
+    True if the traversal was stopped."""
+    return _walkabout(node, visitor, _get_handler_lookup(visitor))
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+#
+# ##################
+# abstrys.link_index
+# ##################
+#
+# An index of the IDs given to elements in a set of DocBook documents, and of
+# the links (linkends) between them, so that dangling links and duplicate IDs
+# can be found without validating the assembled output.
+#
+# Each document's part of the index is what DocBookTranslator.get_link_data()
+# returns: a dict with its 'targets', as [id, element, title] lists, its
+# 'links', as a list of linkends, and its 'aliases': the other IDs of the
+# nodes that targets were made for, each with the ID that was written. All of
+# it can be kept as JSON, so that the parts for unchanged documents don't
+# have to be made again.
+#
+# by Eron Hennessey
+#
+
+# json and lxml are imported by the functions that use them, so that loading
+# this module doesn't slow down the command-line tools.
+
+
+class LinkIndex(object):
+    """The IDs defined by a set of DocBook documents, and the links between
+    them."""
+
+    def __init__(self):
+        # each document's link data, by name.
+        self.documents = {}
+        # the names of the documents defining each ID, and of those with
+        # elements given each ID, made when first needed.
+        self._ids = None
+        self._target_ids = None
+
+    def add_document(self, docname, link_data):
+        """Adds (or replaces) a document's link data."""
+        self.documents[docname] = link_data
+        self._ids = None
+        self._target_ids = None
+
+    def get_target_ids(self):
+        """Returns a dict of the names of the documents with elements given
+        each ID. An ID given to more than one element in a document is listed
+        each time."""
+        if self._target_ids is None:
+            ids = {}
+            for docname in sorted(self.documents):
+                for target in self.documents[docname]['targets']:
+                    ids.setdefault(target[0], []).append(docname)
+            self._target_ids = ids
+        return self._target_ids
+
+    def get_ids(self):
+        """Returns a dict of the names of the documents that define each ID,
+        either by giving it to an element or as an alias of one that is."""
+        if self._ids is None:
+            ids = dict((target_id, list(docnames)) for (target_id, docnames)
+                       in self.get_target_ids().items())
+            for docname in sorted(self.documents):
+                for alias in sorted(self.documents[docname].get('aliases',
+                                                                {})):
+                    ids.setdefault(alias, []).append(docname)
+            self._ids = ids
+        return self._ids
+
+    def find(self, target_id):
+        """Returns the name of the document that defines an ID, or None."""
+        docnames = self.get_ids().get(target_id)
+        if docnames is None:
+            return None
+        return docnames[0]
+
+    def get_dangling_links(self):
+        """Returns the links to IDs that aren't defined by any document, as
+        sorted (docname, linkend) pairs."""
+        ids = self.get_ids()
+        dangling = []
+        for docname in sorted(self.documents):
+            for linkend in sorted(set(self.documents[docname]['links'])):
+                if linkend not in ids:
+                    dangling.append((docname, linkend))
+        return dangling
+
+    def get_duplicate_ids(self):
+        """Returns the IDs that are given to more than one element, as sorted
+        (id, docnames) pairs."""
+        return sorted((target_id, docnames)
+                      for (target_id, docnames)
+                      in self.get_target_ids().items()
+                      if len(docnames) > 1)
+
+    def write_json(self, filename):
+        """Writes the index as JSON: each document's link data, under
+        'documents', and the document defining each ID, under 'ids'."""
+        import json
+        ids = dict((target_id, docnames[0])
+                   for (target_id, docnames) in self.get_ids().items())
+        with open(filename, 'w') as output_file:
+            json.dump({'documents': self.documents, 'ids': ids}, output_file,
+                      indent=1, sort_keys=True)
+
+    @classmethod
+    def read_json(cls, filename):
+        """Returns the index written to filename by write_json()."""
+        import json
+        index = cls()
+        with open(filename) as input_file:
+            index.documents = json.load(input_file)['documents']
+        return index
+
+    def write_olink_db(self, filename, get_uri):
+        """Writes the index as an olink target database, for resolving olinks
+        with the DocBook XSL stylesheets. get_uri(docname) returns the URI of
+        a document's output; the first target in each document is its root
+        element."""
+        import lxml.etree as etree
+        targetset = etree.Element('targetset')
+        etree.SubElement(targetset, 'targetsetinfo')
+        sitemap = etree.SubElement(targetset, 'sitemap')
+        directory = etree.SubElement(sitemap, 'dir', {'name': '.'})
+        for docname in sorted(self.documents):
+            uri = get_uri(docname)
+            document = etree.SubElement(directory, 'document',
+                                        {'targetdoc': docname,
+                                         'baseuri': uri})
+            parent = document
+            for (i, (target_id, element, title)) in enumerate(
+                    self.documents[docname]['targets']):
+                # everything else in the document is beneath its root.
+                attribs = {'element': element, 'targetptr': target_id,
+                           'href': '%s#%s' % (uri, target_id)}
+                target = etree.SubElement(parent, 'div' if i == 0 else 'obj',
+                                          attribs)
+                etree.SubElement(target, 'ttl').text = title
+                etree.SubElement(target, 'xreftext').text = title
+                if i == 0:
+                    parent = target
+        with open(filename, 'wb') as output_file:
+            output_file.write(etree.tostring(etree.ElementTree(targetset),
+                    encoding='utf-8', xml_declaration=True,
+                    pretty_print=True))
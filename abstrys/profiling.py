@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+#
+# #################
+# abstrys.profiling
+# #################
+#
+# Optional instrumentation for the translators, which records how often each
+# visit_*/depart_* handler is called and how long it takes, totalled by
+# handler and by node class.
+#
+# Nothing here is used unless profiling has been turned on: a translator is
+# only instrumented when a writer or builder has been given a NodeProfiler,
+# and instrumenting one wraps the methods of that instance alone.
+#
+# by Eron Hennessey
+#
+
+import sys
+import time
+
+try:
+    _timer = time.perf_counter
+except AttributeError:
+    _timer = time.time
+
+# the number of functions to show from cProfile's statistics.
+CPROFILE_LINES = 40
+
+
+class NodeProfiler(object):
+    """Collects timings from every translator it instruments, optionally
+    running cProfile at the same time."""
+
+    def __init__(self, use_cprofile=False):
+        # each of these maps a name to [calls, total time].
+        self.handlers = {}
+        self.node_classes = {}
+        self.helpers = {}
+        self.cprofile = None
+        if use_cprofile:
+            import cProfile
+            self.cprofile = cProfile.Profile()
+
+    def _add(self, table, name, elapsed):
+        entry = table.get(name)
+        if entry is None:
+            table[name] = [1, elapsed]
+        else:
+            entry[0] += 1
+            entry[1] += elapsed
+
+    def _timed_dispatch(self, dispatch, prefix):
+        handlers = self.handlers
+        node_classes = self.node_classes
+        add = self._add
+
+        def timed_dispatch(node):
+            start = _timer()
+            try:
+                return dispatch(node)
+            finally:
+                elapsed = _timer() - start
+                node_class = node.__class__.__name__
+                add(handlers, prefix + node_class, elapsed)
+                add(node_classes, node_class, elapsed)
+        return timed_dispatch
+
+    def _timed_helper(self, method, name):
+        helpers = self.helpers
+        add = self._add
+
+        def timed_helper(*args, **kwargs):
+            start = _timer()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                add(helpers, name, _timer() - start)
+        return timed_helper
+
+    def instrument(self, visitor):
+        """Wraps the visitor's dispatch methods, and the helper methods named
+        in its profiled_helpers attribute, so that each call is timed."""
+        visitor.dispatch_visit = self._timed_dispatch(
+                visitor.dispatch_visit, 'visit_')
+        visitor.dispatch_departure = self._timed_dispatch(
+                visitor.dispatch_departure, 'depart_')
+        for name in getattr(visitor, 'profiled_helpers', ()):
+            setattr(visitor, name,
+                    self._timed_helper(getattr(visitor, name), name))
+
+    def start(self):
+        if self.cprofile is not None:
+            self.cprofile.enable()
+
+    def stop(self):
+        if self.cprofile is not None:
+            self.cprofile.disable()
+
+    def _format_table(self, title, table):
+        lines = [title, '',
+                 '%10s %12s %14s  %s' % ('calls', 'total ms', 'per call us',
+                                         'name')]
+        entries = sorted(table.items(), key=lambda item: item[1][1],
+                         reverse=True)
+        for (name, (calls, total)) in entries:
+            lines.append('%10d %12.3f %14.3f  %s' % (calls, total * 1000,
+                                                     total * 1000000 / calls,
+                                                     name))
+        lines.append('')
+        return lines
+
+    def get_report(self):
+        """Returns the report as text, with the slowest entries first."""
+        lines = []
+        lines.extend(self._format_table(
+                "Handlers (time spent in each handler, not counting the "
+                "node's children):", self.handlers))
+        lines.extend(self._format_table(
+                "Node classes (visit and depart handlers together):",
+                self.node_classes))
+        if self.helpers:
+            lines.extend(self._format_table(
+                    "Helpers (also counted in the handlers that call them):",
+                    self.helpers))
+        report = '\n'.join(lines)
+        if self.cprofile is not None:
+            import pstats
+            try:
+                # Python 2's pstats writes byte strings.
+                from cStringIO import StringIO
+            except ImportError:
+                from io import StringIO
+            stream = StringIO()
+            stats = pstats.Stats(self.cprofile, stream=stream)
+            stats.sort_stats('cumulative').print_stats(CPROFILE_LINES)
+            report += '\ncProfile:\n' + stream.getvalue()
+        return report
+
+    def write_report(self, filename=None):
+        """Writes the report to filename, or to stderr if there isn't one."""
+        report = self.get_report()
+        if filename is None:
+            sys.stderr.write(report + '\n')
+        else:
+            with open(filename, 'w') as report_file:
+                report_file.write(report + '\n')
+
+
+def parse_profile_option(arg, params):
+    """Handles the --profile[=report_file] and --cprofile command-line
+    options, setting the matching params. Returns False if arg isn't one of
+    them."""
+    (name, sep, value) = arg[2:].partition('=')
+    if name == 'profile':
+        params['profile'] = True
+        if value:
+            params['profile_filename'] = value
+    elif name == 'cprofile':
+        params['profile'] = True
+        params['cprofile'] = True
+    else:
+        return False
+    return True
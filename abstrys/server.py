@@ -0,0 +1,280 @@
+# -*- coding: utf-8 -*-
+#
+# ##############
+# abstrys.server
+# ##############
+#
+# A long-running conversion server, for editors and build tools that convert
+# documents many times over. docutils, lxml, the writers and any templates
+# are loaded once, and kept ready for each request, so converting a typical
+# page takes milliseconds rather than the time it takes to start Python.
+#
+# The server listens on a Unix domain socket. See abstrys.client for the
+# message framing and for a command-line client. Each connection is answered
+# on a thread of its own, so a client that keeps its connection open doesn't
+# hold up the others; documents are converted one at a time.
+#
+# **Requests** are JSON objects with a 'command':
+#
+# * 'convert' (the default) converts a document. The source is given either
+#   as 'input' (the reST text) or as 'input_filename'. 'format' is 'db' or
+#   'md', and 'root_element' and 'template_filename' can be given as for the
+#   command-line tools. If 'output_filename' is given, the output is written
+#   to that file (and the DocBook root element's ID is taken from it);
+#   otherwise it's returned as 'output'. 'source_path' can be given with
+#   'input' to say where included files are found.
+#
+# * 'ping' checks that the server is running.
+#
+# * 'shutdown' stops the server.
+#
+# **Responses** have 'ok' set to true or false. If it's false, 'error' says
+# what went wrong.
+#
+# by Eron Hennessey
+#
+
+import os
+import socket
+import sys
+import threading
+
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver
+
+from abstrys.cache import DEFAULT_MAX_SIZE, parse_size
+from abstrys.client import (get_default_socket_path, receive_message,
+        send_message)
+from abstrys.common import printerr
+
+
+USAGE = """
+serve - run a conversion server for rst2db and rst2md
+
+**Usage:**
+
+:
+python -m abstrys serve [-S socket_path] [-c cache_dir] [-l cache_limit]
+
+Use ``python -m abstrys client`` to send documents to the server. Stop the
+server with Ctrl-C, or with ``python -m abstrys client stop``.
+
+**Settings:**
+
+-S *socket_path*    listen on this socket (default: %s). Only
+                  the user running the server can connect to it.
+
+-c *cache_dir*      keep converted documents in cache_dir, as rst2db and
+                  rst2md do.
+
+-l *cache_limit*    the maximum size of the cache directory (default: 512M).
+        """
+
+# the formats that can be asked for, and the modules and classes that convert
+# them.
+FORMATS = {'db': ('abstrys.cmd_rst2db', 'DocBookConverter'),
+           'md': ('abstrys.cmd_rst2md', 'MarkdownConverter')}
+
+# a small document that's converted when the server starts, so that the
+# parser and writers are ready before the first request arrives.
+WARM_UP_DOCUMENT = b"""
+Warm up
+=======
+
+A paragraph with *emphasis*, a `link <http://example.com>`_ and a list:
+
+* One.
+* Two.
+"""
+
+
+class ConversionServer(object):
+    """Converts documents for requests, keeping a converter ready for each
+    combination of format, root element and template that's asked for."""
+
+    def __init__(self, params):
+        self.params = params
+        self.converters = {}
+        self.running = True
+        # the converters aren't thread-safe, so only one document is
+        # converted at a time.
+        self.lock = threading.Lock()
+
+    def get_converter(self, request):
+        fmt = request.get('format', 'db')
+        if fmt not in FORMATS:
+            raise ValueError("Unknown format: %s" % fmt)
+        root_element = request.get('root_element') or 'section'
+        template_filename = request.get('template_filename')
+        key = (fmt, root_element, template_filename)
+        converter = self.converters.get(key)
+        if converter is None:
+            (module_name, class_name) = FORMATS[fmt]
+            __import__(module_name)
+            converter_class = getattr(sys.modules[module_name], class_name)
+            converter = converter_class({
+                    'root_element': root_element,
+                    'template_filename': template_filename,
+                    'cache_dir': self.params['cache_dir'],
+                    'cache_limit': self.params['cache_limit']})
+            converter.prepare()
+            self.converters[key] = converter
+        return converter
+
+    def warm_up(self):
+        """Converts a small document in each format."""
+        for fmt in sorted(FORMATS):
+            converter = self.get_converter({'format': fmt})
+            converter.convert_contents(WARM_UP_DOCUMENT)
+
+    def convert(self, request):
+        converter = self.get_converter(request)
+        output_filename = request.get('output_filename')
+        if 'input' in request:
+            contents = converter.convert_contents(
+                    request['input'].encode('utf-8'),
+                    request.get('source_path'), output_filename)
+        else:
+            contents = converter.convert(request['input_filename'],
+                                         output_filename)
+        if output_filename != None:
+            output_dir = os.path.dirname(output_filename)
+            if output_dir and not os.path.isdir(output_dir):
+                os.makedirs(output_dir)
+            with open(output_filename, 'wb') as output_file:
+                output_file.write(contents)
+            return {'ok': True}
+        return {'ok': True, 'output': contents.decode('utf-8')}
+
+    def handle_request(self, request):
+        """Returns the response to a request. Errors in converting a document
+        are returned to the client, rather than stopping the server."""
+        command = request.get('command', 'convert')
+        if command == 'ping':
+            return {'ok': True}
+        if command == 'shutdown':
+            self.running = False
+            return {'ok': True}
+        if command != 'convert':
+            return {'ok': False, 'error': "Unknown command: %s" % command}
+        try:
+            with self.lock:
+                return self.convert(request)
+        except SystemExit:
+            # docutils exits when it finds a serious error in the document.
+            return {'ok': False, 'error': "The document couldn't be converted."}
+        except Exception as e:
+            return {'ok': False, 'error': "%s: %s" % (e.__class__.__name__, e)}
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    """Answers each request sent over a connection, until it's closed."""
+
+    def handle(self):
+        conversion_server = self.server.conversion_server
+        while conversion_server.running:
+            request = receive_message(self.rfile)
+            if request is None:
+                break
+            send_message(self.wfile, conversion_server.handle_request(request))
+        if not conversion_server.running:
+            # this runs on a thread of its own, so it can wait for the
+            # server's loop to stop.
+            self.server.shutdown()
+
+
+class _ThreadingUnixStreamServer(socketserver.ThreadingMixIn,
+                                 socketserver.UnixStreamServer):
+    """Answers each connection on a thread of its own."""
+    daemon_threads = True
+
+
+def _remove_stale_socket(socket_path):
+    """Removes a socket left behind by a server that's no longer running.
+    Returns False if another server is still using it."""
+    if not os.path.exists(socket_path):
+        return True
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        s.connect(socket_path)
+    except (IOError, OSError):
+        os.remove(socket_path)
+        return True
+    finally:
+        s.close()
+    return False
+
+
+def serve(params):
+    """Runs the server until it's asked to shut down or is interrupted."""
+    socket_path = params['socket_path']
+    if not _remove_stale_socket(socket_path):
+        printerr("A server is already running on %s" % socket_path)
+        sys.exit(1)
+
+    conversion_server = ConversionServer(params)
+    conversion_server.warm_up()
+
+    # create the socket so that only this user can connect to it.
+    old_umask = os.umask(0o177)
+    try:
+        server = _ThreadingUnixStreamServer(socket_path, _RequestHandler)
+    finally:
+        os.umask(old_umask)
+    server.conversion_server = conversion_server
+    print("Listening on %s" % socket_path)
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.remove(socket_path)
+
+
+def print_usage_and_exit(return_code=0):
+    print(USAGE % get_default_socket_path())
+    sys.exit(return_code)
+
+
+def process_cmd_args(args):
+    params = {'socket_path': get_default_socket_path(),
+              'cache_dir': None,
+              'cache_limit': DEFAULT_MAX_SIZE}
+    last_switch = None
+    for arg in args:
+        if arg[0] == '-':
+            if arg[1] == 'h' or arg[1] == '?':
+                print_usage_and_exit()
+            last_switch = arg[1]
+        else:
+            if last_switch == 'S':  # the socket path
+                params['socket_path'] = arg
+            elif last_switch == 'c':  # the cache directory
+                params['cache_dir'] = arg
+            elif last_switch == 'l':  # the cache size limit
+                params['cache_limit'] = parse_size(arg)
+            else:
+                printerr("Unexpected argument: %s" % arg)
+                print_usage_and_exit(1)
+            last_switch = None
+    return params
+
+
+def run(args=None):
+    """The main procedure."""
+    if args is None:
+        args = sys.argv[1:]
+    if not hasattr(socket, 'AF_UNIX'):
+        printerr("The server needs Unix domain sockets, which aren't "
+                 "available on this system.")
+        sys.exit(1)
+    serve(process_cmd_args(args))
+    sys.exit(0)
+
+
+if __name__ == "__main__":
+    run()
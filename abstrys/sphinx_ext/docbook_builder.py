@@ -7,29 +7,158 @@
 #
 # by Eron Hennessey
 
-from abstrys.docutils_ext.docbook_writer import DocBookWriter
-from docutils.core import publish_from_doctree
+from abstrys import __version__
+from abstrys.assets import AssetCopier, add_doctree_images, get_relative_uri
+from abstrys.cache import file_digest, make_key
+from abstrys.docutils_ext.docbook_writer import (DocBookTranslator,
+        get_id_aliases, get_root_node)
+from abstrys.docutils_ext.traversal import walkabout
+from abstrys.link_index import LinkIndex
+from abstrys.profiling import NodeProfiler
+from abstrys.templates import get_template
 from sphinx.builders.text import TextBuilder
-import os, sys
+from sphinx.environment.collectors import EnvironmentCollector
+from sphinx.util import logging
+import lxml.etree as etree
+import json, os, sys
+
+logger = logging.getLogger(__name__)
+
+# The namespaces declared on the book element when assembling a book.
+BOOK_NSMAP = {None: 'http://docbook.org/ns/docbook',
+              'xlink': 'http://www.w3.org/1999/xlink',
+              'xi': 'http://www.w3.org/2001/XInclude'}
+
+def _get_root_aliases(env):
+    if not hasattr(env, 'docbook_root_aliases'):
+        env.docbook_root_aliases = {}
+    return env.docbook_root_aliases
+
+
+def _get_id_aliases(env):
+    if not hasattr(env, 'docbook_id_aliases'):
+        env.docbook_id_aliases = {}
+    return env.docbook_id_aliases
+
+
+class RootIdCollector(EnvironmentCollector):
+    """Records the IDs of the node that becomes the root element of each
+    document's DocBook output. The root element is given the document's name
+    as its ID, so links to any of these are made to that instead.
+
+    The other node IDs that aren't written (see get_id_aliases()) are
+    recorded too, so that links to them can be made to the ID that is."""
+
+    def clear_doc(self, app, env, docname):
+        _get_root_aliases(env).pop(docname, None)
+        _get_id_aliases(env).pop(docname, None)
+
+    def merge_other(self, app, env, docnames, other):
+        for get_aliases in (_get_root_aliases, _get_id_aliases):
+            aliases = get_aliases(env)
+            other_aliases = get_aliases(other)
+            for docname in docnames:
+                if docname in other_aliases:
+                    aliases[docname] = other_aliases[docname]
+
+    def process_doc(self, app, doctree):
+        root = get_root_node(doctree)
+        _get_root_aliases(app.env)[app.env.docname] = (
+                list(root['ids']) if root is not None else [])
+        _get_id_aliases(app.env)[app.env.docname] = get_id_aliases(doctree)
+
 
 class DocBookBuilder(TextBuilder):
     """Build DocBook documents from a Sphinx doctree"""
     name = 'docbook'
+    out_suffix = '.xml'
 
-    def process_with_template(self, contents):
-        """Process the results with a moustache-style template.
+    # each document is written by its own writer and translator, so documents
+    # can be written in parallel.
+    allow_parallel = True
 
-        The template variables can be specified as {{data.root_element}} and
-        {{data.contents}}. You can use this to create a custom DocBook header
-        for your final output."""
+    # records the settings used for the last build, in the output directory.
+    fingerprint_filename = '.docbook_fingerprint'
+
+    def get_fingerprint(self):
+        """Returns a hash of everything other than the documents themselves
+        that affects the output: the builder settings, the contents of the
+        template file and the version of this package."""
+        template_filename = self.config.docbook_template_file
+        template_digest = None
+        if template_filename != None:
+            template_digest = file_digest(
+                    os.path.join(self.srcdir, template_filename))
+        return make_key(__version__,
+                        self.config.docbook_default_root_element,
+                        template_filename, template_digest,
+                        self.config.docbook_book_mode,
+                        self.get_collects_links(),
+                        self.config.docbook_image_dir)
+
+
+    def get_collects_links(self):
+        """Returns True if the IDs and links of each document are collected,
+        to be checked or written out at the end of the build."""
+        return (self.config.docbook_check_links or
+                self.config.docbook_link_index != None or
+                self.config.docbook_olink_db != None)
+
+
+    def read_fingerprint(self):
+        """Returns the fingerprint saved by the last build, if any."""
+        try:
+            with open(os.path.join(self.outdir,
+                                   self.fingerprint_filename)) as f:
+                return f.read().strip()
+        except (IOError, OSError):
+            return None
+
+
+    def get_outdated_docs(self):
+        """Yields the documents that need to be written: those whose output is
+        missing or older than their source or doctree. If the template or the
+        builder settings have changed since the last build, every document is
+        out of date."""
+        rebuild_all = (self.get_fingerprint() != self.read_fingerprint())
+        if self.config.docbook_book_mode == 'single':
+            # the book is assembled from every document in finish(), so
+            # there are no separate files to check.
+            rebuild_all = True
+        for docname in self.env.found_docs:
+            if rebuild_all or docname not in self.env.all_docs:
+                yield docname
+                continue
+            targetname = os.path.join(self.outdir, docname + self.out_suffix)
+            try:
+                targetmtime = os.path.getmtime(targetname)
+            except OSError:
+                targetmtime = 0
+            try:
+                doctreemtime = os.path.getmtime(
+                        os.path.join(self.doctreedir, docname + '.doctree'))
+            except OSError:
+                doctreemtime = 0
+            try:
+                srcmtime = os.path.getmtime(self.env.doc2path(docname))
+                if max(srcmtime, doctreemtime) > targetmtime:
+                    yield docname
+            except OSError:
+                # source doesn't exist anymore
+                pass
+
+
+    def load_template(self):
+        """Load and compile the template file. This is done once, before any
+        documents are written."""
         try:
             import jinja2
         except ImportError:
             sys.stderr.write("DocBookBuilder -- Jinja2 is not installed: can't use template!\n")
             sys.exit(1)
 
-        full_template_path = os.path.join(sphinx_app.env.srcdir,
-                        sphinx_app.config.docbook_template_file)
+        full_template_path = os.path.join(self.srcdir,
+                        self.config.docbook_template_file)
 
         if not os.path.exists(full_template_path):
             sys.stderr.write(
@@ -37,60 +166,316 @@ class DocBookBuilder(TextBuilder):
                     full_template_path)
             sys.exit(1)
 
-        data = { 'root_element': self.root_element,
-                 'contents': contents }
-
-        jinja2env = jinja2.Environment(
-                loader=jinja2.FileSystemLoader(sphinx_app.env.srcdir),
-                trim_blocks=True)
-
         try:
-            t = jinja2env.get_template(self.template_filename)
-            t.render(data=data)
-        except:
+            # compiled templates are kept with the doctrees.
+            return get_template(self.template_filename, self.srcdir,
+                    os.path.join(self.doctreedir, 'templates'))
+        except jinja2.TemplateError:
             sys.stderr.write(
                     "DocBookBuilder -- Jinja2 couldn't load template at: %s" %
                     full_template_path)
             sys.exit(1)
 
-        return t.render(data=data)
+
+    def process_with_template(self, contents):
+        """Process the results with a moustache-style template.
+
+        The template variables can be specified as {{data.root_element}} and
+        {{data.contents}}. You can use this to create a custom DocBook header
+        for your final output."""
+        data = { 'root_element': self.root_element,
+                 'contents': contents }
+        return self.template.render(data=data)
 
 
     def get_target_uri(self, docname, typ=None):
        return './%s.xml' % docname
 
 
+    def get_link_data_filename(self, docname):
+        """Returns the file that a document's link data is kept in, with the
+        doctrees, so that it's still there for the documents that aren't
+        written again by the next build."""
+        return os.path.join(self.doctreedir, 'docbook_links',
+                            docname + '.json')
+
+
+    def save_link_data(self, docname, link_data):
+        if self.config.docbook_book_mode == 'single':
+            # the whole book is written in this process, in finish().
+            self.link_data[docname] = link_data
+            return
+        filename = self.get_link_data_filename(docname)
+        dirname = os.path.dirname(filename)
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        with open(filename, 'w') as f:
+            json.dump(link_data, f)
+
+
+    def get_link_index(self):
+        """Returns the index of the IDs and links of every document."""
+        index = LinkIndex()
+        if self.config.docbook_book_mode == 'single':
+            # only the documents in the book.
+            for (docname, link_data) in self.link_data.items():
+                index.add_document(docname, link_data)
+            return index
+        for docname in self.env.all_docs:
+            link_data = self.link_data.get(docname)
+            if link_data is None:
+                try:
+                    with open(self.get_link_data_filename(docname)) as f:
+                        link_data = json.load(f)
+                except (IOError, OSError, ValueError):
+                    continue
+            index.add_document(docname, link_data)
+        return index
+
+
+    def finish_links(self):
+        """Reports the dangling links and duplicate IDs found in the
+        documents, and writes the link index and olink target database, if
+        they've been asked for."""
+        index = self.get_link_index()
+        if self.config.docbook_check_links:
+            for (docname, linkend) in index.get_dangling_links():
+                logger.warning("link to a missing ID: %s" % linkend,
+                               location=docname)
+            for (target_id, docnames) in index.get_duplicate_ids():
+                logger.warning("ID given to more than one element: %s (in %s)"
+                               % (target_id, ', '.join(sorted(set(docnames)))))
+        if self.config.docbook_link_index != None:
+            index.write_json(os.path.join(self.outdir,
+                                          self.config.docbook_link_index))
+        if self.config.docbook_olink_db != None:
+            if self.config.docbook_book_mode == 'single':
+                book_uri = self.config.docbook_book_filename
+                get_uri = lambda docname: book_uri
+            else:
+                get_uri = lambda docname: docname + self.out_suffix
+            index.write_olink_db(os.path.join(self.outdir,
+                                              self.config.docbook_olink_db),
+                                 get_uri)
+
+
     def prepare_writing(self, docnames):
-        self.root_element = sphinx_app.config.docbook_default_root_element
-        self.template_filename = sphinx_app.config.docbook_template_file
+        self.root_element = self.config.docbook_default_root_element
+        if self.config.docbook_book_mode != None:
+            # each document is a chapter of the book.
+            self.root_element = 'chapter'
+        self.template_filename = self.config.docbook_template_file
+        self.template = None
+        if self.template_filename != None:
+            self.template = self.load_template()
+        # the IDs of each document's root node, the IDs written for the
+        # others that aren't, and the link data collected in this process.
+        self.root_aliases = dict(
+                (docname, frozenset(ids)) for (docname, ids)
+                in _get_root_aliases(self.env).items())
+        self.id_aliases = _get_id_aliases(self.env)
+        self.link_data = {}
+        self.book_written = False
+        # the copier for the documents' images, if they're copied, and the
+        # path of the copy of each image, by its URI.
+        self.assets = None
+        self.image_paths = {}
+        if self.config.docbook_image_dir != None:
+            self.assets = AssetCopier(
+                    os.path.join(self.outdir, self.config.docbook_image_dir),
+                    os.path.join(self.doctreedir, 'docbook_images.json'))
+        self.profiler = None
+        if self.config.docbook_profile != None:
+            self.profiler = NodeProfiler()
+            # the timings are collected in this process, so documents can't
+            # be written by others in parallel.
+            self.parallel_ok = False
 
 
-    def write_doc(self, docname, doctree):
+    def write_doc_serialized(self, docname, doctree):
+        # this is called in the main process, even when documents are written
+        # in parallel, so each image is only hashed and copied once.
+        if self.assets is not None:
+            add_doctree_images(doctree, self.assets, self.srcdir,
+                               self.image_paths)
+
+
+    def get_image_uri_function(self, base_dir):
+        """Returns the function the translator uses to find the fileref of
+        each image: the URI of its copy, relative to base_dir in the output
+        directory. Returns None if images aren't being copied."""
+        if self.assets is None:
+            return None
+        image_paths = self.image_paths
+        start = os.path.join(self.outdir, base_dir)
+
+        def get_image_uri(uri):
+            if uri in image_paths:
+                return get_relative_uri(image_paths[uri], start)
+            return uri
+        return get_image_uri
 
-        # If there's an output filename, use its basename as the root
-        # element's ID.
-        #(path, filename) = os.path.split(self.output_filename)
-        #(doc_id, ext) = os.path.splitext(filename)
 
-        docutils_writer = DocBookWriter(self.root_element, docname,
-                output_xml_header=(self.template_filename == None))
+    def write_documents(self, docnames):
+        if self.config.docbook_book_mode == 'single':
+            # the documents are resolved and written to the book one at a
+            # time here, rather than each being resolved by Sphinx first (and
+            # handed to worker processes with nothing to do).
+            self.write_single_book(self.get_book_docnames())
+            return
+        TextBuilder.write_documents(self, docnames)
 
-        # get the docbook output.
-        docbook_contents = publish_from_doctree(doctree,
-                writer=docutils_writer)
+
+    def write_doc(self, docname, doctree):
+        if self.config.docbook_book_mode == 'single':
+            # everything is written to the book by write_documents(), or by
+            # finish() with versions of Sphinx that don't call it.
+            return
+
+        # The doctree has already been resolved by Sphinx, so it's translated
+        # directly rather than run through a docutils publisher again. The
+        # docname is used as the root element's ID.
+        visitor = DocBookTranslator(doctree, self.root_element, docname,
+                output_xml_header=(self.template_filename == None),
+                root_aliases=self.root_aliases, id_aliases=self.id_aliases,
+                get_image_uri=self.get_image_uri_function(
+                    os.path.dirname(docname)))
+        if self.profiler is not None:
+            self.profiler.instrument(visitor)
+        walkabout(doctree, visitor)
+        docbook_contents = visitor.astext()
+        if self.get_collects_links():
+            self.save_link_data(docname, visitor.get_link_data())
 
         # process the output with a template if a template name was supplied.
         if self.template_filename != None:
-            docbook_contents = self.process_with_template(docbook_contents)
+            docbook_contents = self.process_with_template(
+                    docbook_contents.decode('utf-8')).encode('utf-8')
+
+        outfilename = os.path.join(self.outdir, docname + self.out_suffix)
+        outdir = os.path.dirname(outfilename)
+        if not os.path.isdir(outdir):
+            os.makedirs(outdir)
+        with open(outfilename, 'wb') as output_file:
+            output_file.write(docbook_contents)
+
+
+    def get_book_docnames(self):
+        """Returns the names of the documents to put in the book, in the order
+        they're found by following the toctrees from the root document."""
+        root_doc = getattr(self.config, 'root_doc', None)
+        if root_doc is None:
+            root_doc = self.config.master_doc
+        docnames = []
+        seen = set()
+        stack = [root_doc]
+        while stack:
+            docname = stack.pop()
+            if docname in seen or docname not in self.env.all_docs:
+                continue
+            seen.add(docname)
+            docnames.append(docname)
+            stack.extend(reversed(self.env.toctree_includes.get(docname, [])))
+        return docnames
+
+
+    def get_book_title(self):
+        if self.config.docbook_book_title != None:
+            return self.config.docbook_book_title
+        return self.config.project
+
+
+    def write_book_master(self, docnames):
+        """Writes a book that pulls in each document's file with xi:include."""
+        book = etree.Element('book', {'version': '5.0'}, nsmap=BOOK_NSMAP)
+        etree.SubElement(book, 'title').text = self.get_book_title()
+        for docname in docnames:
+            etree.SubElement(book, '{http://www.w3.org/2001/XInclude}include',
+                             {'href': docname + self.out_suffix})
+        with open(os.path.join(self.outdir,
+                               self.config.docbook_book_filename),
+                  'wb') as output_file:
+            output_file.write(etree.tostring(etree.ElementTree(book),
+                    encoding='utf-8', standalone=True, pretty_print=True))
+
+
+    def write_single_book(self, docnames):
+        """Writes every document into a single book, one at a time, so that
+        only one document's tree is ever held in memory."""
+        with open(os.path.join(self.outdir,
+                               self.config.docbook_book_filename),
+                  'wb') as output_file:
+            with etree.xmlfile(output_file, encoding='utf-8') as xf:
+                xf.write_declaration(standalone=True)
+                with xf.element('book', {'version': '5.0'}, BOOK_NSMAP):
+                    xf.write('\n  ')
+                    with xf.element('title'):
+                        xf.write(self.get_book_title())
+                    xf.write('\n')
+                    get_image_uri = self.get_image_uri_function('')
+                    for docname in docnames:
+                        doctree = self.env.get_and_resolve_doctree(docname,
+                                                                   self)
+                        self.write_doc_serialized(docname, doctree)
+                        visitor = DocBookTranslator(doctree,
+                                self.root_element, docname, output_xml_header=False,
+                                root_aliases=self.root_aliases,
+                                id_aliases=self.id_aliases,
+                                get_image_uri=get_image_uri)
+                        if self.profiler is not None:
+                            self.profiler.instrument(visitor)
+                        walkabout(doctree, visitor)
+                        if self.get_collects_links():
+                            self.save_link_data(docname,
+                                                visitor.get_link_data())
+                        # each chapter ends with a newline when it's pretty
+                        # printed.
+                        xf.write('  ')
+                        xf.write(visitor.astree(), pretty_print=True)
+                        del doctree, visitor
+            output_file.write(b'\n')
+        self.book_written = True
+
+
+    def finish(self):
+        book_mode = self.config.docbook_book_mode
+        if book_mode == 'xinclude':
+            self.write_book_master(self.get_book_docnames())
+        elif book_mode == 'single' and not self.book_written:
+            self.write_single_book(self.get_book_docnames())
+
+        if self.get_collects_links():
+            self.finish_links()
+
+        if self.assets is not None:
+            for error in self.assets.finish():
+                logger.warning(error)
+
+        if self.profiler is not None:
+            self.profiler.write_report(os.path.join(self.outdir,
+                    self.config.docbook_profile))
 
-        output_file = open(os.path.join(self.outdir, '%s.xml' % docname), 'w+')
-        output_file.write(docbook_contents)
+        # record the settings used, so the next build can tell whether they've
+        # changed.
+        with open(os.path.join(self.outdir, self.fingerprint_filename),
+                  'w') as f:
+            f.write(self.get_fingerprint())
 
 
 def setup(app):
-    global sphinx_app
-    sphinx_app = app
     app.add_config_value('docbook_default_root_element', 'section', 'env')
     app.add_config_value('docbook_template_file', None, 'env')
+    app.add_config_value('docbook_book_mode', None, 'env')
+    app.add_config_value('docbook_book_filename', 'book.xml', 'env')
+    app.add_config_value('docbook_book_title', None, 'env')
+    app.add_config_value('docbook_profile', None, '')
+    app.add_config_value('docbook_check_links', True, '')
+    app.add_config_value('docbook_link_index', None, '')
+    app.add_config_value('docbook_olink_db', None, '')
+    app.add_config_value('docbook_image_dir', None, '')
+    app.add_env_collector(RootIdCollector)
     app.add_builder(DocBookBuilder)
+    return {'version': __version__,
+            'parallel_read_safe': True,
+            'parallel_write_safe': True}
 
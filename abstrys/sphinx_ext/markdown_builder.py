@@ -7,27 +7,136 @@
 #
 # by Eron Hennessey
 
-from abstrys.docutils_ext.markdown_writer import MarkdownWriter, MarkdownTranslator
-from docutils.core import publish_from_doctree
+from abstrys import __version__
+from abstrys.assets import AssetCopier, add_doctree_images, get_relative_uri
+from abstrys.docutils_ext.markdown_writer import (LINE_WIDTH, MarkdownWriter,
+        MarkdownTranslator, get_anchors)
+from abstrys.profiling import NodeProfiler
+from docutils.io import StringOutput
 from sphinx.builders.text import TextBuilder
+from sphinx.environment.collectors import EnvironmentCollector
+from sphinx.util import logging
 import os, sys
 
+logger = logging.getLogger(__name__)
+
+
+def _get_anchor_index(env):
+    if not hasattr(env, 'markdown_anchors'):
+        env.markdown_anchors = {}
+    return env.markdown_anchors
+
+
+class AnchorCollector(EnvironmentCollector):
+    """Records the anchors of the headings in each document's Markdown
+    output, by the IDs of the nodes they're written for, so that links
+    between documents can be resolved while they're written."""
+
+    def clear_doc(self, app, env, docname):
+        _get_anchor_index(env).pop(docname, None)
+
+    def merge_other(self, app, env, docnames, other):
+        anchor_index = _get_anchor_index(env)
+        other_anchor_index = _get_anchor_index(other)
+        for docname in docnames:
+            if docname in other_anchor_index:
+                anchor_index[docname] = other_anchor_index[docname]
+
+    def process_doc(self, app, doctree):
+        _get_anchor_index(app.env)[app.env.docname] = get_anchors(doctree)
+
+
 class MarkdownBuilder(TextBuilder):
     """Build Markdown documents from a Sphinx doctree"""
 
     name = 'markdown'
     format = 'markdown'
+    out_suffix = '.md'
+
+    # the writer keeps no state between documents, so each process writing
+    # documents in parallel can use its own copy.
+    allow_parallel = True
 
-    def __init__(self, app):
-        TextBuilder.__init__(self, app)
-        self.out_suffix = '.md'
+    def get_target_uri(self, docname, typ=None):
+        # the writer adds the .md extension to links to other documents.
+        return docname
 
     def prepare_writing(self, docnames):
-        self.writer = MarkdownWriter()
+        max_col_width = self.config.markdown_max_col_width
+        if max_col_width != None:
+            # it's a string when it's set with sphinx-build -D.
+            max_col_width = int(max_col_width)
+        self.writer = MarkdownWriter(table_max_col_width=max_col_width,
+                line_width=int(self.config.markdown_line_width or 0),
+                anchor_index=_get_anchor_index(self.env))
+        # the copier for the documents' images, if they're copied, and the
+        # path of the copy of each image, by its URI.
+        self.assets = None
+        self.image_paths = {}
+        if self.config.markdown_image_dir != None:
+            self.assets = AssetCopier(
+                    os.path.join(self.outdir, self.config.markdown_image_dir),
+                    os.path.join(self.doctreedir, 'markdown_images.json'))
+        if self.config.markdown_profile != None:
+            self.writer.profiler = NodeProfiler()
+            # the timings are collected in this process, so documents can't
+            # be written by others in parallel.
+            self.parallel_ok = False
+
+    def write_doc_serialized(self, docname, doctree):
+        # this is called in the main process, even when documents are written
+        # in parallel, so each image is only hashed and copied once.
+        if self.assets is not None:
+            add_doctree_images(doctree, self.assets, self.srcdir,
+                               self.image_paths)
+
+    def get_image_uri_function(self, docname):
+        """Returns the function the writer uses to find the URI of each
+        image in a document: that of its copy, relative to the document's
+        output file. Returns None if images aren't being copied."""
+        if self.assets is None:
+            return None
+        image_paths = self.image_paths
+        start = os.path.join(self.outdir, os.path.dirname(docname))
+
+        def get_image_uri(uri):
+            if uri in image_paths:
+                return get_relative_uri(image_paths[uri], start)
+            return uri
+        return get_image_uri
+
+    def write_doc(self, docname, doctree):
+        destination = StringOutput(encoding='utf-8')
+        self.writer.docname = docname
+        self.writer.get_image_uri = self.get_image_uri_function(docname)
+        self.writer.write(doctree, destination)
+        for (node, uri) in self.writer.unresolved_refs:
+            logger.warning("unresolved reference: %s" % uri, location=node)
+        outfilename = os.path.join(self.outdir, docname + self.out_suffix)
+        outdir = os.path.dirname(outfilename)
+        if not os.path.isdir(outdir):
+            os.makedirs(outdir)
+        with open(outfilename, 'wb') as output_file:
+            output_file.write(self.writer.output.encode('utf-8'))
+
+
+    def finish(self):
+        if self.assets is not None:
+            for error in self.assets.finish():
+                logger.warning(error)
+        if self.writer.profiler is not None:
+            self.writer.profiler.write_report(os.path.join(self.outdir,
+                    self.config.markdown_profile))
 
 
 def setup(app):
-    global sphinx_app
-    sphinx_app = app
+    app.add_config_value('markdown_profile', None, '')
+    app.add_config_value('markdown_max_col_width', None, 'env')
+    app.add_config_value('markdown_line_width', LINE_WIDTH, 'env')
+    app.add_config_value('markdown_image_dir', None, 'env')
+    app.add_env_collector(AnchorCollector)
     app.add_builder(MarkdownBuilder)
+    return {'version': __version__,
+            'parallel_read_safe': True,
+            'parallel_write_safe': True}
 
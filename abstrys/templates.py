@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+#
+# #################
+# abstrys.templates
+# #################
+#
+# Jinja2 templates, shared by the command-line tools and the Sphinx builders.
+#
+# Each template is compiled once per process, and the compiled bytecode is
+# kept on disk so that later runs don't need to compile it again.
+#
+# by Eron Hennessey
+#
+
+import os
+
+
+# Jinja2 environments, keyed by (search_dir, bytecode_cache_dir). Jinja2
+# keeps the compiled templates of each environment, and only reloads them
+# when they change.
+_environments = {}
+
+
+def get_default_cache_dir():
+    """Returns the directory used for compiled templates when no other cache
+    directory has been given."""
+    cache_home = os.environ.get('XDG_CACHE_HOME',
+                                os.path.join(os.path.expanduser('~'), '.cache'))
+    return os.path.join(cache_home, 'abstrys', 'templates')
+
+
+def _get_bytecode_cache(jinja2, bytecode_cache_dir):
+    if not os.path.isdir(bytecode_cache_dir):
+        try:
+            os.makedirs(bytecode_cache_dir)
+        except OSError:
+            # another process might have created it; otherwise, do without.
+            if not os.path.isdir(bytecode_cache_dir):
+                return None
+    return jinja2.FileSystemBytecodeCache(bytecode_cache_dir)
+
+
+def get_environment(search_dir, bytecode_cache_dir=None):
+    """Returns the Jinja2 environment that loads templates from search_dir,
+    creating it the first time it's needed. Raises ImportError if Jinja2 isn't
+    installed."""
+    import jinja2
+    if bytecode_cache_dir is None:
+        bytecode_cache_dir = get_default_cache_dir()
+    key = (search_dir, bytecode_cache_dir)
+    env = _environments.get(key)
+    if env is None:
+        env = jinja2.Environment(
+                loader=jinja2.FileSystemLoader(search_dir),
+                bytecode_cache=_get_bytecode_cache(jinja2, bytecode_cache_dir),
+                trim_blocks=True)
+        _environments[key] = env
+    return env
+
+
+def get_template(template_name, search_dir=None, bytecode_cache_dir=None):
+    """Returns a compiled template.
+
+    If search_dir is given, template_name is relative to it. Otherwise,
+    template_name is a path to the template file."""
+    if search_dir is None:
+        (search_dir, template_name) = os.path.split(
+                os.path.abspath(template_name))
+    env = get_environment(search_dir, bytecode_cache_dir)
+    return env.get_template(template_name)
+
+
+def render_template(template_name, fields, search_dir=None,
+                    bytecode_cache_dir=None):
+    """Renders a template, passing fields to it as {{data}}."""
+    t = get_template(template_name, search_dir, bytecode_cache_dir)
+    return t.render(data=fields)
@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+#
+# #############
+# abstrys.watch
+# #############
+#
+# Watch mode for the command-line tools: after converting everything once,
+# the tool keeps running and converts documents again whenever they, the
+# template, or any file they include changes. Only the documents affected by
+# a change are converted, in the same (already warmed up) process. In batch
+# mode, the directories searched for documents (and the manifest) are watched
+# too: when they change, the documents are looked for again, so new ones are
+# converted and removed ones are no longer watched.
+#
+# On Linux, changes are picked up with inotify if the inotify_simple package
+# is installed. Otherwise, the files are polled.
+#
+# by Eron Hennessey
+#
+
+import os
+import sys
+import time
+
+from abstrys.common import printerr
+
+# how long to wait for a burst of changes (such as an editor saving several
+# files) to finish before converting, in seconds.
+DEBOUNCE_TIME = 0.2
+
+# how often to check the files when polling, in seconds.
+POLL_INTERVAL = 0.5
+
+
+def _report(text):
+    """Prints a progress message to stderr."""
+    sys.stderr.write("%s\n" % text)
+    sys.stderr.flush()
+
+
+class PollingMonitor(object):
+    """Finds changed files by checking their modification times and sizes."""
+
+    def __init__(self, interval=POLL_INTERVAL):
+        self.interval = interval
+        self.stats = {}
+
+    def _stat(self, path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return (st.st_mtime, st.st_size)
+
+    def set_paths(self, paths):
+        """Sets the files to watch."""
+        old_stats = self.stats
+        self.stats = {}
+        for path in paths:
+            if path in old_stats:
+                self.stats[path] = old_stats[path]
+            else:
+                self.stats[path] = self._stat(path)
+
+    def _find_changes(self):
+        changed = set()
+        for (path, old_stat) in self.stats.items():
+            new_stat = self._stat(path)
+            if new_stat != old_stat:
+                self.stats[path] = new_stat
+                changed.add(path)
+        return changed
+
+    def wait(self, timeout=None):
+        """Returns the set of files that have changed, waiting up to timeout
+        seconds (or for as long as it takes, if timeout is None) for one to
+        change."""
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+        while True:
+            delay = self.interval
+            if deadline is not None:
+                delay = min(delay, max(0, deadline - time.time()))
+            time.sleep(delay)
+            changed = self._find_changes()
+            if changed or (deadline is not None and time.time() >= deadline):
+                return changed
+
+
+class InotifyMonitor(object):
+    """Finds changed files with inotify. The directories holding the files are
+    watched, rather than the files themselves, so that files replaced by
+    editors (rather than rewritten) are still noticed. A directory that's
+    being watched itself changes when a file is added to it or removed."""
+
+    def __init__(self):
+        import inotify_simple
+        self.flags = inotify_simple.flags
+        self.inotify = inotify_simple.INotify()
+        self.paths = set()
+        # watch descriptors, by directory and the other way around.
+        self.watches = {}
+        self.directories = {}
+
+    def set_paths(self, paths):
+        """Sets the files to watch."""
+        self.paths = set(paths)
+        mask = (self.flags.CLOSE_WRITE | self.flags.MOVED_TO |
+                self.flags.MOVED_FROM | self.flags.CREATE |
+                self.flags.DELETE | self.flags.ATTRIB)
+        directories = set(os.path.dirname(path) for path in self.paths)
+        directories.update(path for path in self.paths if os.path.isdir(path))
+        for directory in directories:
+            if directory in self.watches or not os.path.isdir(directory):
+                continue
+            wd = self.inotify.add_watch(directory, mask)
+            self.watches[directory] = wd
+            self.directories[wd] = directory
+
+    def wait(self, timeout=None):
+        """Returns the set of files that have changed, waiting up to timeout
+        seconds (or for as long as it takes, if timeout is None) for one to
+        change."""
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+        while True:
+            read_timeout = None
+            if deadline is not None:
+                read_timeout = max(0, int((deadline - time.time()) * 1000))
+            changed = set()
+            for event in self.inotify.read(timeout=read_timeout):
+                directory = self.directories.get(event.wd)
+                if directory is None or not event.name:
+                    continue
+                path = os.path.join(directory, event.name)
+                if path in self.paths:
+                    changed.add(path)
+                if directory in self.paths:
+                    changed.add(directory)
+            if changed or (deadline is not None and time.time() >= deadline):
+                return changed
+
+
+def get_monitor():
+    """Returns the best monitor available on this system."""
+    if sys.platform.startswith('linux'):
+        try:
+            return InotifyMonitor()
+        except (ImportError, OSError):
+            pass
+    return PollingMonitor()
+
+
+class Watcher(object):
+    """Converts jobs, and then converts them again when the files they depend
+    on change.
+
+    jobs is a list of (input_filename, output_filename) pairs, as for
+    abstrys.batch.run_batch(). If find_jobs is given, it's called to list the
+    jobs again, returning (jobs, search_paths): the search paths are watched
+    too, and the jobs are listed again whenever one of them changes."""
+
+    def __init__(self, converter, jobs, monitor=None,
+                 debounce_time=DEBOUNCE_TIME, find_jobs=None):
+        self.converter = converter
+        self.jobs = jobs
+        self.monitor = monitor or get_monitor()
+        self.debounce_time = debounce_time
+        self.find_jobs = find_jobs
+        self.search_paths = set()
+        # the jobs that depend on each file, by absolute path.
+        self.dependents = {}
+        # the files each job depends on.
+        self.job_dependencies = {}
+
+    def _get_job_dependencies(self, job):
+        (input_filename, output_filename) = job
+        paths = set([input_filename])
+        template_filename = self.converter.params.get('template_filename')
+        if template_filename != None:
+            paths.add(template_filename)
+        return set(os.path.abspath(path) for path in paths)
+
+    def _set_dependencies(self, job, paths):
+        for path in self.job_dependencies.get(job, ()):
+            self.dependents[path].discard(job)
+        self.job_dependencies[job] = paths
+        for path in paths:
+            self.dependents.setdefault(path, set()).add(job)
+
+    def convert(self, job):
+        """Converts a single job, recording the files it depends on. Errors
+        are reported, and the job is still watched."""
+        (input_filename, output_filename) = job
+        paths = self._get_job_dependencies(job)
+        try:
+            self.converter.convert_file(input_filename, output_filename)
+            paths.update(os.path.abspath(path)
+                         for path in self.converter.dependencies)
+            for error in self.converter.wait_for_images():
+                printerr(error)
+            _report("Converted %s" % input_filename)
+        except Exception as e:
+            printerr("Couldn't convert %s: %s" % (input_filename, e))
+            # keep watching the files it included last time.
+            paths.update(self.job_dependencies.get(job, ()))
+        except SystemExit:
+            # docutils exits when it finds a serious error in a document.
+            printerr("Couldn't convert %s" % input_filename)
+            paths.update(self.job_dependencies.get(job, ()))
+        self._set_dependencies(job, paths)
+
+    def find_new_jobs(self):
+        """Lists the jobs again, with find_jobs. Jobs that are gone are no
+        longer watched, and new ones are converted."""
+        (jobs, search_paths) = self.find_jobs()
+        self.search_paths = set(os.path.abspath(path)
+                                for path in search_paths)
+        found = set(jobs)
+        for job in self.jobs:
+            if job not in found:
+                self._set_dependencies(job, set())
+        old_jobs = set(self.jobs)
+        self.jobs = jobs
+        for job in jobs:
+            if job not in old_jobs:
+                self.convert(job)
+
+    def wait_for_changes(self):
+        """Waits for one or more files to change, and then for the burst of
+        changes to finish. Returns the set of changed files."""
+        changed = self.monitor.wait()
+        while True:
+            more = self.monitor.wait(self.debounce_time)
+            if not more:
+                return changed
+            changed.update(more)
+
+    def run(self):
+        """Converts every job, and then watches for changes until
+        interrupted."""
+        self.converter.prepare()
+        for job in self.jobs:
+            self.convert(job)
+        if self.find_jobs is not None:
+            self.find_new_jobs()
+        try:
+            while True:
+                paths = [path for (path, jobs) in self.dependents.items()
+                         if jobs]
+                self.monitor.set_paths(paths + sorted(self.search_paths))
+                _report("Watching %d files for changes. Press Ctrl-C to "
+                            "stop." % len(paths))
+                changed = self.wait_for_changes()
+                if self.find_jobs is not None and changed & self.search_paths:
+                    self.find_new_jobs()
+                affected = set()
+                for path in changed:
+                    affected.update(self.dependents.get(path, ()))
+                # convert in the original order.
+                for job in self.jobs:
+                    if job in affected:
+                        self.convert(job)
+        except KeyboardInterrupt:
+            pass
+        for error in self.converter.finish_images():
+            printerr(error)
+
+
+def watch(converter, jobs, params=None, extension=None):
+    """Converts the jobs, and then converts them again whenever the files
+    they depend on change, until interrupted; then exits.
+
+    In batch mode, give the command-line params and the extension of the
+    output files, and documents added to the directories searched are
+    converted too."""
+    find_jobs = None
+    if params is not None:
+        from abstrys.batch import get_batch_jobs, get_search_paths
+
+        def find_jobs():
+            return (get_batch_jobs(params, extension),
+                    get_search_paths(params))
+    converter.start_profiling()
+    Watcher(converter, jobs, find_jobs=find_jobs).run()
+    converter.finish_profiling()
+    sys.exit(0)
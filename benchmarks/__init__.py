@@ -0,0 +1,12 @@
+# -*- coding: utf-8 -*-
+#
+# ##########
+# benchmarks
+# ##########
+#
+# Benchmarks for the rst2db writers and command-line tools. They aren't
+# installed with the package; run them from the top of the source tree, for
+# example::
+#
+#  python -m benchmarks.run
+#
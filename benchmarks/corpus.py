@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+#
+# #################
+# benchmarks.corpus
+# #################
+#
+# Generates synthetic reStructuredText documents for the benchmarks.
+#
+# A document is made by repeating one kind of block (a "profile") until it
+# reaches the size asked for. The profiles stress different parts of the
+# writers: plain prose, deeply nested sections and lists, wide and tall
+# tables, many references, and large literal blocks. The 'mixed' profile uses
+# all of them in turn.
+#
+# Usage::
+#
+#  python -m benchmarks.corpus <size> [profile] [-o output_file]
+#
+# where size can be given as 500K, 20M and so on.
+#
+
+import sys
+
+# The characters used to underline section titles, from the document title
+# down. docutils decides the level of each section by the order in which the
+# underlines are first seen, so these are always used in this order.
+SECTION_CHARS = '=-~^"\'`#*+<>'
+
+# The options that can be given for each profile, with their defaults.
+DEFAULT_OPTIONS = {
+    # how deeply sections and lists are nested by the 'nested' profile.
+    'depth': 6,
+    # the size of the tables made by the 'tables' profile.
+    'table_rows': 50,
+    'table_cols': 12,
+    # the number of references in each block of the 'references' profile.
+    'references': 40,
+    # the number of lines in each block of the 'literal' profile.
+    'literal_lines': 200,
+    }
+
+
+def _title(text, level):
+    return u'%s\n%s\n\n' % (text, SECTION_CHARS[level] * len(text))
+
+
+def _prose_block(n, options):
+    return (_title(u'Prose %d' % n, 1) + u"""\
+This is paragraph %(n)d, with some *emphasis*, some **strong text** and some
+``literal text``, long enough that it needs to be wrapped onto a few lines
+when it's written out as Markdown.
+
+* The first item of list %(n)d.
+* The second item, which has a little more text in it.
+
+1. A numbered item.
+2. Another numbered item.
+
+""" % {'n': n})
+
+
+def _nested_block(n, options):
+    depth = min(options['depth'], len(SECTION_CHARS) - 1)
+    parts = []
+    for level in range(1, depth + 1):
+        parts.append(_title(u'Nested %d.%d' % (n, level), level))
+        parts.append(u'A paragraph at level %d of block %d.\n\n' % (level, n))
+    # a list nested to the same depth.
+    for level in range(options['depth']):
+        parts.append(u'%s* List item at depth %d.\n\n' % ('  ' * level, level))
+    return u''.join(parts)
+
+
+def _tables_block(n, options):
+    rows = options['table_rows']
+    cols = options['table_cols']
+    parts = [_title(u'Tables %d' % n, 1),
+             u'.. list-table:: Table %d\n   :header-rows: 1\n\n' % n]
+    for row in range(rows):
+        for col in range(cols):
+            marker = '*' if col == 0 else ' '
+            parts.append(u'   %s - Cell %d,%d\n' % (marker, row, col))
+    parts.append(u'\n')
+    return u''.join(parts)
+
+
+def _references_block(n, options):
+    count = options['references']
+    parts = [_title(u'References %d' % n, 1)]
+    # each block links to its own targets, and to an external site.
+    for i in range(count):
+        parts.append(u'See target_%d_%d_ and `site %d.%d '
+                     u'<http://example.com/%d/%d>`_.\n' % (n, i, n, i, n, i))
+    parts.append(u'\n')
+    for i in range(count):
+        parts.append(u'.. _target_%d_%d:\n\nTarget %d of block %d.\n\n'
+                     % (n, i, i, n))
+    return u''.join(parts)
+
+
+def _literal_block(n, options):
+    parts = [_title(u'Literal %d' % n, 1), u'::\n\n']
+    for i in range(options['literal_lines']):
+        parts.append(u'    line_%d = compute(%d, "some text")  # %d\n'
+                     % (i, i, n))
+    parts.append(u'\n')
+    return u''.join(parts)
+
+
+PROFILES = {
+    'prose': [_prose_block],
+    'nested': [_nested_block],
+    'tables': [_tables_block],
+    'references': [_references_block],
+    'literal': [_literal_block],
+    'mixed': [_prose_block, _nested_block, _tables_block, _references_block,
+              _literal_block],
+    }
+
+
+def generate(size, profile='mixed', **options):
+    """Returns a reST document of at least size characters, made from the
+    blocks of the given profile. The options are described in
+    DEFAULT_OPTIONS."""
+    if profile not in PROFILES:
+        raise ValueError("Unknown corpus profile: %s" % profile)
+    for name in DEFAULT_OPTIONS:
+        options.setdefault(name, DEFAULT_OPTIONS[name])
+    block_makers = PROFILES[profile]
+    # the writers expect everything to be inside a single top-level section.
+    # It starts with a paragraph, so that docutils doesn't turn the first
+    # block's title into a subtitle.
+    parts = [_title(u'Benchmark corpus: %s' % profile, 0) +
+             u'A generated document for benchmarking.\n\n']
+    total = len(parts[0])
+    n = 0
+    while total < size:
+        part = block_makers[n % len(block_makers)](n, options)
+        parts.append(part)
+        total += len(part)
+        n += 1
+    return u''.join(parts)
+
+
+def main():
+    from abstrys.cache import parse_size
+    args = sys.argv[1:]
+    output_filename = None
+    if '-o' in args:
+        i = args.index('-o')
+        output_filename = args[i + 1]
+        del args[i:i + 2]
+    if len(args) == 0:
+        print("Usage: python -m benchmarks.corpus <size> [profile] "
+              "[-o output_file]")
+        sys.exit(1)
+    profile = args[1] if len(args) > 1 else 'mixed'
+    text = generate(parse_size(args[0]), profile).encode('utf-8')
+    if output_filename is None:
+        getattr(sys.stdout, 'buffer', sys.stdout).write(text)
+    else:
+        with open(output_filename, 'wb') as output_file:
+            output_file.write(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# ###########################
+# docbook_doctree_overhead.py
+# ###########################
+#
+# Measures the fixed, per-document cost of translating an already-resolved
+# doctree to DocBook, as DocBookBuilder does for each page of a Sphinx
+# project.
+#
+# Usage::
+#
+#  python benchmarks/docbook_doctree_overhead.py [count]
+#
+# count small documents (default: 500) are parsed once. Each is then
+# translated with publish_from_doctree(), which sets up a new publisher,
+# processes the settings and applies transforms again, and by walking
+# DocBookTranslator over the doctree directly. The average time per document
+# is reported for both.
+#
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from abstrys.docutils_ext.docbook_writer import DocBookTranslator, DocBookWriter
+from docutils.core import publish_doctree, publish_from_doctree
+
+
+PAGE = u"""
+Page %(n)d
+==========
+
+A short page, like most of the pages in a large Sphinx project, with a link to
+`the docutils site <http://docutils.sourceforge.net/>`_.
+
+* One item.
+* Another item.
+"""
+
+
+def time_publisher(doctrees):
+    start = time.time()
+    for (n, doctree) in enumerate(doctrees):
+        publish_from_doctree(doctree,
+                             writer=DocBookWriter('section', 'page%d' % n))
+    return time.time() - start
+
+
+def time_translator(doctrees):
+    start = time.time()
+    for (n, doctree) in enumerate(doctrees):
+        visitor = DocBookTranslator(doctree, 'section', 'page%d' % n)
+        doctree.walkabout(visitor)
+        visitor.astext()
+    return time.time() - start
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    settings = {'doctitle_xform': False}
+    doctrees = [publish_doctree(PAGE % {'n': n}, settings_overrides=settings)
+                for n in range(count)]
+    # both runs get their own copies, since translating can change them.
+    publisher_time = time_publisher([d.deepcopy() for d in doctrees])
+    translator_time = time_translator([d.deepcopy() for d in doctrees])
+    print("publish_from_doctree:  %8.3f ms/document" %
+          (publisher_time * 1000 / count))
+    print("DocBookTranslator:     %8.3f ms/document" %
+          (translator_time * 1000 / count))
+    print("overhead removed:      %8.3f ms/document" %
+          ((publisher_time - translator_time) * 1000 / count))
+
+
+if __name__ == "__main__":
+    main()
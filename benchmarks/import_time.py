@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+#
+# ######################
+# benchmarks.import_time
+# ######################
+#
+# Measures how long the command-line tools take to start, and checks that
+# they don't load docutils, lxml or Jinja2 before there's something to
+# convert.
+#
+# Usage::
+#
+#  python -m benchmarks.import_time [--repeat 5] [-o results.json]
+#
+# Each command is run in a new Python process with ``-X importtime`` (which
+# needs Python 3.7 or later), and the time taken to import each of the
+# tool's modules is reported, slowest first, along with the wall-clock time
+# of the fastest run. The benchmark fails if one of the heavy modules was
+# imported just to show the usage.
+#
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+TOP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# the commands to time, all of which should start without loading the heavy
+# modules.
+COMMANDS = [('import rst2db', ['-c', 'import abstrys.cmd_rst2db']),
+            ('import rst2md', ['-c', 'import abstrys.cmd_rst2md']),
+            ('abstrys db -h', ['-m', 'abstrys', 'db', '-h']),
+            ('abstrys md -h', ['-m', 'abstrys', 'md', '-h'])]
+
+# the packages that should only be loaded when converting.
+HEAVY_MODULES = ['docutils', 'lxml', 'jinja2', 'sphinx']
+
+# the number of modules to list for each command.
+REPORT_LINES = 10
+
+
+def parse_importtime(output):
+    """Returns a list of (module, top_level, cumulative_us) from the output
+    of -X importtime, where top_level is True for modules that weren't
+    imported by another module."""
+    imports = []
+    for line in output.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        try:
+            cumulative_us = int(fields[1])
+        except (IndexError, ValueError):
+            # the header line.
+            continue
+        # nested imports are indented beneath the single space that
+        # follows the bar.
+        module = fields[2][1:]
+        imports.append((module.strip(), not module.startswith(' '),
+                        cumulative_us))
+    return imports
+
+
+def get_tool_import_time(imports):
+    """Returns the time spent on imports from the first of our modules
+    onwards, leaving out Python's own start up."""
+    total = 0
+    started = False
+    for (module, top_level, cumulative_us) in imports:
+        if top_level and module.split('.')[0] == 'abstrys':
+            started = True
+        if started and top_level:
+            total += cumulative_us
+    return total
+
+
+def run_command(args):
+    """Runs python with args, returning its -X importtime output and the
+    wall-clock time it took."""
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+            [TOP_DIR] + [p for p in [env.get('PYTHONPATH')] if p])
+    start = time.time()
+    process = subprocess.Popen([sys.executable, '-X', 'importtime'] + args,
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                               env=env)
+    (stdout, stderr) = process.communicate()
+    elapsed = time.time() - start
+    return (stderr.decode('utf-8', 'replace'), elapsed)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+            description="Times the start up of the command-line tools.")
+    parser.add_argument('--repeat', type=int, default=5,
+            help="run each command this many times, keeping the fastest")
+    parser.add_argument('-o', '--output',
+            help="write the results to this JSON file")
+    args = parser.parse_args()
+
+    results = []
+    failed = False
+    for (name, command) in COMMANDS:
+        best = None
+        for i in range(args.repeat):
+            (output, elapsed) = run_command(command)
+            if best is None or elapsed < best[1]:
+                best = (output, elapsed)
+        (output, elapsed) = best
+        imports = parse_importtime(output)
+        ours = [i for i in imports if i[0].split('.')[0] == 'abstrys']
+        heavy = sorted(set(i[0].split('.')[0] for i in imports
+                           if i[0].split('.')[0] in HEAVY_MODULES))
+        total = get_tool_import_time(imports)
+        print("%s: %.1f ms wall clock, %.1f ms importing" %
+              (name, elapsed * 1000, total / 1000.0))
+        for (module, top_level, cumulative_us) in sorted(
+                ours, key=lambda i: i[2], reverse=True)[:REPORT_LINES]:
+            print("  %8.1f ms  %s" % (cumulative_us / 1000.0, module))
+        if heavy:
+            print("  FAIL: imported %s" % ', '.join(heavy))
+            failed = True
+        results.append({'command': name, 'wall_clock': elapsed,
+                        'import_time': total / 1000000.0,
+                        'heavy_modules': heavy})
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump({'python': sys.version.split()[0], 'results': results},
+                      output_file, indent=2, sort_keys=True)
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+#
+# ###########################
+# benchmarks.markdown_scaling
+# ###########################
+#
+# Checks that MarkdownTranslator's running time grows linearly with the size
+# of the input document.
+#
+# Usage::
+#
+#  python -m benchmarks.markdown_scaling [--max-size 10M] [--profile prose]
+#
+# Documents from 10K up to the maximum size (use 100M for the full run) are
+# generated, parsed once, and then translated to Markdown. The time per
+# kilobyte is reported for each size, and the benchmark fails if the largest
+# document takes more than three times as long per kilobyte as the smallest.
+#
+
+import argparse
+import sys
+import time
+
+from abstrys.cache import parse_size
+from abstrys.docutils_ext.markdown_writer import MarkdownWriter
+from benchmarks.corpus import PROFILES, generate
+from docutils.core import publish_doctree
+from docutils.io import StringOutput
+
+
+# the worst acceptable ratio between the time per kilobyte of the largest and
+# the smallest documents.
+MAX_RATIO = 3.0
+
+# the size of the smallest document.
+MIN_SIZE = 10 * 1024
+
+
+def time_translation(doctree):
+    """Returns the time it takes to translate a parsed document."""
+    writer = MarkdownWriter()
+    start = time.time()
+    writer.write(doctree, StringOutput(encoding='utf-8'))
+    return time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(
+            description="Checks that the Markdown writer's running time grows "
+                        "linearly with the size of the document.")
+    parser.add_argument('--max-size', default='10M',
+            help="the size of the largest document; sizes go up by ten "
+                 "times from 10K (default: 10M)")
+    parser.add_argument('--profile', default='prose', choices=sorted(PROFILES),
+            help="the kind of document to generate (default: prose)")
+    args = parser.parse_args()
+
+    max_size = parse_size(args.max_size)
+    size = MIN_SIZE
+    results = []
+    while size <= max_size:
+        doctree = publish_doctree(generate(size, args.profile),
+                                  settings_overrides={'report_level': 5})
+        elapsed = time_translation(doctree)
+        per_kb = elapsed / (size / 1024.0)
+        results.append(per_kb)
+        print("%10d KB  %8.3f s  %8.3f ms/KB" % (size // 1024, elapsed,
+                                                 per_kb * 1000))
+        size *= 10
+    if len(results) < 2:
+        print("Nothing to compare: --max-size must be at least 100K")
+        sys.exit(1)
+    ratio = results[-1] / results[0]
+    print("largest/smallest time per KB: %.2f" % ratio)
+    if ratio > MAX_RATIO:
+        print("FAIL: translation time doesn't grow linearly")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+#
+# #############################
+# benchmarks.markdown_wrapping
+# #############################
+#
+# Compares the Markdown writer's paragraph wrapping (wrap_text) with the
+# textwrap.TextWrapper it replaced, on the paragraphs of a generated
+# document.
+#
+# Usage::
+#
+#  python -m benchmarks.markdown_wrapping [--size 5M] [--profile prose]
+#                                         [--width 78] [--repeat 3]
+#
+# Each paragraph is wrapped with the same prefixes the writer uses for
+# nested lists and quotes. The best time of each method is reported, along
+# with the number of paragraphs whose wrapping differs; the only expected
+# differences are lines that TextWrapper broke after a hyphen.
+#
+
+import argparse
+import time
+from textwrap import TextWrapper
+
+from abstrys.cache import parse_size
+from abstrys.docutils_ext.markdown_writer import wrap_text
+from benchmarks.corpus import PROFILES, generate
+from docutils import nodes
+from docutils.core import publish_doctree
+
+# the prefixes paragraphs are wrapped with, as (initial, subsequent).
+PREFIXES = [('', ''), ('    ', '    '), ('> ', '> '), ('    > ', '    >   ')]
+
+
+def get_paragraphs(size, profile):
+    """Returns the text of every paragraph in a generated document."""
+    doctree = publish_doctree(generate(size, profile),
+                              settings_overrides={'report_level': 5})
+    # findall() replaced traverse() in docutils 0.18.
+    findall = getattr(doctree, 'findall', doctree.traverse)
+    return [node.astext() for node in findall(nodes.paragraph)]
+
+
+def wrap_with_textwrap(paragraphs, width):
+    wrapper = TextWrapper(width=width, break_long_words=False)
+    output = []
+    for (i, text) in enumerate(paragraphs):
+        (wrapper.initial_indent,
+         wrapper.subsequent_indent) = PREFIXES[i % len(PREFIXES)]
+        output.append(wrapper.fill(text))
+    return output
+
+
+def wrap_with_wrap_text(paragraphs, width):
+    output = []
+    for (i, text) in enumerate(paragraphs):
+        (initial_indent, subsequent_indent) = PREFIXES[i % len(PREFIXES)]
+        output.append('\n'.join(wrap_text(text, width, initial_indent,
+                                          subsequent_indent)))
+    return output
+
+
+def best_of(repeat, func, *args):
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        result = func(*args)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return (best, result)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+            description="Compares the Markdown writer's wrapping with "
+                        "textwrap.")
+    parser.add_argument('--size', default='5M',
+            help="the size of the generated document (default: 5M)")
+    parser.add_argument('--profile', default='prose', choices=sorted(PROFILES),
+            help="the kind of document to generate (default: prose)")
+    parser.add_argument('--width', type=int, default=78,
+            help="the line width (default: 78)")
+    parser.add_argument('--repeat', type=int, default=3,
+            help="run each method this many times, keeping the fastest")
+    args = parser.parse_args()
+
+    paragraphs = get_paragraphs(parse_size(args.size), args.profile)
+    characters = sum(len(text) for text in paragraphs)
+    print("%d paragraphs, %d characters" % (len(paragraphs), characters))
+
+    (old_time, old_output) = best_of(args.repeat, wrap_with_textwrap,
+                                     paragraphs, args.width)
+    (new_time, new_output) = best_of(args.repeat, wrap_with_wrap_text,
+                                     paragraphs, args.width)
+    (no_wrap_time, no_wrap_output) = best_of(args.repeat, wrap_with_wrap_text,
+                                             paragraphs, None)
+    differences = len([i for i in range(len(paragraphs))
+                       if old_output[i] != new_output[i]])
+
+    print("textwrap:   %8.3f s" % old_time)
+    print("wrap_text:  %8.3f s  (%.1fx)" % (new_time, old_time / new_time))
+    print("no wrap:    %8.3f s  (%.1fx)" % (no_wrap_time,
+                                           old_time / no_wrap_time))
+    print("%d paragraphs wrapped differently" % differences)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+#
+# ##############
+# benchmarks.run
+# ##############
+#
+# Times the DocBook and Markdown writers, and the rst2db and rst2md
+# command-line tools, on synthetic documents from benchmarks.corpus.
+#
+# Usage::
+#
+#  python -m benchmarks.run [--sizes 10K,100K,1M] [--profiles mixed,tables]
+#                           [--repeat 3] [--no-cli] [-o results.json]
+#                           [--compare baseline.json]
+#
+# For each profile and size, the document is parsed, translated and
+# serialised by each writer, and each step is timed separately. The tools are
+# then run on the same document in a new process, which includes their start
+# up time.
+#
+# The time per kilobyte of the largest document is compared with that of the
+# smallest for each profile and writer; if it's more than MAX_RATIO times
+# larger, the running time isn't growing linearly with the size of the input,
+# and the benchmark fails.
+#
+# Results can be saved as JSON with -o, and compared with the results from
+# another commit with --compare.
+#
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import docutils
+import lxml.etree
+from docutils.core import publish_doctree
+
+from abstrys.cache import parse_size
+from abstrys.docutils_ext.docbook_writer import DocBookTranslator
+from abstrys.docutils_ext.markdown_writer import MarkdownTranslator
+from benchmarks.corpus import PROFILES, generate
+
+
+# the worst acceptable ratio between the time per kilobyte of the largest and
+# the smallest documents.
+MAX_RATIO = 3.0
+
+DEFAULT_SIZES = '10K,100K,1M'
+
+# the settings used when parsing, which match the ones used by the tools.
+PARSE_SETTINGS = {'input_encoding': 'utf-8',
+                  'doctitle_xform': False,
+                  'report_level': 5}
+
+TOP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _docbook_translator(doctree):
+    return DocBookTranslator(doctree, 'section', 'benchmark')
+
+
+def _markdown_translator(doctree):
+    return MarkdownTranslator(doctree)
+
+
+WRITERS = [('docbook', _docbook_translator),
+           ('markdown', _markdown_translator)]
+
+TOOLS = [('rst2db', 'abstrys.cmd_rst2db'),
+         ('rst2md', 'abstrys.cmd_rst2md')]
+
+
+def time_writer(text, make_translator):
+    """Returns the times taken to parse, translate and serialise text."""
+    start = time.time()
+    doctree = publish_doctree(text, settings_overrides=PARSE_SETTINGS)
+    parsed = time.time()
+    visitor = make_translator(doctree)
+    doctree.walkabout(visitor)
+    translated = time.time()
+    visitor.astext()
+    serialised = time.time()
+    return {'parse': parsed - start,
+            'translate': translated - parsed,
+            'serialise': serialised - translated}
+
+
+def time_tool(module, input_filename, output_filename):
+    """Returns the time taken to run one of the tools in a new process."""
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+            [TOP_DIR] + [p for p in [env.get('PYTHONPATH')] if p])
+    start = time.time()
+    subprocess.check_call([sys.executable, '-m', module, input_filename,
+                           '-o', output_filename], env=env)
+    return time.time() - start
+
+
+def best_of(repeat, func, *args):
+    """Runs func repeat times, returning its fastest result. Results that are
+    dicts of times are compared by their total."""
+    best = None
+    for i in range(repeat):
+        result = func(*args)
+        total = sum(result.values()) if isinstance(result, dict) else result
+        if best is None or total < best[0]:
+            best = (total, result)
+    return best[1]
+
+
+def run_benchmarks(sizes, profiles, repeat, run_tools):
+    results = []
+    # translate a small document first, so that the first timings don't
+    # include loading the parser and writers.
+    for (name, make_translator) in WRITERS:
+        time_writer(generate(1024), make_translator)
+    temp_dir = tempfile.mkdtemp(prefix='rst2db-benchmark-')
+    try:
+        for profile in profiles:
+            for size in sizes:
+                text = generate(size, profile)
+                for (name, make_translator) in WRITERS:
+                    times = best_of(repeat, time_writer, text,
+                                    make_translator)
+                    results.append(dict(times, profile=profile, size=size,
+                                        target=name))
+                    report(results[-1])
+                if not run_tools:
+                    continue
+                input_filename = os.path.join(temp_dir, 'corpus.rst')
+                with open(input_filename, 'wb') as input_file:
+                    input_file.write(text.encode('utf-8'))
+                for (name, module) in TOOLS:
+                    elapsed = best_of(repeat, time_tool, module,
+                            input_filename, os.path.join(temp_dir, 'output'))
+                    results.append({'profile': profile, 'size': size,
+                                    'target': name, 'total': elapsed})
+                    report(results[-1])
+    finally:
+        shutil.rmtree(temp_dir)
+    return results
+
+
+def get_total(result):
+    if 'total' in result:
+        return result['total']
+    return result['parse'] + result['translate'] + result['serialise']
+
+
+def report(result):
+    line = "%-10s %-8s %10d KB  %8.3f s" % (result['profile'],
+            result['target'], result['size'] // 1024, get_total(result))
+    if 'parse' in result:
+        line += "  (parse %.3f, translate %.3f, serialise %.3f)" % (
+                result['parse'], result['translate'], result['serialise'])
+    print(line)
+
+
+def check_scaling(results):
+    """Returns a list of (profile, target, ratio) for every profile and
+    target, comparing the time per kilobyte of the largest and smallest
+    documents."""
+    groups = {}
+    for result in results:
+        key = (result['profile'], result['target'])
+        groups.setdefault(key, []).append(result)
+    scaling = []
+    for key in sorted(groups):
+        group = sorted(groups[key], key=lambda r: r['size'])
+        if len(group) < 2:
+            continue
+        (smallest, largest) = (group[0], group[-1])
+        ratio = ((get_total(largest) / largest['size']) /
+                 (get_total(smallest) / smallest['size']))
+        scaling.append((key[0], key[1], ratio))
+    return scaling
+
+
+def compare(results, baseline_filename):
+    """Prints the change in each result since the baseline."""
+    with open(baseline_filename) as baseline_file:
+        baseline = json.load(baseline_file)
+    old_totals = {}
+    for result in baseline['results']:
+        old_totals[(result['profile'], result['target'], result['size'])] = \
+                get_total(result)
+    print("\nCompared with %s (%s):" % (baseline_filename,
+                                        baseline.get('commit')))
+    for result in results:
+        key = (result['profile'], result['target'], result['size'])
+        if key in old_totals and old_totals[key] > 0:
+            print("%-10s %-8s %10d KB  %+7.1f%%" % (key[0], key[1],
+                    key[2] // 1024,
+                    (get_total(result) / old_totals[key] - 1) * 100))
+
+
+def get_commit():
+    try:
+        output = subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                         cwd=TOP_DIR)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return output.decode('ascii').strip()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+            description="Benchmarks the rst2db writers and tools.")
+    parser.add_argument('--sizes', default=DEFAULT_SIZES,
+            help="comma-separated document sizes (default: %s)" %
+                 DEFAULT_SIZES)
+    parser.add_argument('--profiles', default=','.join(sorted(PROFILES)),
+            help="comma-separated corpus profiles (default: all of them)")
+    parser.add_argument('--repeat', type=int, default=1,
+            help="run each benchmark this many times, keeping the fastest")
+    parser.add_argument('--no-cli', action='store_true',
+            help="don't time the command-line tools")
+    parser.add_argument('-o', '--output',
+            help="write the results to this JSON file")
+    parser.add_argument('--compare',
+            help="compare the results with this JSON file")
+    args = parser.parse_args()
+
+    sizes = sorted(parse_size(size) for size in args.sizes.split(','))
+    profiles = args.profiles.split(',')
+    for profile in profiles:
+        if profile not in PROFILES:
+            parser.error("unknown profile: %s" % profile)
+
+    results = run_benchmarks(sizes, profiles, args.repeat, not args.no_cli)
+    scaling = check_scaling(results)
+    failed = False
+    print("\nLargest/smallest time per KB:")
+    for (profile, target, ratio) in scaling:
+        status = 'ok'
+        if ratio > MAX_RATIO:
+            status = 'FAIL: not linear'
+            failed = True
+        print("%-10s %-8s %6.2f  %s" % (profile, target, ratio, status))
+
+    if args.output:
+        data = {'commit': get_commit(),
+                'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'python': platform.python_version(),
+                'docutils': docutils.__version__,
+                'lxml': lxml.etree.__version__,
+                'platform': platform.platform(),
+                'results': results,
+                'scaling': [{'profile': p, 'target': t, 'ratio': r}
+                            for (p, t, r) in scaling]}
+        with open(args.output, 'w') as output_file:
+            json.dump(data, output_file, indent=2, sort_keys=True)
+
+    if args.compare:
+        compare(results, args.compare)
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+#
+# ####################
+# benchmarks.traversal
+# ####################
+#
+# Compares docutils' Node.walkabout() with abstrys.docutils_ext.traversal's
+# walkabout(), translating the same doctree with each of the translators.
+#
+# Usage::
+#
+#  python -m benchmarks.traversal [--size 5M] [--profile mixed] [--repeat 3]
+#                                 [--depth 5000]
+#
+# The best time of each is reported, along with the number of nodes in the
+# doctree. A translator that does nothing is timed too, to show the cost of
+# the traversal and dispatch alone.
+#
+# Each translator is then given a doctree of sections nested --depth levels
+# deep, which is more than Python's recursion limit allows walkabout() to
+# walk.
+#
+
+import argparse
+import sys
+import time
+
+from abstrys.cache import parse_size
+from abstrys.docutils_ext.docbook_writer import DocBookTranslator
+from abstrys.docutils_ext.markdown_writer import MarkdownTranslator
+from abstrys.docutils_ext.traversal import walkabout
+from benchmarks.corpus import PROFILES, generate
+from docutils import nodes
+from docutils.core import publish_doctree
+
+
+class NullTranslator(nodes.SparseNodeVisitor):
+    """A translator whose handlers do nothing."""
+    pass
+
+
+TRANSLATORS = [
+    ('null', lambda doctree: NullTranslator(doctree)),
+    ('docbook', lambda doctree: DocBookTranslator(doctree, 'section', 'id')),
+    ('markdown', lambda doctree: MarkdownTranslator(doctree)),
+    ]
+
+
+def docutils_walkabout(doctree, make_translator):
+    doctree.walkabout(make_translator(doctree))
+
+
+def table_walkabout(doctree, make_translator):
+    walkabout(doctree, make_translator(doctree))
+
+
+def make_deep_doctree(depth):
+    """Returns a doctree of sections nested depth levels deep, each with a
+    title and a paragraph."""
+    doctree = publish_doctree('', settings_overrides={'report_level': 5})
+    parent = doctree
+    for i in range(depth):
+        section = nodes.section(ids=['level-%d' % i])
+        section += nodes.title(text='Level %d' % i)
+        section += nodes.paragraph(text='Section %d of %d.' % (i + 1, depth))
+        parent += section
+        parent = section
+    return doctree
+
+
+def time_deep_walkabout(func, doctree, make_translator):
+    """Returns a description of the time taken to walk the doctree with
+    func, or of the RecursionError raised."""
+    start = time.time()
+    try:
+        func(doctree, make_translator)
+    except RuntimeError:
+        # RecursionError is a RuntimeError, and only exists in Python 3.
+        return "%9s" % "too deep"
+    return "%7.3f s" % (time.time() - start)
+
+
+def best_of(repeat, func, *args):
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        func(*args)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(
+            description="Compares the translators' traversal with docutils' "
+                        "walkabout().")
+    parser.add_argument('--size', default='5M',
+            help="the size of the generated document (default: 5M)")
+    parser.add_argument('--profile', default='mixed', choices=sorted(PROFILES),
+            help="the kind of document to generate (default: mixed)")
+    parser.add_argument('--repeat', type=int, default=3,
+            help="time each traversal this many times, keeping the fastest")
+    parser.add_argument('--depth', type=int, default=5000,
+            help="how deeply to nest the sections of the deep doctree "
+                 "(default: 5000)")
+    args = parser.parse_args()
+
+    doctree = publish_doctree(generate(parse_size(args.size), args.profile),
+                              settings_overrides={'report_level': 5})
+    # findall() replaced traverse() in docutils 0.18.
+    findall = getattr(doctree, 'findall', doctree.traverse)
+    print("%d nodes" % len(list(findall())))
+    for (name, make_translator) in TRANSLATORS:
+        old_time = best_of(args.repeat, docutils_walkabout, doctree,
+                           make_translator)
+        new_time = best_of(args.repeat, table_walkabout, doctree,
+                           make_translator)
+        print("%-10s docutils: %7.3f s   abstrys: %7.3f s   (%.2fx)" %
+              (name, old_time, new_time, old_time / new_time))
+
+    doctree = make_deep_doctree(args.depth)
+    print("%d levels deep (recursion limit: %d)" %
+          (args.depth, sys.getrecursionlimit()))
+    for (name, make_translator) in TRANSLATORS:
+        print("%-10s docutils: %s   abstrys: %s" %
+              (name,
+               time_deep_walkabout(docutils_walkabout, doctree,
+                                   make_translator),
+               time_deep_walkabout(table_walkabout, doctree,
+                                   make_translator)))
+
+
+if __name__ == "__main__":
+    main()
@@ -35,11 +35,12 @@ setup(name='rst2db',
         A reStructuredText to MarkDown converter using Python's docutils.""",
       version='1.1',
       install_requires=['docutils>=0.12', 'lxml>=2.3'],
-      packages=find_packages(),
+      packages=find_packages(exclude=['benchmarks', 'benchmarks.*']),
       entry_points={
           'console_scripts': [
               'rst2db = abstrys.cmd_rst2db:run',
               'rst2md = abstrys.cmd_rst2md:run',
+              'abstrys = abstrys.__main__:main',
               ],
           },
       author='Eron Hennessey',
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+#
+# Tests for the DocBook writer, run with ``python -m pytest`` (or
+# ``python -m unittest discover tests``) from the top of the repository.
+#
+
+import os
+import subprocess
+import sys
+import unittest
+
+import lxml.etree as etree
+from docutils.core import publish_string
+
+from abstrys.docutils_ext.docbook_writer import (XML_ID, DocBookWriter,
+                                                   get_document_xml_id)
+
+
+TOP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TEST_TOPIC = os.path.join(TOP_DIR, 'testfiles', 'test_topic.rst')
+
+DOCBOOK_NS = '{http://docbook.org/ns/docbook}'
+
+
+def convert(source, root_element='section', document_id=None,
+            source_path=None):
+    """Converts reST source (as text) to DocBook, returning the root
+    element of the parsed output."""
+    output = publish_string(source, source_path=source_path,
+            writer=DocBookWriter(root_element, document_id),
+            settings_overrides={'output_encoding': 'utf-8',
+                                'doctitle_xform': False})
+    return etree.fromstring(output)
+
+
+class DocBookWriterTest(unittest.TestCase):
+
+    def test_convert_test_topic(self):
+        with open(TEST_TOPIC, 'rb') as f:
+            source = f.read().decode('utf-8')
+        root = convert(source, document_id='test_topic',
+                       source_path=TEST_TOPIC)
+        self.assertEqual(root.tag, DOCBOOK_NS + 'section')
+        self.assertEqual(root.get(XML_ID), 'test_topic')
+        self.assertEqual(root.find(DOCBOOK_NS + 'title').text,
+                         'My Test Topic')
+
+    def test_image_attributes(self):
+        root = convert(u"Title\n=====\n\n.. image:: picture.png\n"
+                       u"   :scale: 50\n")
+        imagedata = root.find('.//' + DOCBOOK_NS + 'imagedata')
+        self.assertEqual(imagedata.get('fileref'), 'picture.png')
+        self.assertEqual(imagedata.get('scale'), '50')
+
+    def test_links_to_section_ids_use_the_written_id(self):
+        # the section has its own ID ('sub') and the label's; only the label
+        # is written, so links to either are made to it.
+        root = convert(u"Title\n=====\n\nLinks to `Sub`_ and label_.\n\n"
+                       u".. _label:\n\nSub\n---\n\nText.\n")
+        section = root.find(DOCBOOK_NS + 'section')
+        self.assertEqual(section.get(XML_ID), 'label')
+        self.assertEqual([link.get('linkend')
+                          for link in root.iter(DOCBOOK_NS + 'link')],
+                         ['label', 'label'])
+
+    def test_document_ids_of_documents_in_subdirectories(self):
+        # the slash in a document's name can't be used in an xml:id.
+        self.assertEqual(get_document_xml_id('sub/page'), 'sub-page')
+        self.assertEqual(get_document_xml_id('1st'), '_1st')
+        root = convert(u"Page\n====\n\nText.\n", 'chapter', 'sub/page')
+        self.assertEqual(root.get(XML_ID), 'sub-page')
+
+    def test_rst2db_command(self):
+        # run in a fresh interpreter, as the command-line tool is.
+        output = subprocess.check_output(
+                [sys.executable, '-m', 'abstrys', 'db', TEST_TOPIC],
+                cwd=TOP_DIR)
+        root = etree.fromstring(output)
+        self.assertEqual(root.tag, DOCBOOK_NS + 'section')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+#
+# Tests that the command-line tools start without loading the modules that
+# are only needed to convert, run with ``python -m pytest`` (or
+# ``python -m unittest discover tests``) from the top of the repository.
+# See benchmarks/import_time.py for the timings.
+#
+
+import os
+import subprocess
+import sys
+import unittest
+
+TOP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# the modules that showing the usage mustn't load.
+HEAVY_MODULES = ['docutils.core', 'lxml.etree',
+                 'abstrys.docutils_ext.docbook_writer',
+                 'abstrys.docutils_ext.markdown_writer']
+
+
+def get_imported_modules(args):
+    """Runs python -X importtime with args in a new process, returning the
+    names of the modules it imported."""
+    process = subprocess.Popen([sys.executable, '-X', 'importtime'] + args,
+                               cwd=TOP_DIR, stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE)
+    (stdout, stderr) = process.communicate()
+    modules = set()
+    for line in stderr.decode('utf-8', 'replace').splitlines():
+        if line.startswith('import time:'):
+            modules.add(line.split('|')[-1].strip())
+    return modules
+
+
+@unittest.skipIf(sys.version_info < (3, 7), "-X importtime needs Python 3.7")
+class ImportTimeTest(unittest.TestCase):
+
+    def test_usage_does_not_load_heavy_modules(self):
+        modules = get_imported_modules(['-m', 'abstrys', 'db', '-h'])
+        # make sure the output was understood.
+        self.assertIn('abstrys.cmd_rst2db', modules)
+        for module in HEAVY_MODULES:
+            self.assertNotIn(module, modules)
+
+
+if __name__ == '__main__':
+    unittest.main()
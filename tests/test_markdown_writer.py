@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+#
+# Tests for the Markdown writer, run with ``python -m pytest`` (or
+# ``python -m unittest discover tests``) from the top of the repository.
+#
+
+import sys
+import unittest
+
+from docutils import nodes
+from docutils.core import publish_doctree
+
+from abstrys.docutils_ext.markdown_writer import (MarkdownTranslator,
+        get_anchors)
+from abstrys.docutils_ext.traversal import walkabout
+
+
+def make_deep_doctree(depth):
+    """Returns a doctree of sections nested depth levels deep."""
+    doctree = publish_doctree('', settings_overrides={'report_level': 5})
+    parent = doctree
+    for i in range(depth):
+        section = nodes.section(ids=['level-%d' % i])
+        section += nodes.title(text='Level %d' % i)
+        parent += section
+        parent = section
+    return doctree
+
+
+class DeepDocumentTest(unittest.TestCase):
+
+    depth = sys.getrecursionlimit() * 2
+
+    def test_get_anchors(self):
+        anchors = get_anchors(make_deep_doctree(self.depth))
+        self.assertEqual(len(anchors), self.depth)
+        self.assertEqual(anchors['level-%d' % (self.depth - 1)],
+                         'level-%d' % (self.depth - 1))
+
+    def test_translate(self):
+        doctree = make_deep_doctree(self.depth)
+        translator = MarkdownTranslator(doctree)
+        walkabout(doctree, translator)
+        self.assertIn('Level %d' % (self.depth - 1), translator.astext())
+
+
+TABLE_SOURCE = u"""\
+Intro.
+
+Section
+-------
+
++--------------+-------------------+
+| Name         | Value             |
++==============+===================+
+| *emphasis*   | ``a | b``         |
++--------------+-------------------+
+| `Section`_   | first paragraph   |
+|              |                   |
+|              | second paragraph  |
++--------------+-------------------+
+"""
+
+
+class ChunkedFile(object):
+    """Keeps each piece of output written to it."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(data)
+
+
+class TableTest(unittest.TestCase):
+
+    def test_cells_keep_inline_markup(self):
+        doctree = publish_doctree(TABLE_SOURCE)
+        translator = MarkdownTranslator(doctree)
+        walkabout(doctree, translator)
+        output = translator.astext()
+        self.assertIn(u'| *emphasis*', output)
+        self.assertIn(u'| `a \\| b`', output)
+        self.assertIn(u'| [Section](#section)', output)
+        self.assertIn(u'| first paragraph second paragraph |', output)
+
+    def test_rows_are_streamed_one_at_a_time(self):
+        # a table without a header is given an empty one.
+        doctree = publish_doctree(u"Intro.\n\n+-----+---+\n| a   | b |\n"
+                                  u"+-----+---+\n| ccc | d |\n+-----+---+\n")
+        output_file = ChunkedFile()
+        walkabout(doctree, MarkdownTranslator(doctree,
+                                              output_file=output_file))
+        self.assertEqual([chunk for chunk in output_file.chunks
+                          if chunk.startswith(b'|')],
+                         [b'|     |     |\n', b'| --- | --- |\n',
+                          b'| a   | b   |\n', b'| ccc | d   |\n'])
+
+
+if __name__ == '__main__':
+    unittest.main()
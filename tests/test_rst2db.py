@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+#
+# Tests for rst2db's converter, run with ``python -m pytest`` (or
+# ``python -m unittest discover tests``) from the top of the repository.
+#
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from abstrys.batch import run_batch
+from abstrys.cache import DEFAULT_MAX_SIZE
+from abstrys.cmd_rst2db import DocBookConverter
+
+
+TOP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TEST_TOPIC = os.path.join(TOP_DIR, 'testfiles', 'test_topic.rst')
+
+DANGLING_LINK_SOURCE = b"""\
+Title
+=====
+
+A link to `nowhere`__.
+
+__ _nowhere
+"""
+
+
+def make_params(**params):
+    defaults = {'root_element': 'section', 'template_filename': None,
+                'cache_dir': None, 'cache_limit': DEFAULT_MAX_SIZE,
+                'link_index': False}
+    defaults.update(params)
+    return defaults
+
+
+class CapturedStderr(object):
+    """Collects what's written to stderr while it's in use."""
+
+    def __enter__(self):
+        self.saved = sys.stderr
+        self.lines = []
+        sys.stderr = self
+        return self
+
+    def write(self, text):
+        self.lines.append(text)
+
+    def flush(self):
+        pass
+
+    def __exit__(self, *exc_info):
+        sys.stderr = self.saved
+
+    def getvalue(self):
+        return ''.join(self.lines)
+
+
+class LinkIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.input_filename = os.path.join(self.temp_dir, 'doc.rst')
+        with open(self.input_filename, 'wb') as f:
+            f.write(DANGLING_LINK_SOURCE)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def convert(self, converter):
+        output_filename = os.path.join(self.temp_dir, 'out', 'doc.xml')
+        with CapturedStderr() as stderr:
+            converter.convert_file(self.input_filename, output_filename)
+        return stderr.getvalue()
+
+    def test_links_checked_on_cache_hit(self):
+        params = make_params(link_index=True,
+                             cache_dir=os.path.join(self.temp_dir, 'cache'))
+        first = self.convert(DocBookConverter(params))
+        second = self.convert(DocBookConverter(params))
+        self.assertIn('link to a missing ID: nowhere', first)
+        self.assertEqual(first, second)
+
+
+class StreamingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def convert(self, input_filename, stream_output):
+        # the output file has the same name either way, since the root
+        # element's ID is taken from it.
+        output_filename = os.path.join(self.temp_dir,
+                'streamed' if stream_output else 'buffered', 'doc.xml')
+        converter = DocBookConverter(make_params(stream_output=stream_output))
+        converter.convert_file(input_filename, output_filename)
+        with open(output_filename, 'rb') as f:
+            return f.read()
+
+    def test_streamed_output_matches_buffered_output(self):
+        self.assertEqual(self.convert(TEST_TOPIC, True),
+                         self.convert(TEST_TOPIC, False))
+
+    def test_failed_conversion_leaves_no_output(self):
+        input_filename = os.path.join(self.temp_dir, 'doc.rst')
+        with open(input_filename, 'wb') as f:
+            f.write(b'Title\n=====\n\nText.\n\n.. include:: missing.rst\n')
+        for stream_output in [True, False]:
+            with CapturedStderr():
+                self.assertRaises((Exception, SystemExit), self.convert,
+                                  input_filename, stream_output)
+        self.assertEqual(sorted(os.listdir(self.temp_dir)),
+                         ['buffered', 'doc.rst', 'streamed'])
+        self.assertEqual(os.listdir(os.path.join(self.temp_dir, 'streamed')),
+                         [])
+        self.assertEqual(os.listdir(os.path.join(self.temp_dir, 'buffered')),
+                         [])
+
+
+class ImageCopyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        with open(os.path.join(self.temp_dir, 'picture.png'), 'wb') as f:
+            f.write(b'not really a picture')
+        self.jobs = []
+        for name in ['a', 'b', 'c']:
+            input_filename = os.path.join(self.temp_dir, name + '.rst')
+            with open(input_filename, 'wb') as f:
+                f.write(b'Title\n=====\n\n.. image:: picture.png\n')
+            self.jobs.append((input_filename, os.path.join(
+                    self.temp_dir, 'out', name + '.xml')))
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_parallel_run_saves_digests(self):
+        # the workers hash the image; the main process copies it once and
+        # saves the hashes.
+        cache_dir = os.path.join(self.temp_dir, 'cache')
+        params = make_params(copy_images=True, cache_dir=cache_dir,
+                output_dir=os.path.join(self.temp_dir, 'out'))
+        self.assertEqual(run_batch(DocBookConverter(params), self.jobs, 2), 0)
+        self.assertEqual(len(os.listdir(os.path.join(self.temp_dir, 'out',
+                                                     '_images'))), 1)
+        self.assertTrue(os.path.exists(os.path.join(cache_dir,
+                                                    'image_digests.json')))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+#
+# Tests for the conversion server, run with ``python -m pytest`` (or
+# ``python -m unittest discover tests``) from the top of the repository.
+#
+
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import unittest
+
+from abstrys.cache import DEFAULT_MAX_SIZE
+from abstrys.client import ConversionClient
+from abstrys.server import serve
+
+
+@unittest.skipUnless(hasattr(socket, 'AF_UNIX'), "needs Unix domain sockets")
+class ServerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.socket_path = os.path.join(self.temp_dir, 'abstrys.sock')
+        self.thread = threading.Thread(target=serve, args=({
+                'socket_path': self.socket_path, 'cache_dir': None,
+                'cache_limit': DEFAULT_MAX_SIZE},))
+        self.thread.daemon = True
+        self.thread.start()
+        self.clients = []
+
+    def tearDown(self):
+        for client in self.clients:
+            client.close()
+        self.thread.join(10)
+        shutil.rmtree(self.temp_dir)
+
+    def connect(self):
+        # the server warms up before it listens.
+        for i in range(100):
+            try:
+                client = ConversionClient(self.socket_path)
+                break
+            except (IOError, OSError):
+                time.sleep(0.1)
+        else:
+            client = ConversionClient(self.socket_path)
+        # a request that isn't answered fails the test rather than hanging.
+        client.socket.settimeout(10)
+        self.clients.append(client)
+        return client
+
+    def test_open_connection_does_not_block_others(self):
+        idle = self.connect()
+        self.assertTrue(idle.request({'command': 'ping'})['ok'])
+        busy = self.connect()
+        response = busy.request({'format': 'md',
+                                 'input': u'Title\n=====\n\nText.\n'})
+        self.assertTrue(response['ok'])
+        self.assertIn(u'Text.', response['output'])
+        self.assertTrue(busy.request({'command': 'shutdown'})['ok'])
+        self.thread.join(10)
+        self.assertFalse(self.thread.is_alive())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+#
+# Tests for the translators' traversal, run with ``python -m pytest`` (or
+# ``python -m unittest discover tests``) from the top of the repository.
+#
+
+import sys
+import unittest
+
+from docutils import nodes
+from docutils.core import publish_doctree
+from docutils.io import StringOutput
+
+from abstrys.docutils_ext.docbook_writer import DocBookWriter
+from abstrys.docutils_ext.markdown_writer import MarkdownWriter
+from abstrys.docutils_ext.traversal import walkabout
+
+
+def new_document():
+    return publish_doctree(u'', settings_overrides={'report_level': 5})
+
+
+def nest_sections(parent, depth):
+    for i in range(depth):
+        section = nodes.section(ids=['section-%d' % i])
+        section += nodes.title(text=u'Section %d' % i)
+        parent += section
+        parent = section
+    return parent
+
+
+def nest_block_quotes(parent, depth):
+    for i in range(depth):
+        quote = nodes.block_quote()
+        quote += nodes.paragraph(text=u'Quote %d' % i)
+        parent += quote
+        parent = quote
+    return parent
+
+
+def nest_lists(parent, depth):
+    for i in range(depth):
+        bullet_list = nodes.bullet_list(bullet=u'*')
+        item = nodes.list_item()
+        item += nodes.paragraph(text=u'Item %d' % i)
+        bullet_list += item
+        parent += bullet_list
+        parent = item
+    return parent
+
+
+def make_deep_doctree(kind, depth):
+    """Returns a doctree with sections, block quotes or lists nested depth
+    levels deep, inside a section."""
+    doctree = new_document()
+    parent = nest_sections(doctree, 1)
+    parent = {'section': nest_sections, 'block_quote': nest_block_quotes,
+              'list': nest_lists}[kind](parent, depth)
+    parent += nodes.paragraph(text=u'The bottom.')
+    return doctree
+
+
+class DeepDocumentTest(unittest.TestCase):
+    """The writers walk doctrees nested deeper than Python's recursion
+    limit, which docutils' own walkabout() can't."""
+
+    depth = sys.getrecursionlimit() + 100
+
+    def write(self, writer, kind):
+        doctree = make_deep_doctree(kind, self.depth)
+        output = writer.write(doctree, StringOutput(encoding='utf-8'))
+        return output.decode('utf-8')
+
+    def test_docbook_writer(self):
+        for kind in ['section', 'block_quote', 'list']:
+            output = self.write(DocBookWriter('section', 'deep'), kind)
+            self.assertIn(u'bottom.', output)
+
+    def test_markdown_writer(self):
+        for kind in ['section', 'block_quote', 'list']:
+            output = self.write(MarkdownWriter(), kind)
+            self.assertIn(u'bottom.', output)
+
+
+class RecordingVisitor(nodes.NodeVisitor):
+    """Records each node visited and departed, raising the exception given
+    for a (phase, label) pair when it's reached."""
+
+    def __init__(self, document, raises=None):
+        nodes.NodeVisitor.__init__(self, document)
+        self.raises = raises or {}
+        self.log = []
+
+    def _record(self, phase, node):
+        if isinstance(node, nodes.Text):
+            label = node.astext()
+        else:
+            names = node.get('names')
+            label = names[0] if names else node.tagname
+        self.log.append((phase, label))
+        exception = self.raises.get((phase, label))
+        if exception is not None:
+            raise exception()
+
+    def unknown_visit(self, node):
+        self._record('visit', node)
+
+    def unknown_departure(self, node):
+        self._record('depart', node)
+
+
+def make_small_doctree():
+    """Returns a small doctree in which every element has a name of its own,
+    nested a few levels deep, with siblings at each level."""
+    doctree = new_document()
+
+    def element(name, *children):
+        node = nodes.Element(names=[name])
+        node.extend(children)
+        return node
+    doctree += element('a',
+                       element('b', nodes.Text(u'b1'), nodes.Text(u'b2')),
+                       element('c',
+                               element('d', nodes.Text(u'd1')),
+                               element('e'),
+                               element('f', nodes.Text(u'f1'))),
+                       element('g'))
+    doctree += element('h', nodes.Text(u'h1'))
+    return doctree
+
+
+def run_walk(walk, raises):
+    """Walks the small doctree, returning the visitor's log and the result:
+    the return value, or the class of the exception that got out."""
+    doctree = make_small_doctree()
+    visitor = RecordingVisitor(doctree, raises)
+    try:
+        result = walk(doctree, visitor)
+    except nodes.TreePruningException as e:
+        result = e.__class__
+    return (visitor.log, result)
+
+
+class WalkaboutSemanticsTest(unittest.TestCase):
+    """walkabout() handles the tree-pruning exceptions exactly as
+    Node.walkabout() does, wherever they're raised."""
+
+    exceptions = [nodes.SkipNode, nodes.SkipChildren, nodes.SkipDeparture,
+                  nodes.SkipSiblings, nodes.StopTraversal]
+
+    def test_without_exceptions(self):
+        self.assertEqual(run_walk(walkabout, {}),
+                         run_walk(nodes.Node.walkabout, {}))
+
+    def test_exceptions(self):
+        (log, result) = run_walk(walkabout, {})
+        for (phase, label) in log:
+            for exception in self.exceptions:
+                raises = {(phase, label): exception}
+                self.assertEqual(run_walk(walkabout, raises),
+                                 run_walk(nodes.Node.walkabout, raises),
+                                 "%s raised by %s %s" %
+                                 (exception.__name__, phase, label))
+
+    def test_exceptions_at_two_levels(self):
+        # an exception raised while another is still being handled above.
+        for exception in self.exceptions:
+            for other in self.exceptions:
+                raises = {('visit', 'd1'): exception,
+                          ('depart', 'c'): other}
+                self.assertEqual(run_walk(walkabout, raises),
+                                 run_walk(nodes.Node.walkabout, raises),
+                                 "%s then %s" % (exception.__name__,
+                                                 other.__name__))
+
+
+if __name__ == '__main__':
+    unittest.main()
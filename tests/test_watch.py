@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+#
+# Tests for watch mode, run with ``python -m pytest`` (or
+# ``python -m unittest discover tests``) from the top of the repository.
+#
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from abstrys.batch import get_batch_jobs, get_search_paths
+from abstrys.cache import DEFAULT_MAX_SIZE
+from abstrys.cmd_rst2md import MarkdownConverter
+from abstrys.watch import Watcher
+
+
+class ScriptedMonitor(object):
+    """Stands in for a file monitor, running a function for each wait and
+    reporting the files it returns as changed. Interrupts the watcher when
+    there are no more."""
+
+    def __init__(self, steps):
+        self.steps = list(steps)
+        self.paths = []
+
+    def set_paths(self, paths):
+        self.paths = paths
+
+    def wait(self, timeout=None):
+        if timeout is not None:
+            # the burst of changes is over.
+            return set()
+        if not self.steps:
+            raise KeyboardInterrupt
+        return set(os.path.abspath(path) for path in self.steps.pop(0)())
+
+
+class WatcherTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.source_dir = os.path.join(self.temp_dir, 'src')
+        self.output_dir = os.path.join(self.temp_dir, 'out')
+        os.makedirs(self.source_dir)
+        self.write_source('a.rst')
+        self.params = {'input_filenames': [self.source_dir],
+                       'manifest_filename': None, 'includes': [],
+                       'excludes': [], 'output_dir': self.output_dir,
+                       'template_filename': None, 'cache_dir': None,
+                       'cache_limit': DEFAULT_MAX_SIZE}
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def write_source(self, name):
+        path = os.path.join(self.source_dir, name)
+        with open(path, 'w') as f:
+            f.write('Title\n=====\n\nText.\n')
+        return path
+
+    def test_new_documents_are_converted(self):
+        def add_document():
+            self.write_source('b.rst')
+            return [self.source_dir]
+
+        def find_jobs():
+            return (get_batch_jobs(self.params, '.md'),
+                    get_search_paths(self.params))
+        converter = MarkdownConverter(self.params)
+        watcher = Watcher(converter, get_batch_jobs(self.params, '.md'),
+                          monitor=ScriptedMonitor([add_document]),
+                          find_jobs=find_jobs)
+        watcher.run()
+        self.assertEqual(sorted(os.listdir(self.output_dir)),
+                         ['a.md', 'b.md'])
+        self.assertIn(os.path.abspath(os.path.join(self.source_dir, 'b.rst')),
+                      watcher.monitor.paths)
+
+
+if __name__ == '__main__':
+    unittest.main()